@@ -35,24 +35,16 @@ def extract_rows_qmd(
     """
     api = GristApi()
 
-    # Download data to filter urls
-    logger.info(f"Début du téléchargement de la table Grist cible {input_table}")
-    veille_df = (
-        api.fetch_table_pl(table_id=input_table)
-    )
-    logger.info(
-        f"Table Grist cible {input_table} téléchargée, nombre de lignes : {len(veille_df)}"
-    )
-
-    # Filter new articles in former Grist table
-    logger.info("Filtrer les lignes à insérer dans la veille")
-    veille_df = (
-        veille_df
-        .filter(
-            pl.col("A_garder"), pl.col("Lien_veille") == ""
-        )
+    # Download the rows kept (A_garder) and not yet in a veille (Lien_veille empty)
+    logger.info(f"Début du téléchargement des lignes à garder de la table Grist cible {input_table}")
+    veille_df = api.fetch_table_pl(
+        table_id=input_table, filter={"A_garder": [True], "Lien_veille": [""]}
     )
     logger.info(f"Nombre de lignes à garder sans veille renseignée: {len(veille_df)}")
+    if len(veille_df) == 0:
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write("")
+        return ""
 
     # Update categories with labels and not ids
     logger.info("Remplacement des catégories")
@@ -73,4 +65,4 @@ def extract_rows_qmd(
 
     logger.info("Remplacement des catégories effectué")
 
-    return create_veille_qmd(veille_df, output_path, logger)
+    return create_veille_qmd(veille_df, output_path, logger, api=api)
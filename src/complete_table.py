@@ -1,12 +1,24 @@
-from src.utils.access_grist_api import GristApi
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from src.utils.access_grist_api import GristApi, UpdateBuffer
+from src.utils.host_scheduler import HostScheduler
+from src.utils.link_health import LinkHealth
+from src.utils.llm_client import LLMCache, pool_summary, token_usage
 from src.utils.logging import setup_logging
+from src.utils.page_cache import PageCache
+from src.utils.pipeline import Stage, run_pipeline, stage_summary
 from src.data.complete_veille import (
     formula_target_columns,
     build_category_examples,
     build_category_ref_maps,
     category_vocabulary,
+    find_canonical_duplicates,
+    interleave_by_host,
     select_rows,
-    process_row,
+    fetch_row,
+    analysis_source,
+    analyse_row,
     now_stamp
 )
 from src.utils.config import (
@@ -16,7 +28,9 @@ from src.utils.config import (
     COL_CATEGORY,
     COL_PROCESS,
     TABLE_RUBRIQUES,
-    DEFAULT_N_EXAMPLES
+    DEFAULT_N_EXAMPLES,
+    HOST_MAX_CONCURRENCY,
+    HOST_RATE,
 )
 
 
@@ -25,6 +39,18 @@ def complete_veille(
     limit=None,
     dry_run=False,
     n_examples=DEFAULT_N_EXAMPLES,
+    workers=1,
+    fetch_workers=None,
+    llm_workers=None,
+    page_cache=True,
+    offline=False,
+    llm_cache=True,
+    main_content=False,
+    parse_workers=None,
+    per_host=HOST_MAX_CONCURRENCY,
+    host_rate=HOST_RATE,
+    link_health=True,
+    hedge_llm=False,
     logger=None,
 ):
     """
@@ -35,6 +61,27 @@ def complete_veille(
         limit: optional cap on the number of rows processed (handy for testing).
         dry_run: compute everything but do NOT write back to Grist.
         n_examples: number of example category assignments sent to the LLM.
+        workers: number of rows handled at the same time by each stage (page
+            fetch, text extraction, LLM call); results come back in row order.
+        fetch_workers: concurrency of the page fetch stage (default: `workers`).
+        llm_workers: concurrency of the LLM stage (default: `workers`).
+        page_cache: keep the fetched pages on disk (`PageCache`) and reuse them
+            on the next runs instead of downloading them again.
+        offline: only use the cached pages, never fetch (implies `page_cache`).
+        llm_cache: keep the LLM answers on disk (`LLMCache`): a request already
+            answered, e.g. during a dry run, is not sent again.
+        main_content: send only the article body of each page to the LLM
+            (menus, banners, footers dropped), not the whole page text.
+        parse_workers: if set, the pages are parsed by that many processes
+            instead of the threads of the text stage (parsing is CPU-bound).
+        per_host: page requests in flight to one site, whatever `fetch_workers`.
+        host_rate: page requests per second to one site.
+        link_health: remember the dead links and sites on disk (`LinkHealth`)
+            and do not try them again before their failure expires; a site
+            failing repeatedly is skipped for the rest of the run.
+        hedge_llm: send an LLM call a second time when it is slower than most
+            recent ones, the first answer wins (a little more load on the
+            endpoints for a shorter run).
 
     Returns:
         the list of {"id", "fields"} updates that were (or would be) applied.
@@ -58,10 +105,15 @@ def complete_veille(
             f"[dry-run] colonnes formule detectees (non modifiables) : {blocked}"
         )
 
-    logger.info(f"Telechargement de la table Grist '{table_id}'")
-    df = api.fetch_table_pl(table_id)
-    rows = df.to_dicts()
-    logger.info(f"{len(rows)} lignes recuperees")
+    # Only the rows still to process come with all their columns; the other
+    # rows are only read for what they are used for (examples, duplicates).
+    logger.info(f"Telechargement des lignes a traiter de la table Grist '{table_id}'")
+    targets = select_rows(  # rows whose Traitement is empty
+        api.fetch_table_pl(
+            table_id, filter={COL_PROCESS: ["", "None", None]}, sort="id", limit=limit
+        ).to_dicts()
+    )
+    logger.info(f"{len(targets)} lignes a traiter (Traitement vide)")
 
     # The Categorie column references the Rubriques table; load it so we can show
     # the LLM real category names and write its answers back as Rubriques ids.
@@ -75,41 +127,140 @@ def complete_veille(
         rubriques_rows = []
     id_to_name, name_to_id = build_category_ref_maps(rubriques_rows)
     vocabulary = category_vocabulary(id_to_name)
-    examples = build_category_examples(rows, id_to_name, n=n_examples)
+    example_rows = api.fetch_table_pl(
+        table_id,
+        columns=[COL_TITLE, COL_RESUME, COL_CATEGORY],
+        where=(
+            f"COALESCE(\"{COL_CATEGORY}\", '') NOT IN ('', '[]') AND ("
+            f"COALESCE(\"{COL_TITLE}\", '') NOT IN ('', 'None') OR "
+            f"COALESCE(\"{COL_RESUME}\", '') NOT IN ('', 'None'))"
+        ),
+        sort="id",
+        limit=2 * n_examples,  # slack for ids no longer in Rubriques
+        list_columns=[COL_CATEGORY],
+    ).to_dicts()
+    examples = build_category_examples(example_rows, id_to_name, n=n_examples)
     logger.info(
         f"{len(vocabulary)} categories dans '{TABLE_RUBRIQUES}', "
         f"{len(examples)} exemples d'affectation"
     )
 
-    targets = select_rows(rows)  # rows whose Traitement is empty
-    if limit is not None:
-        targets = targets[:limit]
-    logger.info(f"{len(targets)} lignes a traiter (Traitement vide)")
+    # Same article behind another url (http/https, tracking parameters...)
+    duplicate_of = find_canonical_duplicates(
+        api.fetch_table_pl(table_id, columns=[COL_LINK]).to_dicts()
+    )
 
-    updates = []
-    for row in targets:
-        try:
-            fields = process_row(
-                row, vocabulary, examples, logger, id_to_name, name_to_id
+    # Each row goes through fetch -> text -> LLM -> write, each stage with its
+    # own workers; the bounded queues between them keep a fast stage from
+    # piling up pages while the LLM is busy. A row that is settled early
+    # (duplicate, no link, error) carries its `fields` through the next stages.
+    def fetch(job):
+        job["fields"], job["url"], job["html"] = fetch_row(
+            job["row"], logger, duplicate_of.get(job["row"].get("id")), cache, scheduler, health
+        )
+        return job
+
+    def extract(job):
+        if job["fields"] is None:
+            html = job.pop("html")
+            job["source"] = analysis_source(
+                job["row"], job["url"], html, logger, main_content, parse_pool, prompt_sizes
             )
-        except Exception as exc:  # never let one row kill the batch
-            logger.error(f"[id {row.get('id')}] erreur inattendue : {exc}")
-            fields = {COL_PROCESS: f"ERREUR : {exc} - {now_stamp()}"}
+        return job
 
-        update = {"id": row.get("id"), "fields": fields}
-        updates.append(update)
+    def analyse(job):
+        if job["fields"] is None:
+            source = job.pop("source")
+            job["fields"] = analyse_row(
+                job["row"], job["url"], source, vocabulary, examples, logger,
+                id_to_name, name_to_id, answers, hedge_llm,
+            )
+            if source is not None:
+                analysed.append(job["index"])
+        return job
 
-        if dry_run:
-            logger.info(f"[dry-run] [id {update['id']}] {fields}")
-            continue
+    updates = [None] * len(targets)
+    prompt_sizes = []  # (whole page text, main content) lengths, with main_content
+    analysed = []  # rows that went through the LLM
+    usage_before = token_usage()
 
-        resp = api.update_records(table_id, json={"records": [update]})
-        if resp.status_code == 200:
-            logger.info(f"[id {update['id']}] mis a jour")
+    def write(job):
+        update = {"id": job["row"].get("id"), "fields": job["fields"]}
+        updates[job["index"]] = update
+        if dry_run:
+            logger.info(f"[dry-run] [id {update['id']}] {update['fields']}")
         else:
-            logger.error(
-                f"[id {update['id']}] echec maj ({resp.status_code}): {resp.text[:200]}"
-            )
+            buffer.add(update)
+        return job
+
+    def on_error(job, stage, exc):  # never let one row kill the batch
+        logger.error(f"[id {job['row'].get('id')}] erreur inattendue ({stage.name}) : {exc}")
+        job["fields"] = {COL_PROCESS: f"ERREUR : {exc} - {now_stamp()}"}
+        job.pop("html", None)
+        return job
 
+    stages = [
+        Stage("fetch", fetch, workers=fetch_workers or workers),
+        # with processes, one thread per process keeps them all busy
+        Stage("texte", extract, workers=parse_workers or workers),
+        Stage("llm", analyse, workers=llm_workers or workers),
+        Stage("ecriture", write),  # one writer: the buffer is not thread-safe
+    ]
+    cache = PageCache(offline=offline) if page_cache or offline else None
+    answers = LLMCache() if llm_cache else None
+    # spawn rather than fork: fork is unsafe with the threads already running
+    parse_pool = (
+        ProcessPoolExecutor(parse_workers, mp_context=get_context("spawn"))
+        if parse_workers else None
+    )
+    scheduler = HostScheduler(max_concurrency=per_host, rate=host_rate)
+    health = LinkHealth() if link_health and not offline else None
+    # Rows are fetched round-robin over the sites, results keep the row order
+    jobs = (
+        {"index": i, "row": targets[i], "fields": None} for i in interleave_by_host(targets)
+    )
+    # Updates are PATCHed by batches; the buffer writes what is left when the
+    # run ends, fails or is interrupted (Ctrl+C), so no LLM work is lost.
+    try:
+        with UpdateBuffer(api, table_id, logger) as buffer:
+            run_pipeline(jobs, stages, on_error=on_error)
+    finally:
+        if cache is not None:
+            cache.close()
+        if answers is not None:
+            answers.close()
+        if health is not None:
+            health.close()
+        if parse_pool is not None:
+            parse_pool.shutdown(cancel_futures=True)
+    updates = [update for update in updates if update is not None]
+
+    for line in stage_summary(stages):
+        logger.info(line)
+    if pool_summary() is not None:
+        logger.info(pool_summary())
+    usage = {name: count - usage_before[name] for name, count in token_usage().items()}
+    if analysed and usage["calls"]:
+        tokens = usage["prompt_tokens"] + usage["completion_tokens"]
+        logger.info(
+            f"LLM : {usage['calls']} appels pour {len(analysed)} lignes analysees "
+            f"({usage['calls'] / len(analysed):.2f} par ligne, reponses en cache non comptees), "
+            f"{tokens / len(analysed):.0f} tokens par ligne"
+        )
+    if health is not None and (health.skipped or health.down):
+        logger.info(
+            f"Liens connus KO : {health.skipped} liens non reessayes, "
+            f"{len(health.down)} sites hors service pour ce run {sorted(health.down)}"
+        )
+    if prompt_sizes:
+        whole = sum(size for size, _ in prompt_sizes)
+        main = sum(size for _, size in prompt_sizes)
+        logger.info(
+            f"Contenu principal : {main / len(prompt_sizes):.0f} caracteres envoyes au LLM "
+            f"par page au lieu de {whole / len(prompt_sizes):.0f} "
+            f"(-{1 - main / max(whole, 1):.0%} en moyenne sur {len(prompt_sizes)} pages)"
+        )
+    if buffer.failed:
+        logger.error(f"{len(buffer.failed)} lignes non ecrites dans Grist : {buffer.failed}")
     logger.info(f"Termine : {len(updates)} lignes traitees (dry_run={dry_run})")
     return updates
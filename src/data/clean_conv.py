@@ -1,61 +1,169 @@
 import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from multiprocessing import get_context
 
 import polars as pl
 
-from src.data.formatting_link import extract_link_title
-from src.utils.config import _INTERNAL_PREFIXES
+from src.data.formatting_link import canonical_url_pl, extract_links_pl
+from src.data.watermark import merge_watermark, skip_ingested
+from src.utils.config import _INTERNAL_PREFIXES, CONV_BATCH_SIZE, CONV_READ_SIZE
 
-def clean_conv(file_path):
+# Schema of the raw events pulled out of the export, so that every record batch
+# (and an empty export) gets the same column types.
+_CONV_SCHEMA = {
+    "body": pl.Utf8,
+    "formatted_body": pl.Utf8,
+    "event_id": pl.Utf8,
+    "origin_server_ts": pl.Int64,
+    "room_id": pl.Utf8,
+}
+
+_JSON_WS = " \t\n\r"
+_JSON_DECODER = json.JSONDecoder()
+
+
+class _JsonStream:
     """
-    Converts a json file extracted from Tchap to a database.
+    Minimal pull reader over a json file: reads it by chunks of `read_size`
+    characters and decodes one value at a time with `raw_decode`, so only the
+    value being decoded (plus one chunk) is held in memory.
+    """
+
+    def __init__(self, read_file, read_size=CONV_READ_SIZE):
+        self.read_file = read_file
+        self.read_size = read_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.read_file.read(self.read_size)
+        if not chunk:
+            self.eof = True
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+
+    def peek(self):
+        """Next non-whitespace character ('' at the end of the file)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _JSON_WS:
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos : self.pos + 1]
+            self._fill()
+
+    def expect(self, *chars):
+        """Consume the next structural character, which must be one of `chars`."""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(
+                f"Export Tchap mal forme : attendu {chars}, trouve {char!r} "
+                f"(position {self.pos})"
+            )
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode the next json value (object, list, string, number...)."""
+        self.peek()
+        while True:
+            try:
+                obj, end = _JSON_DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self._fill()  # value cut by the end of the chunk
+                continue
+            if end == len(self.buf) and not self.eof:
+                self._fill()  # a number may go on in the next chunk
+                continue
+            self.pos = end
+            return obj
+
+
+def iter_tchap_messages(file_path, read_size=CONV_READ_SIZE):
+    """
+    Yield the events of the `messages` array of a Tchap json export, one at a
+    time, without loading the whole file.
 
     Args:
-        file_path (string): path to json file to convert.
+        file_path (string): path to the json export.
+        read_size (int): number of characters read from the file at once.
 
     Returns:
-        A dataframe (pl.Df) with columns : ['link_text', 'hyperlink', 'msg_link', 'body', 'origin_server_ts']
-
-    Example:
-        >>> clean_conv('matrix - SSPLab - Veille - Chat Export - 2025-10-13T12-19-53.163Z.json')
-                                                     link_text  ... origin_server_ts
-        6    Linux a sa réponse à Microsoft Copilot, et ell...  ...       1754574677
+        A generator of event dicts, in the order of the export.
     """
     with open(file_path, mode="r") as read_file:
-        conv_tchap = json.load(read_file)
-
-    extracted_conv = []
-    for record in conv_tchap["messages"]:
-        extracted_msg = {
-            "body": record["content"].get(
-                "body", ""
-            ),  # To return "" when key not found
-            "formatted_body": record["content"].get(
-                "formatted_body", ""
-            ),  # To return "" when key not found
-            "event_id": record["event_id"],
-            "origin_server_ts": record["origin_server_ts"],
-            "room_id": record["room_id"],
-        }
-
-        extracted_conv.append(extracted_msg)
-
-    # Create a DataFrame
-    func_conv_df = pl.DataFrame(extracted_conv)
-
-    # Streamlining data
+        stream = _JsonStream(read_file, read_size)
+        stream.expect("{")
+        if stream.peek() == "}":
+            raise KeyError("messages")
+        while True:
+            key = stream.value()
+            stream.expect(":")
+            if key != "messages":
+                stream.value()  # room name, export date... not needed
+            else:
+                stream.expect("[")
+                if stream.peek() == "]":
+                    return
+                while True:
+                    yield stream.value()
+                    if stream.expect(",", "]") == "]":
+                        return
+            if stream.expect(",", "}") == "}":
+                raise KeyError("messages")
+
+
+def _extract_msg(record):
+    """Keep only the fields of a Tchap event that are used downstream."""
+    return {
+        "body": record["content"].get("body", ""),  # To return "" when key not found
+        "formatted_body": record["content"].get(
+            "formatted_body", ""
+        ),  # To return "" when key not found
+        "event_id": record["event_id"],
+        "origin_server_ts": record["origin_server_ts"],
+        "room_id": record["room_id"],
+    }
+
+
+def iter_conv_batches(file_path, batch_size=CONV_BATCH_SIZE, watermark=None, since=None):
+    """
+    Walk a Tchap export event by event and yield polars record batches of (at
+    most) `batch_size` messages, so that peak memory does not depend on the size
+    of the export.
+
+    Args:
+        file_path (string): path to json file to convert.
+        batch_size (int): number of messages per batch.
+        watermark, since: only the new events are kept, see `skip_ingested`.
+
+    Returns:
+        A generator of dataframes (pl.Df) with columns : ['body', 'formatted_body', 'event_id', 'origin_server_ts', 'room_id']
+    """
+    batch = []
+    for record in skip_ingested(iter_tchap_messages(file_path), watermark, since):
+        batch.append(_extract_msg(record))
+        if len(batch) >= batch_size:
+            yield pl.DataFrame(batch, schema=_CONV_SCHEMA)
+            batch = []
+    if batch:
+        yield pl.DataFrame(batch, schema=_CONV_SCHEMA)
+
+
+def _streamline_conv(func_conv_df, all_links=False, pool=None):
+    """Turn a batch of raw messages into the rows holding a link (per-message steps only)."""
     func_conv_df = (
-        func_conv_df.with_columns(
+        # Extract hyperlink : <a href="https://www.insee.fr">Le plus beau site du monde</a> -> https://www.insee.fr, Le plus beau site du monde
+        extract_links_pl(func_conv_df, "formatted_body", all_links=all_links, pool=pool)
+        .with_columns(
             msg_link=_INTERNAL_PREFIXES[0] + "#/room/"
             + pl.col("room_id")
             + "/"
             + pl.col("event_id"),  # Creating link to tchap msg
-            hyperlink=pl.col("formatted_body").map_elements(
-                lambda x: extract_link_title(x), return_dtype=pl.List(pl.Utf8)
-            ),  # Extract hyperlink : <a href="https://www.insee.fr">Le plus beau site du monde</a> -> [https://www.insee.fr, Le plus beau site du monde]
-        )
-        .with_columns(
-            hyperlink=pl.col("hyperlink").list.get(0),
-            link_text=pl.col("hyperlink").list.get(1),
         )
         .drop_nulls(subset="hyperlink")
         .with_columns(
@@ -64,6 +172,7 @@ def clean_conv(file_path):
             .otherwise("body"),  # If message is only a link, set body to ''
             origin_server_ts=pl.col("origin_server_ts")
             // 1000,  ## Changing time format from 13 to 10 digts
+            link_key=canonical_url_pl(pl.col("hyperlink")),  # Same article behind different urls
         )
     )
 
@@ -73,12 +182,67 @@ def clean_conv(file_path):
         "msg_link",
         "body",
         "origin_server_ts",
+        "link_key",
     ]
 
-    func_conv_df = func_conv_df.select(cols_to_keep)
+    return func_conv_df.select(cols_to_keep)
 
-    # Removing identical hyperlinks
-    func_conv_df = func_conv_df.unique("hyperlink", keep="first")
+
+def clean_conv(
+    file_path, batch_size=None, all_links=False, watermark=None, since=None, pool=None
+):
+    """
+    Converts a json file extracted from Tchap to a database.
+
+    Args:
+        file_path (string): path to json file to convert.
+        batch_size (int, optional): if set, the export is read incrementally,
+            `batch_size` messages at a time, instead of being loaded at once.
+            The result is the same; only peak memory changes.
+        all_links (bool): if True, every external link of a message becomes a
+            row, instead of only its first link.
+        watermark (dict, optional): last event already ingested per room (see
+            `src.data.watermark`). Older events are skipped before being parsed
+            and the marks are moved forward in place.
+        since (int, optional): unix time in ms; overrides `watermark`, only the
+            events from then on are kept.
+        pool (Executor, optional): process pool the html links that need
+            BeautifulSoup are parsed in (see `extract_links_pl`).
+
+    Returns:
+        A dataframe (pl.Df) with columns : ['link_text', 'hyperlink', 'msg_link', 'body', 'origin_server_ts', 'link_key'],
+        'link_key' being the canonical form of 'hyperlink' (see `canonical_url`)
+
+    Example:
+        >>> clean_conv('matrix - SSPLab - Veille - Chat Export - 2025-10-13T12-19-53.163Z.json')
+                                                     link_text  ... origin_server_ts
+        6    Linux a sa réponse à Microsoft Copilot, et ell...  ...       1754574677
+    """
+    if batch_size is None:
+        with open(file_path, mode="r") as read_file:
+            conv_tchap = json.load(read_file)
+
+        extracted_conv = [
+            _extract_msg(record)
+            for record in skip_ingested(conv_tchap["messages"], watermark, since)
+        ]
+
+        # Create a DataFrame
+        func_conv_df = _streamline_conv(
+            pl.DataFrame(extracted_conv, schema=_CONV_SCHEMA), all_links, pool
+        )
+    else:
+        # Only the rows holding a link are kept from each batch
+        func_conv_df = pl.concat(
+            [
+                _streamline_conv(batch, all_links, pool)
+                for batch in iter_conv_batches(file_path, batch_size, watermark, since)
+            ]
+            or [_streamline_conv(pl.DataFrame([], schema=_CONV_SCHEMA), all_links)]
+        )
+
+    # Removing identical hyperlinks (http/https, www., tracking parameters... ignored)
+    func_conv_df = func_conv_df.unique("link_key", keep="first")
 
     # Removing body of the message if just an hyperlink (body='[title](hyperlink)')
     func_conv_df = func_conv_df.with_columns(
@@ -90,3 +254,76 @@ def clean_conv(file_path):
     )
 
     return func_conv_df
+
+
+def find_export_files(path):
+    """
+    List the Tchap exports to read.
+
+    Args:
+        path (string): a json file, a directory (every *.json file in it) or a
+            glob pattern such as 'exports/*Veille*.json'.
+
+    Returns:
+        the sorted list of file paths.
+    """
+    if os.path.isdir(path):
+        files = glob(os.path.join(path, "*.json"))
+    elif os.path.exists(path):
+        files = [path]
+    else:
+        files = glob(path)
+    if not files:
+        raise FileNotFoundError(f"Aucun export Tchap trouve pour {path!r}")
+    return sorted(files)
+
+
+def _clean_conv_worker(file_path, batch_size, all_links, watermark, since):
+    # Runs in a child process: the moved marks have to be sent back explicitly.
+    return clean_conv(file_path, batch_size, all_links, watermark, since), watermark
+
+
+def clean_convs(
+    file_paths, batch_size=None, all_links=False, watermark=None, since=None, max_workers=None
+):
+    """
+    `clean_conv` over several Tchap exports (several rooms, or several export
+    dates of one room), parsed in parallel in a process pool.
+
+    Args:
+        file_paths (list): paths to the json exports.
+        max_workers (int, optional): number of processes (default: one per core).
+            With a single export, the processes (only if `max_workers` is
+            given) parse the html links that need BeautifulSoup.
+        batch_size, all_links, watermark, since: as in `clean_conv`; every file
+            starts from the same marks and `watermark` ends on the latest event
+            seen in any of them.
+
+    Returns:
+        A dataframe (pl.Df) with the columns of `clean_conv`, one row per
+        canonical link (the earliest message that posted it).
+    """
+    if len(file_paths) == 1:
+        if not max_workers or max_workers < 2:
+            return clean_conv(file_paths[0], batch_size, all_links, watermark, since)
+        with ProcessPoolExecutor(max_workers, mp_context=get_context("spawn")) as pool:
+            return clean_conv(file_paths[0], batch_size, all_links, watermark, since, pool)
+
+    # spawn rather than fork: polars' thread pool does not survive a fork
+    with ProcessPoolExecutor(max_workers, mp_context=get_context("spawn")) as pool:
+        futures = [
+            pool.submit(_clean_conv_worker, path, batch_size, all_links, watermark, since)
+            for path in file_paths
+        ]
+        results = [future.result() for future in futures]
+
+    if watermark is not None:
+        for _, file_watermark in results:
+            merge_watermark(watermark, file_watermark)
+
+    return (
+        pl.concat([func_conv_df for func_conv_df, _ in results])
+        .sort("origin_server_ts")
+        .unique("link_key", keep="first", maintain_order=True)
+    )
+
@@ -4,9 +4,11 @@ Complete the Veille Grist table with the help of an LLM.
 For every targeted row (e.g. modified/added after a given date and not yet
 processed), the pipeline:
 
-  1. Skips duplicate rows (Doublon_lien > 1) and records that in `Traitement`.
-  2. Finds a working link: tries `Lien_article` first, then the links found in
-     `Resume`; if none responds, writes "NO WORKING LINK FOUND".
+  1. Skips duplicate rows (Doublon_lien > 1, or the same canonical link as an
+     earlier row) and records that in `Traitement`.
+  2. Finds a working link: `Lien_article` first, then the links found in
+     `Resume` (all checked at the same time, the first in that order wins); if
+     none responds, writes "NO WORKING LINK FOUND".
   3. Calls the LLM to (a) extract / craft a title, (b) write a 2-3 sentence
      telegraphic summary, (c) pick categories from the `Rubriques` table (the
      closed category list), guided by example assignments taken from
@@ -24,12 +26,20 @@ The prompt still carries the category vocabulary and the example assignments, so
 the behaviour matches the three-step spec.
 """
 
+import html as html_lib
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
+from html.parser import HTMLParser
 
 import requests
 from bs4 import BeautifulSoup
 
+from src.data.formatting_link import canonical_url
+from src.utils.host_scheduler import host_of
+from src.utils.link_health import error_outcome, status_outcome
 from src.utils.llm_client import ask_json
 from src.utils.config import (
     COL_LINK,
@@ -40,15 +50,35 @@ from src.utils.config import (
     COL_PROCESS,
     COL_RUBRIQUE_CATEGORY,
     REQUEST_TIMEOUT,
+    FETCH_RETRIES,
+    LINK_PROBE_WORKERS,
+    MAX_PAGE_BYTES,
+    PAGE_CONTENT_TYPES,
     MAX_ARTICLE_CHARS,
+    MAX_REPAIR_CHARS,
+    LLM_REPAIR_ROUNDS,
+    MIN_MAIN_CONTENT_CHARS,
     DEFAULT_N_EXAMPLES,
     PARIS_TZ,
     USER_AGENT,
     _URL_RE,
-    _INTERNAL_PREFIXES
+    _INTERNAL_PREFIXES,
+    _CHARSET_RE,
 )
 
 
+_SPACES_RE = re.compile(r"\s+")
+_PARSE_CHUNK = 1 << 14  # characters fed to the HTML parser between two budget checks
+# main content extraction: blocks never part of an article, and class/id hints
+_BOILERPLATE_TAGS = ["nav", "header", "footer", "aside", "form", "iframe", "svg", "button"]
+_NEGATIVE_HINT_RE = re.compile(
+    r"comment|footer|footnote|nav|menu|sidebar|sponsor|banner|cookie|consent|"
+    r"social|share|related|promo|newsletter|breadcrumb|popup|modal|widget",
+    re.IGNORECASE,
+)
+_POSITIVE_HINT_RE = re.compile(r"article|body|content|entry|main|post|text|blog|story", re.IGNORECASE)
+
+
 # --------------------------------------------------------------------------- #
 # Small pure helpers (unit-tested)
 # --------------------------------------------------------------------------- #
@@ -96,6 +126,34 @@ def extract_all_links(text: str) -> list[str]:
     return out
 
 
+def find_canonical_duplicates(rows: list[dict]) -> dict:
+    """
+    Rows whose `Lien_article` is, once canonicalised (http/https, "www.",
+    trailing slash, tracking parameters... ignored, see `canonical_url`), the
+    link of a row with a smaller id: {row id -> id of that first row}.
+
+    Complements `Doublon_lien`, which Grist computes on the raw strings.
+
+    >>> find_canonical_duplicates([
+    ...     {"id": 1, "Lien_article": "https://www.insee.fr/a/"},
+    ...     {"id": 2, "Lien_article": "http://insee.fr/a?utm_source=x"},
+    ...     {"id": 3, "Lien_article": "https://insee.fr/b"},
+    ... ])
+    {2: 1}
+    """
+    first_id, duplicate_of = {}, {}
+    for row in sorted(rows, key=lambda r: r.get("id") or 0):
+        links = extract_all_links(clean_text(row.get(COL_LINK)))
+        if not links:
+            continue
+        key = canonical_url(links[0])
+        if key in first_id:
+            duplicate_of[row.get("id")] = first_id[key]
+        else:
+            first_id[key] = row.get("id")
+    return duplicate_of
+
+
 def clean_text(value) -> str:
     """
     Normalise a Grist text cell: None and the literal string 'None' (which shows
@@ -135,6 +193,27 @@ def candidate_links(row: dict) -> list[str]:
     return links
 
 
+def interleave_by_host(rows: list[dict]) -> list[int]:
+    """
+    Positions of `rows` in the order to fetch them: round-robin over the hosts
+    of their first candidate link, so that a run of rows on one site does not
+    keep every fetch waiting for that site's limits.
+
+    Example:
+        >>> rows = [{"Lien_article": u} for u in ("https://a.fr/1", "https://a.fr/2", "https://b.fr", "")]
+        >>> interleave_by_host(rows)
+        [0, 2, 3, 1]
+    """
+    queues = {}
+    for i, row in enumerate(rows):
+        links = candidate_links(row)
+        queues.setdefault(host_of(links[0]) if links else "", []).append(i)
+    order = []
+    for turn in range(max((len(q) for q in queues.values()), default=0)):
+        order.extend(q[turn] for q in queues.values() if turn < len(q))
+    return order
+
+
 def normalise_categories(value, id_to_name=None) -> list[str]:
     """
     Turn a Grist `Categorie` cell into a clean list of category *names*.
@@ -251,8 +330,173 @@ def build_category_examples(
     return examples
 
 
+class _PageTextParser(HTMLParser):
+    """
+    Event-driven reading of a page for `html_to_text`: keeps the first <title>,
+    the description <meta> tags and the text, skipping script/style/noscript,
+    without building a tree. `done` is set once `max_chars` of text are read.
+
+    A text node may come in several `handle_data` calls (the page is fed by
+    chunks): its pieces are kept in `pending` and only used as one text at the
+    next tag or at `close()`, as bs4 sees it.
+    """
+
+    _SKIPPED = frozenset(("script", "style", "noscript"))
+
+    def __init__(self, max_chars):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.skip_depth = 0
+        self.title = None  # pieces of the first <title>, None until one is met
+        self.in_title = False
+        self.description = None  # first <meta name="description">
+        self.og_description = None  # first <meta property="og:description">
+        self.pieces = []
+        self.pending = []  # pieces of the text node being read
+        self.size = -1  # length of " ".join(pieces)
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag in self._SKIPPED:
+            self.skip_depth += 1
+        elif self.skip_depth:
+            return
+        elif tag == "title" and self.title is None:
+            self.title, self.in_title = [], True
+        elif tag == "meta":
+            attrs = dict(attrs)
+            if self.description is None and attrs.get("name") == "description":
+                self.description = attrs
+            elif self.og_description is None and attrs.get("property") == "og:description":
+                self.og_description = attrs
+
+    def handle_startendtag(self, tag, attrs):
+        self._flush()
+        if tag not in self._SKIPPED:  # <script/> opens nothing
+            self.handle_starttag(tag, attrs)
+        if tag == "title":
+            self.in_title = False
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag in self._SKIPPED:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag == "title":
+            self.in_title = False
+
+    def handle_data(self, data):
+        self.pending.append(data)
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_decl(self, decl):
+        self._flush()
+
+    def handle_pi(self, data):
+        self._flush()
+
+    def close(self):
+        super().close()
+        self._flush()
+
+    def _flush(self):
+        # Use the text node read so far, whole
+        if not self.pending:
+            return
+        data = "".join(self.pending)
+        self.pending = []
+        if self.skip_depth:
+            return
+        text = data.strip()
+        if not text:
+            return
+        if self.in_title:
+            self.title.append(text)
+        text = _SPACES_RE.sub(" ", text)
+        self.pieces.append(text)
+        self.size += len(text) + 1
+        if self.size >= self.max_chars:
+            self.done = True
+
+    def unknown_decl(self, data):
+        self._flush()
+        if data.startswith("CDATA["):  # <![CDATA[...]]> text is kept, as bs4 does
+            self.handle_data(data[len("CDATA["):])
+            self._flush()
+
+
 def html_to_text(html: str, max_chars: int = MAX_ARTICLE_CHARS) -> str:
-    """Extract a readable text blob (title + meta description + body) from HTML."""
+    """
+    Extract a readable text blob (title + meta description + body) from HTML.
+
+    The page is read as a stream of tags and text, without building a tree,
+    and reading stops as soon as `max_chars` of text are collected.
+
+    Example:
+        >>> html_to_text("<title>T</title><meta name='description' content=' D '><p>Un <b>texte</b></p>")
+        'T\\nD\\nT Un texte'
+    """
+    parser = _PageTextParser(max_chars)
+    html = html or ""
+    for start in range(0, len(html), _PARSE_CHUNK):
+        parser.feed(html[start : start + _PARSE_CHUNK])
+        if parser.done:
+            break
+    else:
+        parser.close()
+
+    parts = []
+    title = "".join(parser.title or [])
+    if title:
+        parts.append(title)
+    meta = parser.description or parser.og_description
+    if meta and meta.get("content"):
+        parts.append(meta["content"].strip())
+    parts.append(" ".join(parser.pieces))
+
+    return "\n".join(p for p in parts if p)[:max_chars]
+
+
+def _hint_weight(tag) -> int:
+    # readability-style bonus / malus from the class and id of a block
+    weight = 0
+    for value in (" ".join(tag.get("class") or []), tag.get("id") or ""):
+        if _NEGATIVE_HINT_RE.search(value):
+            weight -= 25
+        if _POSITIVE_HINT_RE.search(value):
+            weight += 25
+    return weight
+
+
+def _link_density(tag) -> float:
+    # share of the text of a block that is link text (menus, link lists)
+    text = len(tag.get_text(" ", strip=True))
+    if not text:
+        return 1.0
+    links = sum(len(a.get_text(" ", strip=True)) for a in tag.find_all("a"))
+    return links / text
+
+
+def main_content_text(html: str, max_chars: int = MAX_ARTICLE_CHARS) -> str:
+    """
+    Like `html_to_text`, but keeps only the main content of the page (the
+    article body) instead of the whole page text: menus, cookie banners,
+    footers and link lists are dropped before the text is cut to `max_chars`.
+
+    Readability-style: the paragraphs score their parent (and half for their
+    grandparent) by length and commas; a block scores less the more of its text
+    is link text, more or less by its class/id (`article`, `content` vs `nav`,
+    `cookie`...). The best block is kept, with its siblings that score close.
+    Falls back to `html_to_text` when no block stands out.
+    """
+    return _main_content(html, max_chars)[0]
+
+
+def _main_content(html: str, max_chars: int = MAX_ARTICLE_CHARS) -> tuple[str, int]:
+    # `main_content_text`, and the length the whole page text would have had
+    # (as `html_to_text` cuts it), from the same parse
     soup = BeautifulSoup(html or "", "html.parser")
     for tag in soup(["script", "style", "noscript"]):
         tag.decompose()
@@ -265,42 +509,349 @@ def html_to_text(html: str, max_chars: int = MAX_ARTICLE_CHARS) -> str:
     )
     if meta and meta.get("content"):
         parts.append(meta["content"].strip())
+    whole = "\n".join(p for p in [*parts, _SPACES_RE.sub(" ", soup.get_text(" ", strip=True))] if p)
+    whole_chars = min(len(whole), max_chars)
 
-    body = soup.get_text(separator=" ", strip=True)
-    body = re.sub(r"\s+", " ", body)
+    for tag in soup(_BOILERPLATE_TAGS):
+        tag.decompose()
+    for tag in soup.find_all(True):
+        if tag.decomposed or tag.name in ("html", "body", "article", "main"):
+            continue
+        hints = f"{' '.join(tag.get('class') or [])} {tag.get('id') or ''}"
+        if _NEGATIVE_HINT_RE.search(hints) and not _POSITIVE_HINT_RE.search(hints):
+            tag.decompose()  # unlikely to hold the article
+
+    scores = {}  # id(block) -> [block, score]
+    for paragraph in soup.find_all(["p", "pre", "td", "blockquote"]):
+        text = paragraph.get_text(" ", strip=True)
+        if len(text) < 25:
+            continue
+        score = 1 + text.count(",") + min(len(text) // 100, 3)
+        parent = paragraph.parent
+        grandparent = parent.parent if parent is not None else None
+        for block, share in ((parent, 1), (grandparent, 0.5)):
+            if block is None or block is soup:
+                continue
+            if id(block) not in scores:
+                scores[id(block)] = [block, _hint_weight(block)]
+            scores[id(block)][1] += score * share
+    for entry in scores.values():
+        entry[1] *= 1 - _link_density(entry[0])
+    if not scores:
+        text = html_to_text(html, max_chars)
+        return text, len(text)
+
+    best, best_score = max(scores.values(), key=lambda entry: entry[1])
+    threshold = max(10, 0.2 * best_score)
+    kept = []
+    for sibling in best.parent.children if best.parent is not None else [best]:
+        if getattr(sibling, "name", None) is None:  # text between the blocks
+            continue
+        if sibling is best or scores.get(id(sibling), [None, 0])[1] >= threshold:
+            kept.append(sibling)
+        elif sibling.name == "p":
+            text = sibling.get_text(" ", strip=True)
+            if len(text) > 80 and _link_density(sibling) < 0.25:
+                kept.append(sibling)
+    body = _SPACES_RE.sub(" ", " ".join(block.get_text(" ", strip=True) for block in kept))
+    if len(body) < MIN_MAIN_CONTENT_CHARS:
+        text = html_to_text(html, max_chars)
+        return text, len(text)
     parts.append(body)
 
-    return "\n".join(p for p in parts if p)[:max_chars]
+    return "\n".join(p for p in parts if p)[:max_chars], whole_chars
+
+
+ANALYSIS_KEYS = ("titre", "resume", "categories")
+
+
+def analysis_schema(vocabulary, keys=ANALYSIS_KEYS) -> dict:
+    """
+    JSON schema of the LLM answer (`keys` of it only): the categories are
+    restricted to the vocabulary, plus "??".
+
+    Example:
+        >>> analysis_schema(["IA"], keys=["categories"])["properties"]["categories"]["items"]
+        {'type': 'string', 'enum': ['IA', '??']}
+    """
+    categories = {"type": "string", "enum": [*vocabulary, "??"]} if vocabulary else {"type": "string"}
+    properties = {
+        "titre": {"type": "string"},
+        "resume": {"type": "string"},
+        "categories": {"type": "array", "items": categories, "minItems": 1, "maxItems": 4},
+    }
+    return {
+        "type": "object",
+        "properties": {key: properties[key] for key in keys},
+        "required": list(keys),
+        "additionalProperties": False,
+    }
+
+
+def invalid_analysis_keys(analysis: dict, vocabulary, from_page=True) -> list[str]:
+    """
+    Keys of a normalised LLM answer that are missing or unusable: an empty
+    title or summary (allowed in the fallback, where the text may not be
+    enough), no category from the vocabulary (or "??").
+
+    Example:
+        >>> invalid_analysis_keys({"titre": "T", "resume": "", "categories": ["Autre"]}, ["IA"])
+        ['resume', 'categories']
+        >>> invalid_analysis_keys({"titre": "", "resume": "", "categories": ["??"]}, ["IA"], from_page=False)
+        []
+    """
+    invalid = []
+    if from_page:
+        invalid += [key for key in ("titre", "resume") if not analysis.get(key)]
+    known = set(vocabulary) | {"??"}
+    categories = analysis.get("categories") or []
+    if not categories or (vocabulary and not known.intersection(categories)):
+        invalid.append("categories")
+    return invalid
 
 
 # --------------------------------------------------------------------------- #
 # Network + LLM (side effects)
 # --------------------------------------------------------------------------- #
-def fetch_if_working(url: str, logger) -> str | None:
-    """GET the url; return its HTML if it responds < 400, else None."""
+def page_kind(content_type: str | None) -> str | None:
+    """
+    How a response of this Content-Type is analysed: "html", "text", or None
+    when it cannot be (pdf, images, video...). A missing header is taken as HTML.
+
+    Example:
+        >>> page_kind("text/html; charset=UTF-8"), page_kind("text/plain"), page_kind(None)
+        ('html', 'text', 'html')
+        >>> page_kind("application/pdf") is None
+        True
+    """
+    if not content_type:
+        return "html"
+    return PAGE_CONTENT_TYPES.get(content_type.split(";")[0].strip().lower())
+
+
+def decode_page(body: bytes, content_type: str | None = None) -> str:
+    """
+    Decode the bytes of a page with the charset of its Content-Type header, or
+    else the one of its <meta> tag, or else utf-8. Undecodable bytes (e.g. a
+    character cut at the end of the byte budget) are replaced.
+
+    Example:
+        >>> decode_page("é".encode("latin-1"), "text/html; charset=ISO-8859-1")
+        'é'
+        >>> decode_page(b'<meta charset="windows-1252">\\x80')[-1]
+        '€'
+        >>> decode_page("é".encode("utf-8")[:1] + b"a")
+        '\\ufffda'
+    """
+    match = _CHARSET_RE.search(content_type or "") or _CHARSET_RE.search(
+        body[:4096].decode("ascii", errors="replace")
+    )
+    charset = match.group(1) if match else "utf-8"
     try:
-        resp = requests.get(
+        return body.decode(charset, errors="replace")
+    except LookupError:  # unknown charset name
+        return body.decode("utf-8", errors="replace")
+
+
+def _read_page(resp, max_bytes: int) -> bytes:
+    # Stop downloading once the budget is reached: html_to_text only keeps the
+    # start of the page anyway
+    chunks, size = [], 0
+    for chunk in resp.iter_content(chunk_size=1 << 14):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= max_bytes:
+            break
+    return b"".join(chunks)[:max_bytes]
+
+
+@contextmanager
+def _streamed_get(url: str, headers: dict, scheduler=None):
+    """
+    Streamed GET of `url`, as a context manager giving (response, slot). With
+    a `HostScheduler`, the request waits for a slot of its host (the slot, else
+    None), and a 429 / 503 answer is asked again (`FETCH_RETRIES` times) once
+    its `Retry-After` has passed.
+    """
+    attempts = 1 + (FETCH_RETRIES if scheduler is not None else 0)
+    for attempt in range(attempts):
+        slot = scheduler.slot(url) if scheduler is not None else None
+        with slot or nullcontext(), requests.get(
             url,
-            headers={"User-Agent": USER_AGENT},
+            headers=headers,
             timeout=REQUEST_TIMEOUT,
             allow_redirects=True,
-        )
-        if resp.status_code < 400 and resp.text:
-            return resp.text
-        logger.info(f"  lien KO ({resp.status_code}) : {url}")
+            stream=True,
+        ) as resp:
+            if attempt + 1 < attempts and scheduler.retry_after(url, resp):
+                continue
+            yield resp, slot
+            return
+
+
+def fetch_if_working(url: str, logger, cache=None, scheduler=None, health=None) -> str | None:
+    """
+    GET the url; return its HTML if it responds < 400, else None.
+
+    The page is streamed: the Content-Type is checked first (pdf, images, video
+    are skipped, plain text is wrapped as HTML) and at most `MAX_PAGE_BYTES`
+    are read.
+
+    With a `PageCache`, a fresh cached page is returned without any request, an
+    older one is revalidated (a 304 answer reuses it) and a new page is stored.
+    With a `HostScheduler`, the request respects the limits of its host. With
+    a `LinkHealth`, the outcome of the request is remembered.
+    """
+    entry = cache.get(url) if cache is not None else None
+    if entry is not None and cache.is_fresh(entry):
+        return entry["html"]
+    if cache is not None and cache.offline:
+        logger.info(f"  hors ligne, page absente du cache : {url}")
+        return None
+    headers = {"User-Agent": USER_AGENT}
+    if entry is not None:
+        headers.update(cache.validators(entry))
+    try:
+        with _streamed_get(url, headers, scheduler) as (resp, _):
+            if resp.status_code == 304 and entry is not None:
+                cache.refresh(url)
+                return entry["html"]
+            if resp.status_code >= 400:
+                logger.info(f"  lien KO ({resp.status_code}) : {url}")
+                if health is not None:
+                    health.failed(url, status_outcome(resp.status_code))
+                return None
+            if health is not None:
+                health.worked(url)
+            content_type = resp.headers.get("Content-Type")
+            if page_kind(content_type) is None:
+                logger.info(f"  lien ignore (contenu {content_type}) : {url}")
+                return None
+            return _page_of(url, resp, logger, cache)
     except requests.RequestException as exc:
         logger.info(f"  lien injoignable ({exc.__class__.__name__}) : {url}")
+        if health is not None:
+            health.failed(url, error_outcome(exc))
     return None
 
 
-def resolve_working_link(row: dict, logger) -> tuple[str | None, str | None]:
+def _page_of(url: str, resp, logger, cache=None) -> str | None:
+    # Page of a response whose status and Content-Type were already checked
+    content_type = resp.headers.get("Content-Type")
+    html = decode_page(_read_page(resp, MAX_PAGE_BYTES), content_type)
+    if page_kind(content_type) == "text":
+        html = f"<html><body><pre>{html_lib.escape(html)}</pre></body></html>"
+    if not html:
+        logger.info(f"  lien KO (page vide) : {url}")
+        return None
+    if cache is not None:
+        cache.put(url, resp, html)
+    return html
+
+
+def probe_link(
+    url: str, logger, scheduler=None, health=None, cache=None, turn=None, stop=None
+) -> str | bool:
+    """
+    Cheap check that the url responds < 400 with a page that can be analysed
+    (see `page_kind`): only the response headers are read, the body is not
+    downloaded. `scheduler` and `health` as in `fetch_if_working`.
+
+    With a `turn` event, a working link then waits for it (at most
+    `REQUEST_TIMEOUT`), its response still open but its host slot given back,
+    so that the other requests to the site go on meanwhile. Once `turn` is
+    set, and unless `stop` is set too, the slot is taken again and the page is
+    read from that same response and returned (and stored in `cache`, if
+    given), or False if it is empty.
+    """
+    try:
+        with _streamed_get(url, {"User-Agent": USER_AGENT}, scheduler) as (resp, slot):
+            if health is not None:
+                if resp.status_code >= 400:
+                    health.failed(url, status_outcome(resp.status_code))
+                else:
+                    health.worked(url)
+            if resp.status_code >= 400:
+                logger.info(f"  lien KO ({resp.status_code}) : {url}")
+            elif page_kind(resp.headers.get("Content-Type")) is None:
+                logger.info(f"  lien ignore (contenu {resp.headers.get('Content-Type')}) : {url}")
+            elif turn is None:
+                return True
+            else:
+                if slot is not None:
+                    slot.pause()
+                if not turn.wait(REQUEST_TIMEOUT) or (stop is not None and stop.is_set()):
+                    return True
+                if slot is not None:
+                    slot.resume()
+                return _page_of(url, resp, logger, cache) or False
+    except requests.RequestException as exc:
+        logger.info(f"  lien injoignable ({exc.__class__.__name__}) : {url}")
+        if health is not None:
+            health.failed(url, error_outcome(exc))
+    return False
+
+
+def resolve_working_link(
+    row: dict, logger, cache=None, scheduler=None, health=None
+) -> tuple[str | None, str | None]:
     """
     First working (url, html) among the candidate links, or (None, None).
+    Pages are read through `cache` (a `PageCache`) and the requests wait for
+    `scheduler` (a `HostScheduler`) when given. With `health` (a `LinkHealth`),
+    the links known to be dead, and those of a site down for the run, are not
+    tried at all.
+
+    The candidates are probed at the same time (`probe_link`), so dead links
+    cost one timeout in total instead of one each. The first candidate that
+    answers, in priority order, wins: its probe reads the page from the
+    response it already holds, once every link before it failed. The other
+    working links close their response without reading it, and the probes not
+    started yet are cancelled.
     """
-    for url in candidate_links(row):
-        html = fetch_if_working(url, logger)
-        if html is not None:
-            return url, html
+    candidates = candidate_links(row)
+    if health is not None:
+        alive = []
+        for url in candidates:
+            reason = health.dead(url)
+            if reason is None:
+                alive.append(url)
+            else:
+                logger.info(f"  lien connu KO ({reason}), non reessaye : {url}")
+        candidates = alive
+    if len(candidates) <= 1:  # nothing to race
+        for url in candidates:
+            html = fetch_if_working(url, logger, cache, scheduler, health)
+            if html is not None:
+                return url, html
+        return None, None
+
+    stop = threading.Event()
+    turns = [threading.Event() for _ in candidates]
+
+    def probe(url, turn):
+        if cache is not None and (cache.offline or cache.has_fresh(url)):
+            return True  # answered from the cache, no request
+        return probe_link(url, logger, scheduler, health, cache, turn, stop)
+
+    pool = ThreadPoolExecutor(max_workers=min(len(candidates), LINK_PROBE_WORKERS))
+    try:
+        probes = [pool.submit(probe, url, turn) for url, turn in zip(candidates, turns)]
+        for url, turn, answer in zip(candidates, turns, probes):
+            turn.set()  # every link before it failed: its page is the one wanted
+            page = answer.result()
+            if not page:
+                continue
+            if page is True:  # from the cache, or the probe gave up waiting
+                page = fetch_if_working(url, logger, cache, scheduler, health)
+            if page is not None:
+                return url, page
+    finally:
+        # The lower-priority probes drop their response, or never start
+        stop.set()
+        for turn in turns:
+            turn.set()
+        pool.shutdown(wait=False, cancel_futures=True)
     return None, None
 
 
@@ -394,27 +945,90 @@ Reponds uniquement avec le JSON, par exemple :
     ]
 
 
-def analyze_article(article_text, url, vocabulary, examples, from_page=True) -> dict:
-    """
-    Single LLM call returning {"titre", "resume", "categories"} for the article.
-    `from_page=False` switches to the fallback prompt (work from existing
-    title/summary because the page could not be fetched).
-    Defensive: always returns the three keys with sane fallbacks.
-    """
-    data = ask_json(
-        _build_analysis_messages(article_text, url, vocabulary, examples, from_page)
+def _build_repair_messages(analysis, missing, article_text, url, vocabulary) -> list[dict]:
+    # Only the missing keys are asked for, with what is already known of the
+    # article; its text is sent again (shortened) only for a title / summary.
+    system = (
+        "Tu es un assistant de veille pour la statistique publique francaise. "
+        "Tu reponds UNIQUEMENT avec un objet JSON valide, sans aucun texte ni "
+        "balise Markdown autour."
+    )
+    vocab_str = ", ".join(vocabulary) if vocabulary else "(aucune pour l'instant)"
+    instructions = {
+        "titre": '- "titre": le titre de l\'article (invente-en un de 10 mots maximum s\'il n\'y en a pas).',
+        "resume": '- "resume": un resume tres concis, en francais, style telegraphique, 2 a 3 phrases maximum.',
+        "categories": (
+            '- "categories": une a quatre categories choisies EXCLUSIVEMENT dans cette '
+            f'liste : {vocab_str} ; reponds ["??"] si aucune ne convient.'
+        ),
+    }
+    known = "\n".join(
+        f"{key} : {analysis[key]}" for key in ("titre", "resume") if key not in missing and analysis[key]
     )
+    parts = [
+        "Renvoie un objet JSON avec exactement ces cles :",
+        "\n".join(instructions[key] for key in missing),
+        f"URL : {url}",
+    ]
+    if known:
+        parts.append(f"Ce que l'on sait deja de l'article :\n{known}")
+    if "titre" in missing or "resume" in missing or not known:
+        parts.append(f'Debut de l\'article :\n"""\n{article_text[:MAX_REPAIR_CHARS]}\n"""')
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": "\n\n".join(parts)},
+    ]
+
 
+def _normalise_analysis(data: dict) -> dict:
     titre = str(data.get("titre", "")).strip()
     resume = str(data.get("resume", "")).strip()
     cats = data.get("categories", [])
     if isinstance(cats, str):
         cats = [cats]
     categories = [str(c).strip() for c in cats if str(c).strip()]
-
     return {"titre": titre, "resume": resume, "categories": categories}
 
 
+def analyze_article(
+    article_text, url, vocabulary, examples, from_page=True, cache=None, hedge=False
+) -> dict:
+    """
+    Single LLM call returning {"titre", "resume", "categories"} for the article.
+    `from_page=False` switches to the fallback prompt (work from existing
+    title/summary because the page could not be fetched). `cache` is the
+    `LLMCache` answers are reused from, if any. `hedge` sends the call a second
+    time if it is much slower than usual (see `LLMPool`).
+
+    The endpoint is asked for JSON of the `analysis_schema` shape. The keys
+    still missing or invalid (`invalid_analysis_keys`) are asked again, alone
+    and with a short prompt, `LLM_REPAIR_ROUNDS` times at most.
+    Defensive: always returns the three keys with sane fallbacks.
+    """
+    analysis = _normalise_analysis(
+        ask_json(
+            _build_analysis_messages(article_text, url, vocabulary, examples, from_page),
+            cache=cache,
+            hedge=hedge,
+            schema=analysis_schema(vocabulary),
+        )
+    )
+    for _ in range(LLM_REPAIR_ROUNDS):
+        missing = invalid_analysis_keys(analysis, vocabulary, from_page)
+        if not missing:
+            break
+        repaired = _normalise_analysis(
+            ask_json(
+                _build_repair_messages(analysis, missing, article_text, url, vocabulary),
+                cache=cache,
+                hedge=hedge,
+                schema=analysis_schema(vocabulary, missing),
+            )
+        )
+        analysis.update({key: repaired[key] for key in missing if repaired[key]})
+    return analysis
+
+
 # --------------------------------------------------------------------------- #
 # Per-row orchestration
 # --------------------------------------------------------------------------- #
@@ -428,16 +1042,40 @@ def fallback_text(row: dict) -> str:
     return "\n".join(p for p in parts if p)
 
 
-def process_row(row: dict, vocabulary, examples, logger, id_to_name=None, name_to_id=None) -> dict:
+def process_row(
+    row: dict,
+    vocabulary,
+    examples,
+    logger,
+    id_to_name=None,
+    name_to_id=None,
+    duplicate_of=None,
+    cache=None,
+    main_content=False,
+    scheduler=None,
+    health=None,
+    llm_cache=None,
+    hedge=False,
+    parse_pool=None,
+) -> dict:
     """
     Compute the {column_name: new_value} dict to PATCH for a single row.
     Never raises on expected conditions; the `Traitement` column always reflects
-    what happened.
+    what happened. The stages of `complete_table` run the same steps
+    (`fetch_row`, `analysis_source`, `analyse_row`), one stage each.
 
     `id_to_name` / `name_to_id` are the Rubriques lookups (see
     `build_category_ref_maps`): the first translates the row's stored category
     ids to names, the second turns the LLM's chosen names back into Rubriques row
-    ids for the Reference List write.
+    ids for the Reference List write. `duplicate_of` is the id of an earlier row
+    holding the same canonical link (see `find_canonical_duplicates`), if any.
+    `cache` is the `PageCache` the article pages are read through, if any.
+    `main_content` sends only the article body of the page to the LLM.
+    `scheduler` is the `HostScheduler` the page requests wait for, if any.
+    `health` is the `LinkHealth` sparing the links known to be dead, if any.
+    `llm_cache` is the `LLMCache` the LLM answers are reused from, if any, and
+    `hedge` sends a slow LLM call a second time (see `analyze_article`).
+    `parse_pool` is the process pool the page is parsed in, if any.
 
     Link handling:
       - if a link works, the article page is analysed and the LLM results are
@@ -451,44 +1089,135 @@ def process_row(row: dict, vocabulary, examples, logger, id_to_name=None, name_t
       - if there's neither a working link nor any existing text, the row is left
         with "NO WORKING LINK FOUND".
     """
-    row_id = row.get("id")
+    # 1-2. Skip duplicates, else find a working link.
+    skipped, url, html = fetch_row(row, logger, duplicate_of, cache, scheduler, health)
+    if skipped is not None:
+        return skipped
+
+    # 3. Text to analyse: the page, or the existing title/summary as fallback.
+    source = analysis_source(row, url, html, logger, main_content, parse_pool)
+
+    # 4. Ask the LLM and build the update dict keyed by Grist column names.
+    return analyse_row(
+        row, url, source, vocabulary, examples, logger, id_to_name, name_to_id,
+        llm_cache, hedge,
+    )
 
-    # 1. Duplicates are skipped (but recorded).
+
+def fetch_row(
+    row: dict, logger, duplicate_of=None, cache=None, scheduler=None, health=None
+) -> tuple[dict | None, str | None, str | None]:
+    """
+    First step of `process_row`: (fields, url, html). `fields` is the update of
+    a row settled without looking at its links (see `skip_fields`), and then
+    there is no (url, html); else it is None and (url, html) come from
+    `resolve_working_link`.
+    """
+    skipped = skip_fields(row, logger, duplicate_of)
+    if skipped is not None:
+        return skipped, None, None
+    url, html = resolve_working_link(row, logger, cache, scheduler, health)
+    return None, url, html
+
+
+def analyse_row(
+    row: dict,
+    url,
+    source,
+    vocabulary,
+    examples,
+    logger,
+    id_to_name=None,
+    name_to_id=None,
+    cache=None,
+    hedge=False,
+) -> dict:
+    """
+    Last step of `process_row`: the update of `row` from its `analysis_source`
+    (the LLM is only called when there is one). `cache` and `hedge` as in
+    `analyze_article`.
+    """
+    if source is None:
+        return {COL_PROCESS: f"NO WORKING LINK FOUND - {now_stamp()}"}
+    text, link, from_page = source
+    analysis = analyze_article(
+        text, link, vocabulary, examples, from_page=from_page, cache=cache, hedge=hedge
+    )
+    return analysis_fields(row, url, analysis, logger, id_to_name, name_to_id)
+
+
+def skip_fields(row: dict, logger, duplicate_of=None) -> dict | None:
+    """
+    The update recording why `row` is skipped (it is a duplicate), or None when
+    it has to be analysed.
+    """
+    row_id = row.get("id")
     if is_duplicate(row.get(COL_DUPLICATE)):
         logger.info(f"[id {row_id}] doublon -> ignore")
         return {
             COL_PROCESS: f"Ignore : doublon (Doublon_lien={row.get(COL_DUPLICATE)}) - {now_stamp()}"
         }
+    if duplicate_of is not None:
+        logger.info(f"[id {row_id}] meme lien que la ligne {duplicate_of} -> ignore")
+        return {COL_PROCESS: f"Ignore : doublon de la ligne {duplicate_of} - {now_stamp()}"}
+    return None
+
+
+def analysis_source(
+    row: dict, url, html, logger, main_content=False, pool=None, sizes=None
+) -> tuple[str, str, bool] | None:
+    """
+    The (text, link, from_page) to send to the LLM for `row`, given the result
+    of `resolve_working_link`. With `main_content`, only the article body of the
+    page is sent (`main_content_text`), not the whole page text, and the
+    (whole page text, main content) lengths are appended to `sizes` (a list),
+    if given. With `pool` (a process pool), the page is parsed there: only the
+    page goes to the worker and only the text comes back.
+
+    When no link works, the existing title/summary is used instead
+    (`from_page=False`) so a category can still be assigned; None when there is
+    no text at all.
+    """
+    row_id = row.get("id")
+    if url is not None:
+        logger.info(f"[id {row_id}] analyse LLM de {url}")
+        if not main_content:
+            text = html_to_text(html) if pool is None else pool.submit(html_to_text, html).result()
+            return text, url, True
+        text, whole_chars = (
+            _main_content(html) if pool is None else pool.submit(_main_content, html).result()
+        )
+        if sizes is not None:
+            sizes.append((whole_chars, len(text)))
+        return text, url, True
+    # Fallback: no reachable link -> use the existing title/summary so we can
+    # at least categorise.
+    text = fallback_text(row)
+    if not text:
+        logger.info(f"[id {row_id}] aucun lien valide, aucun texte existant")
+        return None
+    logger.info(f"[id {row_id}] lien injoignable -> fallback sur le texte existant")
+    return text, clean_text(row.get(COL_LINK)), False
 
+
+def analysis_fields(row: dict, url, analysis, logger, id_to_name=None, name_to_id=None) -> dict:
+    """
+    The {column_name: new_value} update of `row` from the LLM `analysis`.
+
+    `url` is the working link (None when the existing text was analysed
+    instead): in that fallback, never overwrite a cell that already has content,
+    because there is no new ground truth, just a re-reading of the same text.
+    """
+    row_id = row.get("id")
+    gap_only = url is None
     has_title = bool(clean_text(row.get(COL_TITLE)))
     has_resume = bool(clean_text(row.get(COL_RESUME)))
     has_cat = bool(normalise_categories(row.get(COL_CATEGORY), id_to_name))
 
-    # 2. Find a working link.
-    url, html = resolve_working_link(row, logger)
-
-    if url is not None:
-        # Page fetched: analyse it and overwrite the cells.
-        logger.info(f"[id {row_id}] analyse LLM de {url}")
-        analysis = analyze_article(html_to_text(html), url, vocabulary, examples, from_page=True)
-        gap_only = False
-        note = f"Traite le {now_stamp()}"
+    if gap_only:
+        fields = {COL_PROCESS: f"Traite via texte existant (lien injoignable) le {now_stamp()}"}
     else:
-        # 3. Fallback: no reachable link -> use the existing title/summary so we
-        #    can at least categorise. Never overwrite curated cells here.
-        text = fallback_text(row)
-        if not text:
-            logger.info(f"[id {row_id}] aucun lien valide, aucun texte existant")
-            return {COL_PROCESS: f"NO WORKING LINK FOUND - {now_stamp()}"}
-        logger.info(f"[id {row_id}] lien injoignable -> fallback sur le texte existant")
-        link_for_context = clean_text(row.get(COL_LINK))
-        analysis = analyze_article(text, link_for_context, vocabulary, examples, from_page=False)
-        gap_only = True
-        note = f"Traite via texte existant (lien injoignable) le {now_stamp()}"
-
-    # 4. Build the update dict keyed by Grist column names.
-    #    `gap_only` (fallback only) -> never overwrite a cell that already has content.
-    fields = {COL_PROCESS: note}
+        fields = {COL_PROCESS: f"Traite le {now_stamp()}"}
     # If the link that actually worked is not the one stored in Lien_article
     # (a backup link from Resume, or a clean URL extracted from malformed
     # markdown), write it back so the table holds the working link.
@@ -1,8 +1,9 @@
 import re
 
+import polars as pl
 from bs4 import BeautifulSoup, MarkupResemblesLocatorWarning
 import warnings
-from src.utils.config import _INTERNAL_PREFIXES
+from src.utils.config import _INTERNAL_PREFIXES, _TRACKING_PARAM_RE
 
 warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning)  # Filter out warning message from bs4 that identifies input to parse as html
 
@@ -35,7 +36,39 @@ def extract_link_rawtxt(text):
     return href
 
 
-# Function to extract the hyperlink and its title from an html formatted body
+# Function to extract the hyperlinks and their titles from an html formatted body
+def extract_all_link_title_html(text):
+    """
+    Every external http(s) link of an html formatted body, with its title.
+    Replies (<mx-reply>) and Tchap/Matrix internal links are ignored.
+
+    Args:
+        text (string): html text where to look for the links
+
+    Returns: a list of (url, title) tuples, in order ([] if nothing found)
+
+    Example:
+        >>> extract_all_link_title_html('<a href="https://a.fr">A</a> <a href="https://b.fr">B</a>')
+        [('https://a.fr', 'A'), ('https://b.fr', 'B')]
+    """
+    # Parse the formatted body
+    soup = BeautifulSoup(text, "html.parser")
+
+    # Remove all <mx-reply> tags when you reply to a msg
+    for mx_reply in soup.find_all("mx-reply"):
+        mx_reply.decompose()
+
+    # Find all <a> tags with href attributes, keep the HTTPS/HTTP external ones
+    found = []
+    for link in soup.find_all("a", href=True):
+        href = link["href"]
+        if href.startswith(_INTERNAL_PREFIXES):  # Filtering internal links
+            continue
+        if href.startswith(("http://", "https://")):
+            found.append((href, link.get_text(strip=True)))  # Extract the title text
+    return found
+
+
 def extract_link_title_html(text):
     """
     Function to extract a link, formatted in Markodwn or plain text, from a string
@@ -53,33 +86,9 @@ def extract_link_title_html(text):
         >>> extract_link('[a link](https://www.tjis_is_my_link.fr)')
         'https://www.tjis_is_my_link.fr'
     """
-    # Parse the formatted body
-    soup = BeautifulSoup(text, "html.parser")
-
-    # Remove all <mx-reply> tags when you reply to a msg
-    for mx_reply in soup.find_all("mx-reply"):
-        mx_reply.decompose()
-
-    # Find all <a> tags with href attributes
-    links = soup.find_all("a", href=True)
-
-    # Filter HTTPS/HTTP links and get the first match
-    first_link = None
-    first_title = ""
-    for link in links:
-        href = link["href"]
-        if href.startswith(_INTERNAL_PREFIXES[0]) or href.startswith(
-            _INTERNAL_PREFIXES[1]
-        ):  # Filtering internal links
-            href = None
-        if href is not None:
-            if href.startswith(("http://", "https://")):
-                first_link = href
-                first_title = link.get_text(strip=True)  # Extract the title text
-                break
-
-    if first_link:
-        return first_link, first_title
+    links = extract_all_link_title_html(text)
+    if links:
+        return links[0]
     else:
         return None, None
 
@@ -95,3 +104,179 @@ def extract_link_title(text):
 
 
 # %%
+# Same rules as the BeautifulSoup / regex helpers above, written as polars
+# expressions so a whole batch of messages is handled natively at once.
+_RAW_URL_RE = r"\bhttps?://\S+|www\.\S+"  # as in extract_link_rawtxt
+_MX_REPLY_RE = r"(?s)<mx-reply>.*?</mx-reply>"
+_A_TAG_RE = r'(?s)<a\s(?:[^>]*?\s)?href="([^"]*)"[^>]*>(.*?)</a>'
+# an <a> tag with a ">" inside a quoted attribute value, where _A_TAG_RE would
+# end the tag too early
+_QUOTED_GT_RE = r"""(?i)<a\s(?:[^>"']|"[^"]*"|'[^']*')*["'][^"'>]*>"""
+_LINK_SCHEMA = pl.Struct({"links": pl.List(pl.Utf8), "titles": pl.List(pl.Utf8)})
+
+
+def _is_internal(expr):
+    return expr.str.starts_with(_INTERNAL_PREFIXES[0]) | expr.str.starts_with(
+        _INTERNAL_PREFIXES[1]
+    )
+
+
+def _html_links_bs(text):
+    """BeautifulSoup path, for the messages the regex path cannot parse safely."""
+    links = extract_all_link_title_html(text)
+    return {"links": [link for link, _ in links], "titles": [title for _, title in links]}
+
+
+def extract_links_pl(df, col="formatted_body", all_links=False, pool=None):
+    """
+    Vectorized `extract_link_title` over the `col` column of a dataframe.
+
+    <a href> links are read with polars regexes (replies stripped, internal
+    links dropped); when a message has none, the raw-text urls are used. The
+    few messages whose html the regexes cannot read like BeautifulSoup would
+    (html entities, tags inside a link, unquoted or unusual <a> tags) go
+    through `extract_all_link_title_html` instead.
+
+    Args:
+        df (pl.DataFrame): the messages.
+        col (string): name of the column holding the (html) text.
+        all_links (bool): if True, return one row per external link of each
+            message instead of its first link only.
+        pool (Executor, optional): process pool the BeautifulSoup path runs in
+            (only the message texts are sent, only the links come back).
+
+    Returns:
+        `df` with two more columns, 'hyperlink' and 'link_text' (both null for
+        a message without any link).
+
+    Example:
+        >>> extract_links_pl(pl.DataFrame({"formatted_body": ['<a href="https://a.fr">A</a>']})).row(0)
+        ('<a href="https://a.fr">A</a>', 'https://a.fr', 'A')
+    """
+    text = pl.col(col)
+    html = text.str.replace_all(_MX_REPLY_RE, "")
+    anchors = html.str.extract_all(_A_TAG_RE)
+    hrefs = anchors.list.eval(pl.element().str.extract(_A_TAG_RE, 1))
+    titles = anchors.list.eval(pl.element().str.extract(_A_TAG_RE, 2))
+    external = hrefs.list.eval(
+        (
+            pl.element().str.starts_with("http://")
+            | pl.element().str.starts_with("https://")
+        )
+        & ~_is_internal(pl.element())
+    ).list.eval(pl.element().arg_true())
+
+    df = df.with_row_index("_msg").with_columns(
+        _links=hrefs.list.gather(external),
+        _titles=titles.list.gather(external).list.eval(pl.element().str.strip_chars()),
+        _needs_bs=(html.str.count_matches(r"(?i)<a\s") != anchors.list.len())
+        | html.str.contains(r"(?i)<mx-reply")
+        | html.str.contains(_QUOTED_GT_RE)
+        | anchors.list.join("").str.contains("&", literal=True)
+        | titles.list.eval(pl.element().str.contains("<", literal=True)).list.any(),
+    )
+    fast, slow = df.filter(~pl.col("_needs_bs")), df.filter(pl.col("_needs_bs"))
+    if len(slow):
+        if pool is None:
+            bs = text.map_elements(_html_links_bs, return_dtype=_LINK_SCHEMA)
+        else:
+            links = pool.map(_html_links_bs, slow[col].to_list(), chunksize=64)
+            bs = pl.Series(list(links), dtype=_LINK_SCHEMA)
+        slow = slow.with_columns(bs.alias("_bs")).with_columns(
+            _links=pl.col("_bs").struct.field("links"),
+            _titles=pl.col("_bs").struct.field("titles"),
+        ).drop("_bs")
+        df = pl.concat([fast, slow]).sort("_msg")
+
+    # No html link: fall back on the urls written in the raw text
+    raw = text.str.extract_all(_RAW_URL_RE)
+    if not all_links:
+        raw = raw.list.head(1)  # only the first url counts, even if internal
+    raw = raw.list.eval(pl.element().filter(~_is_internal(pl.element())))
+    has_html = pl.col("_links").list.len() > 0
+    df = df.with_columns(
+        _links=pl.when(has_html).then("_links").otherwise(raw),
+        _titles=pl.when(has_html)
+        .then("_titles")
+        .otherwise(raw.list.eval(pl.element().str.slice(0, 0))),  # no title: ""
+    )
+
+    if all_links:
+        df = df.explode("_links", "_titles")
+    else:
+        df = df.with_columns(pl.col("_links", "_titles").list.first())
+    return df.rename({"_links": "hyperlink", "_titles": "link_text"}).drop(
+        "_msg", "_needs_bs"
+    )
+
+
+# scheme, "www." / host / path / query / fragment
+_URL_PARTS_RE = r"^(?i:https?://)?(?i:www\.)?([^/?#]*)([^?#]*)(?:\?([^#]*))?(?:#(.*))?"
+
+
+def canonical_url(url):
+    """
+    Canonical form of an url, used as the key to spot the same article behind
+    different urls: https, no "www.", lowercase host, no trailing slash, no
+    tracking parameters (utm_*, fbclid...), no fragment (unless it is a route
+    like '#/page' or '#!page').
+
+    Args:
+        url (string): url to canonicalize
+
+    Returns:
+        the canonical url (string), None if `url` is None
+
+    Example:
+        >>> canonical_url('http://www.Insee.fr/fr/statistiques/?utm_source=x&id=2#haut')
+        'https://insee.fr/fr/statistiques?id=2'
+        >>> canonical_url('www.insee.fr')
+        'https://insee.fr'
+    """
+    if url is None:
+        return None
+    host, path, query, fragment = re.match(_URL_PARTS_RE, url.strip()).groups()
+    params = [
+        param
+        for param in (query or "").split("&")
+        if param and not re.match(_TRACKING_PARAM_RE, param)
+    ]
+    canonical = "https://" + host.lower() + path.rstrip("/")
+    if params:
+        canonical += "?" + "&".join(params)
+    if fragment and fragment.startswith(("/", "!")):
+        canonical += "#" + fragment
+    return canonical
+
+
+def canonical_url_pl(expr):
+    """
+    `canonical_url` as a polars expression, to canonicalize a whole column.
+
+    Example:
+        >>> pl.select(canonical_url_pl(pl.lit("http://www.insee.fr/"))).item()
+        'https://insee.fr'
+    """
+    parts = expr.cast(pl.Utf8).str.strip_chars().str.extract_groups(_URL_PARTS_RE)
+    params = (
+        parts.struct.field("3")
+        .fill_null("")
+        .str.split("&")
+        .list.eval(
+            pl.element().filter(
+                (pl.element() != "") & ~pl.element().str.contains(_TRACKING_PARAM_RE)
+            )
+        )
+        .list.join("&")
+    )
+    fragment = parts.struct.field("4").fill_null("")
+    return pl.concat_str(
+        pl.lit("https://"),
+        parts.struct.field("1").str.to_lowercase(),
+        parts.struct.field("2").str.strip_chars_end("/"),
+        pl.when(params != "").then("?" + params).otherwise(pl.lit("")),
+        pl.when(fragment.str.contains(r"^[/!]"))
+        .then("#" + fragment)
+        .otherwise(pl.lit("")),
+    )
+
@@ -1,4 +1,7 @@
 from datetime import datetime
+
+import polars as pl
+
 from src.utils.config import PARIS_TZ
 
 
@@ -24,4 +27,56 @@ def convert_unix_time(time_as_int):
         time_as_int = time_as_int / 1000
 
     time = datetime.fromtimestamp(time_as_int, PARIS_TZ)
-    return time.strftime("%Y-%m-%d %H:%M")
\ No newline at end of file
+    return time.strftime("%Y-%m-%d %H:%M")
+
+
+def convert_unix_time_pl(expr):
+    """
+    `convert_unix_time` as a polars expression, to convert a whole column at once
+
+    Args:
+        expr (pl.Expr): unix times, with either 10 or 13 digits
+
+    Returns:
+        expression of the dates (string) format ("%Y-%m-%d %H:%M"), Paris time
+
+    Example:
+        >>> pl.select(convert_unix_time_pl(pl.lit(1760297400000))).item()
+        '2025-10-12 21:30'
+        >>> pl.select(convert_unix_time_pl(pl.lit(1760297400))).item()
+        '2025-10-12 21:30'
+    """
+    expr = expr.cast(pl.Int64)
+    time_ms = pl.when(expr >= 1e12).then(expr).otherwise(expr * 1000)
+    return (
+        pl.from_epoch(time_ms, time_unit="ms")
+        .dt.replace_time_zone("UTC")
+        .dt.convert_time_zone(PARIS_TZ.key)
+        .dt.strftime("%Y-%m-%d %H:%M")
+    )
+
+
+def parse_date_to_unix_ms(date_str):
+    """
+    Convert a Paris time date, as written by `convert_unix_time`, to a 13 digits
+    unix time (ie milliseconds, like Tchap `origin_server_ts`)
+
+    Args:
+        date_str (string): date, format "%Y-%m-%d" or "%Y-%m-%d %H:%M"
+
+    Returns:
+        unix time in milliseconds (int)
+
+    Example:
+        >>> parse_date_to_unix_ms('2025-10-12 21:30')
+        1760297400000
+    """
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            time = datetime.strptime(date_str, fmt).replace(tzinfo=PARIS_TZ)
+        except ValueError:
+            continue
+        return int(time.timestamp()) * 1000
+    raise ValueError(
+        f"Date invalide : {date_str!r} (format attendu YYYY-MM-DD ou 'YYYY-MM-DD HH:MM')"
+    )
@@ -22,6 +22,7 @@ def create_veille_qmd(
     veille_df,
     output_path="veille.qmd",
     logger=setup_logging(),
+    api=None,
 ):
     """
     Summarise all the rows of a Polars dataframe to the following format: 
@@ -41,6 +42,7 @@ def create_veille_qmd(
         veille_df : the Polars dataframe (filter) whose rows will be summarised
         output_path (string) : path of the Qmd file to store the results
         logger
+        api (GristApi, optional) : client to reuse (a new one otherwise)
 
     Returns:
         the markdown formatted text
@@ -48,8 +50,10 @@ def create_veille_qmd(
     Example:
     >>> create_veille_qmd(veille_df)
     """
+    api = api or GristApi()
+
     # Define category mappings
-    rubriques_groups = fetch_rubriques(logger=logger)
+    rubriques_groups = fetch_rubriques(logger=logger, api=api)
 
     # Initialize markdown content
     markdown_content = ""
@@ -57,8 +61,7 @@ def create_veille_qmd(
 
     # Fetch rubrique order (tag 1 prevails over tag in 2 ...)
     groups_ordered = (
-        GristApi()
-        .fetch_table_pl(table_id=TABLE_RUBRIQUES)
+        api.fetch_table_pl(table_id=TABLE_RUBRIQUES)
         .unique(COL_RUBRIQUE_RUBRIQUE)
         .select([COL_RUBRIQUE_RUBRIQUE, "Ordre"])
         .sort("Ordre")[COL_RUBRIQUE_RUBRIQUE]
@@ -91,15 +94,16 @@ def create_veille_qmd(
     return markdown_content
 
 
-def fetch_rubriques(logger=setup_logging()):
+def fetch_rubriques(logger=setup_logging(), api=None):
     """
     To fetch categories from the Rubrique table and send it back as a dictionnary 'Rubrique' : [list of categories]
 
     Args : 
+        api (GristApi, optional) : client to reuse (a new one otherwise)
 
     """
     logger.info(f"Récupération des catégories de la table {TABLE_RUBRIQUES}")
-    rubriques_df = GristApi().fetch_table_pl(table_id=TABLE_RUBRIQUES)
+    rubriques_df = (api or GristApi()).fetch_table_pl(table_id=TABLE_RUBRIQUES)
 
     logger.info("Transformation en dictionnaire de catégories")
     rubriques_groups = dict(
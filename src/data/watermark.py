@@ -0,0 +1,91 @@
+import json
+import os
+
+from src.utils.config import WATERMARK_PATH
+
+
+def load_watermark(table_id, path=WATERMARK_PATH):
+    """
+    High-water marks of the extraction into `table_id`: for each Tchap room,
+    the last event already ingested.
+
+    Args:
+        table_id (string): Grist table the export is added to (each table has its own marks).
+        path (string): json file where the marks are kept.
+
+    Returns:
+        a dict {room_id: {"origin_server_ts": int, "event_id": string}}, empty
+        when nothing has been extracted into the table yet.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, mode="r") as read_file:
+        return json.load(read_file).get(table_id, {})
+
+
+def save_watermark(table_id, watermark, path=WATERMARK_PATH):
+    """Persist the marks of `table_id`, keeping those of the other tables."""
+    marks = {}
+    if os.path.exists(path):
+        with open(path, mode="r") as read_file:
+            marks = json.load(read_file)
+    marks[table_id] = watermark
+    with open(path, mode="w") as write_file:
+        json.dump(marks, write_file, indent=2)
+
+
+def skip_ingested(messages, watermark=None, since=None):
+    """
+    Yield only the events that were not ingested yet, and move `watermark`
+    forward (in place) to the last event of each room once they are all read.
+
+    An event is new when it is after the mark its room had before the call, so
+    events out of order in the export are all kept. If `since` (unix time in ms)
+    is given, it replaces the marks: every event from `since` on is kept.
+
+    Args:
+        messages: iterable of Tchap event dicts.
+        watermark (dict, optional): marks as returned by `load_watermark`,
+            updated with the last event of each room seen. None keeps every event.
+        since (int, optional): unix time in ms overriding the marks.
+
+    Example:
+        >>> marks = {"!r": {"origin_server_ts": 2, "event_id": "$b"}}
+        >>> events = [{"room_id": "!r", "origin_server_ts": ts, "event_id": e} for ts, e in [(1, "$a"), (2, "$b"), (3, "$c")]]
+        >>> [e["event_id"] for e in skip_ingested(events, marks)]
+        ['$c']
+        >>> marks["!r"]
+        {'origin_server_ts': 3, 'event_id': '$c'}
+        >>> events = [{"room_id": "!r", "origin_server_ts": ts, "event_id": e} for ts, e in [(10, "$a"), (9, "$b"), (11, "$c")]]
+        >>> [e["event_id"] for e in skip_ingested(events, {})]
+        ['$a', '$b', '$c']
+    """
+    saved = dict(watermark or {})  # the marks events are compared against
+    latest = {}  # last event of each room in this run
+    for record in messages:
+        room, ts = record["room_id"], record["origin_server_ts"]
+        mark = saved.get(room)
+        if since is not None:
+            is_new = ts >= since
+        elif mark is None:
+            is_new = True
+        else:
+            is_new = ts > mark["origin_server_ts"] or (
+                ts == mark["origin_server_ts"] and record["event_id"] != mark["event_id"]
+            )
+        last = latest.get(room)
+        if last is None or ts >= last["origin_server_ts"]:
+            latest[room] = {"origin_server_ts": ts, "event_id": record["event_id"]}
+        if is_new:
+            yield record
+    if watermark is not None:
+        merge_watermark(watermark, latest)
+
+
+def merge_watermark(watermark, other):
+    """Move the marks of `watermark` forward (in place) to those of `other` when later."""
+    for room, mark in other.items():
+        current = watermark.get(room)
+        if current is None or mark["origin_server_ts"] >= current["origin_server_ts"]:
+            watermark[room] = mark
+
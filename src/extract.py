@@ -1,7 +1,9 @@
 import polars as pl
 
-from src.data.clean_conv import clean_conv
-from src.data.formatting_time import convert_unix_time
+from src.data.clean_conv import clean_convs, find_export_files
+from src.data.formatting_link import canonical_url_pl
+from src.data.formatting_time import convert_unix_time_pl, parse_date_to_unix_ms
+from src.data.watermark import load_watermark, save_watermark
 from src.utils.access_grist_api import GristApi
 from src.utils.logging import setup_logging
 from src.utils.config import COL_LINK, COL_TITLE
@@ -45,17 +47,14 @@ def add_to_veille(my_conv_df, target_table="Test", logger=setup_logging()):
         .to_dicts()
     )
 
-    new_msg_json = {
-        "records": new_msg_dict,
-    }
-
-    res = GristApi().add_records(target_table, json=new_msg_json)
-    res = res.json().get("records", "")
+    # Sent by chunks, transient errors retried; raises if a chunk fails for
+    # good (the caller only moves its watermark on success)
+    res = GristApi().add_records_bulk(target_table, new_msg_dict)
 
     if len(res) == 0:
         res_msg = f"No record has been added to the {target_table} table"
     else:
-        res_msg = f"{len(res)} records have been added to the {target_table} table, from id {res[0]['id']} to {res[-1]['id']}"
+        res_msg = f"{len(res)} records have been added to the {target_table} table, from id {min(res)} to {max(res)}"
 
     logger.info(f"{res_msg}")
 
@@ -66,15 +65,34 @@ def add_to_veille(my_conv_df, target_table="Test", logger=setup_logging()):
 def extract_and_add_to_veille(
     input_conv_file_path="export.json",
     target_table="Test",
+    batch_size=None,
+    all_links=False,
+    since=None,
+    full=False,
+    max_workers=None,
     logger=setup_logging(),
 ):
     """
-    wrapper to extract from a json Tchap file and add records to Veille table.
-    Url that are already present in Target table will be discarded when updating the Grist table
+    wrapper to extract from json Tchap files and add records to Veille table.
+    Several exports (rooms, export dates) are parsed in parallel and added to
+    the table in a single batch, each link once (its earliest message).
+    Url that are already present in Target table (compared in their canonical
+    form, see `canonical_url`) will be discarded when updating the Grist table.
+    Only the messages posted after the last run (per Tchap room and target
+    table, see `src.data.watermark`) are read, unless `since` or `full` is given.
 
     Args:
-        input_conv_file_path (string) : path to json file that has been extracted from Tchap
+        input_conv_file_path (string) : path to json file that has been extracted from Tchap,
+            or a directory / glob pattern matching several of them
         target_table : Grist table id to update the rows to.
+        batch_size (int, optional) : read the export incrementally, `batch_size`
+            messages at a time (constant memory for big exports).
+        all_links (bool) : keep every external link of a message, not only the first one.
+        since (string, optional) : "YYYY-MM-DD" or "YYYY-MM-DD HH:MM"; read the
+            messages from that date on, whatever was ingested before.
+        full (bool) : read the whole export again, whatever was ingested before.
+        max_workers (int, optional) : number of processes parsing the exports
+            (default: one per core).
 
     Returns:
         the records that have been added to table
@@ -84,16 +102,43 @@ def extract_and_add_to_veille(
     '170 records have been added to the Test table, from row 319 to 488'
     """
     logger.info("Début de la récupération de la veille")
-    # Clean the conversation
-    my_conv_df = clean_conv(input_conv_file_path)
+    watermark = load_watermark(target_table)
+    if full:
+        since_ms = 0
+    elif since is not None:
+        since_ms = parse_date_to_unix_ms(since)
+    else:
+        since_ms = None
+        logger.info(f"Reprise après le dernier message ingéré de {len(watermark)} salon(s)")
+
+    file_paths = find_export_files(input_conv_file_path)
+    logger.info(f"{len(file_paths)} export(s) Tchap à lire : {file_paths}")
+
+    # Clean the conversations (older messages are skipped, watermark moved forward)
+    my_conv_df = clean_convs(
+        file_paths,
+        batch_size=batch_size,
+        all_links=all_links,
+        watermark=watermark,
+        since=since_ms,
+        max_workers=max_workers,
+    )
     logger.info(
         f"Conversation transformée en table Grist, nombre de liens : {len(my_conv_df)}\nConversation propre (table my_conv_df):\n{my_conv_df}"
     )
+    if len(my_conv_df) == 0:
+        save_watermark(target_table, watermark)
+        res_msg = f"No new link in the export, nothing to add to the {target_table} table"
+        logger.info(res_msg)
+        return res_msg
 
     # Download data to filter new urls
     logger.info(f"Début du téléchargement de la table Grist cible {target_table}")
     old_conv_df = (
-        GristApi().fetch_table_pl(table_id=target_table).select(COL_LINK).unique()
+        GristApi()
+        .fetch_table_pl(table_id=target_table, columns=[COL_LINK])
+        .select(link_key=canonical_url_pl(pl.col(COL_LINK)))
+        .unique()
     )
     logger.info(
         f"Table Grist cible {target_table} téléchargée, nombre de lignes : {len(old_conv_df)}\nTable cible téléchargée (table old_conv_df):\n{old_conv_df}"
@@ -102,12 +147,12 @@ def extract_and_add_to_veille(
     # Join new articles in former Grist table
     logger.info("Début de la création de la table Grist finale")
     my_conv_df = my_conv_df.join(
-        old_conv_df, left_on="hyperlink", right_on=COL_LINK, how="anti"
-    ).with_columns(  # To keep only url that are not already present in the Grist table
-        pl.col("origin_server_ts").map_elements(
-            lambda x: convert_unix_time(x)
-        )  # Convert from Unix time to human readable time
+        old_conv_df, on="link_key", how="anti"
+    ).drop("link_key").with_columns(  # To keep only url that are not already present in the Grist table
+        convert_unix_time_pl(pl.col("origin_server_ts"))  # Convert from Unix time to human readable time
     )
     logger.info(f"Nombre de lignes après filtre liens déjà présents: {len(my_conv_df)}\nTable finale à ajouter (table my_conv_df):\n{my_conv_df}")
 
-    return add_to_veille(my_conv_df, target_table)
+    res_msg = add_to_veille(my_conv_df, target_table)
+    save_watermark(target_table, watermark)
+    return res_msg
@@ -15,12 +15,22 @@ import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 import doctest
+import re
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest import mock
 
+import polars as pl
+from bs4 import BeautifulSoup
+
 import pytest
 
+import src.complete_table as ct
 import src.data.complete_veille as cv
 import src.utils.llm_client as llm
+import src.utils.pipeline as pipeline
 import src.utils.config as config
 
 FAKE_HTML = (
@@ -57,7 +67,9 @@ def examples(sample_rows):
 # --------------------------------------------------------------------------- #
 # Doctests on the pure helpers
 # --------------------------------------------------------------------------- #
-@pytest.mark.parametrize("module", [cv, llm], ids=["complete_veille", "llm_client"])
+@pytest.mark.parametrize(
+    "module", [cv, llm, pipeline], ids=["complete_veille", "llm_client", "pipeline"]
+)
 def test_doctests(module):
     result = doctest.testmod(module, verbose=False)
     assert result.failed == 0, f"{module.__name__} doctests failed: {result}"
@@ -78,6 +90,242 @@ def test_parse_json_answer(raw, expected):
     assert llm.parse_json_answer(raw) == expected
 
 
+# --------------------------------------------------------------------------- #
+# llm_client.LLMCache
+# --------------------------------------------------------------------------- #
+def _fake_client(answer='{"titre": "T"}'):
+    client = mock.Mock()
+    client.chat.completions.create.return_value.choices = [mock.Mock(message=mock.Mock(content=answer))]
+    return client
+
+
+def test_llm_cache_answers_a_request_once(tmp_path):
+    cache = llm.LLMCache(path=str(tmp_path / "llm.sqlite"))
+    client = _fake_client()
+    messages = [{"role": "user", "content": "article"}]
+    assert llm.ask_json(messages, client=client, cache=cache) == {"titre": "T"}  # e.g. --dry-run
+    assert llm.ask_json(messages, client=client, cache=cache) == {"titre": "T"}  # real run
+    assert client.chat.completions.create.call_count == 1
+    llm.ask(messages, client=client, cache=cache, temperature=0)  # other options: new request
+    llm.ask(messages, client=client)  # no cache: always sent
+    assert client.chat.completions.create.call_count == 3
+    cache.close()
+
+
+def test_llm_cache_skips_unparsable_answers(tmp_path):
+    cache = llm.LLMCache(path=str(tmp_path / "llm.sqlite"))
+    client = _fake_client("desole, je ne peux pas")
+    messages = [{"role": "user", "content": "article"}]
+    assert llm.ask_json(messages, client=client, cache=cache) == {}
+    client.chat.completions.create.return_value.choices[0].message.content = '{"titre": "T"}'
+    assert llm.ask_json(messages, client=client, cache=cache) == {"titre": "T"}  # asked again
+    assert llm.ask_json(messages, client=client, cache=cache) == {"titre": "T"}  # now cached
+    assert client.chat.completions.create.call_count == 2
+    cache.close()
+
+
+def test_llm_cache_drops_least_recently_used(tmp_path):
+    cache = llm.LLMCache(path=str(tmp_path / "llm.sqlite"), max_bytes=10)
+    cache.put("a", "x" * 6)
+    cache.put("b", "y" * 6)  # over 10 bytes: "a" goes
+    assert (cache.get("a"), cache.get("b")) == (None, "yyyyyy")
+    cache.close()
+
+
+# --------------------------------------------------------------------------- #
+# llm_client.LLMPool
+# --------------------------------------------------------------------------- #
+def _connection_error():
+    return llm.openai.APIConnectionError(request=mock.Mock())
+
+
+def test_llm_pool_sends_to_least_busy_endpoint():
+    busy, release = _fake_client(), threading.Event()
+    busy.chat.completions.create.side_effect = lambda **kw: release.wait(5) and "lent"
+    free = _fake_client()
+    pool = llm.LLMPool([busy, free])
+    with ThreadPoolExecutor(1) as executor:
+        first = executor.submit(pool.create, model="m", messages=[])
+        while not busy.chat.completions.create.called:
+            time.sleep(0.01)
+        pool.create(model="m", messages=[])  # busy has one request in flight
+        release.set()
+        assert first.result() == "lent"
+    assert free.chat.completions.create.call_count == 1
+
+
+def test_llm_pool_ejects_failing_endpoint():
+    down, up = _fake_client(), _fake_client()
+    down.chat.completions.create.side_effect = _connection_error()
+    pool = llm.LLMPool([down, up], eject_seconds=60, retries=0)
+    pool.create(model="m", messages=[])  # down fails, sent again to up
+    pool.create(model="m", messages=[])  # down is ejected
+    assert (down.chat.completions.create.call_count, up.chat.completions.create.call_count) == (1, 2)
+
+    up.chat.completions.create.side_effect = _connection_error()
+    with pytest.raises(llm.openai.APIConnectionError):  # every endpoint failed
+        pool.create(model="m", messages=[])
+
+
+def test_llm_pool_retries_after_backoff():
+    client = _fake_client()
+    client.chat.completions.create.side_effect = [_connection_error(), _connection_error(), "ok"]
+    pool = llm.LLMPool([client], retries=2)
+    with mock.patch.object(llm.time, "sleep") as sleep:
+        assert pool.create(model="m", messages=[]) == "ok"
+    assert sleep.call_count == 2
+    assert pool.limiter.throttled == 2 and pool.limiter.done == 1
+
+
+def test_backoff_delay_grows_and_honours_retry_after():
+    with mock.patch.object(llm.random, "uniform", side_effect=lambda low, high: high):
+        assert [llm.backoff_delay(n, base=1, cap=5) for n in range(4)] == [1, 2, 4, 5]
+        throttled = mock.Mock(response=mock.Mock(headers={"Retry-After": "3"}))
+        assert llm.backoff_delay(0, throttled, base=1) == 3
+
+
+def test_adaptive_limiter_aimd():
+    clock = [1000.0]
+    limiter = llm.AdaptiveLimiter(initial=4, maximum=8)
+
+    def call(duration, throttled=False):
+        started = limiter.acquire()
+        clock[0] += duration
+        limiter.release(started, throttled=throttled)
+
+    with mock.patch.object(llm.time, "monotonic", side_effect=lambda: clock[0]):
+        for _ in range(8):  # 1 s calls: about +1 per round of calls
+            call(1)
+        assert 5 <= limiter.limit <= 6
+        before = limiter.limit
+        call(1, throttled=True)
+        assert limiter.limit == before / 2
+        call(0, throttled=True)  # same burst: not halved again
+        assert limiter.limit == before / 2
+        call(10)  # 10 s call: a latency spike
+        assert limiter.limit == before / 4
+    assert (limiter.done, limiter.throttled) == (9, 2)
+    assert "requetes/s" in limiter.summary()
+
+
+def test_adaptive_limiter_bounds_calls_in_flight():
+    limiter = llm.AdaptiveLimiter(initial=2, maximum=2)
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def call(_):
+        started = limiter.acquire()
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        limiter.release(started)
+
+    with ThreadPoolExecutor(6) as executor:
+        list(executor.map(call, range(12)))
+    assert peak[0] == 2
+
+
+class _FakeStream:
+    # streamed answer; with a `gate`, nothing comes before the gate opens
+    def __init__(self, text, gate=None, usage=None):
+        self.text, self.gate, self.usage, self.closed = text, gate, usage, threading.Event()
+
+    def __iter__(self):
+        while self.gate is not None and not self.gate.is_set():
+            if self.closed.wait(0.01):
+                raise RuntimeError("stream closed")
+        yield mock.Mock(choices=[mock.Mock(delta=mock.Mock(content=self.text))], usage=None)
+        if self.usage is not None:  # last chunk with stream_options include_usage
+            yield mock.Mock(choices=[], usage=self.usage)
+
+    def close(self):
+        self.closed.set()
+
+
+def _warm_hedging_pool(budget, limiter=None):
+    # two fast endpoints, then `slow` streams only once the returned event is set
+    slow, fast = _fake_client(), _fake_client()
+    pool = llm.LLMPool([slow, fast], hedge_budget=budget, limiter=limiter)
+    for _ in range(config.LLM_HEDGE_MIN_SAMPLES):  # learn the usual duration
+        pool.create(hedge=True, model="m", messages=[])
+    release = threading.Event()
+    slow.stream = _FakeStream("lent", gate=release)
+    slow.chat.completions.create.side_effect = lambda **kw: slow.stream
+    fast.chat.completions.create.side_effect = lambda **kw: _FakeStream("rapide")
+    return pool, slow, fast, release
+
+
+def _answer(response):
+    return response.choices[0].message.content
+
+
+def _wait_until(condition):
+    deadline = time.monotonic() + 2
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_llm_pool_hedges_slow_request():
+    pool, slow, fast, release = _warm_hedging_pool(budget=0.1)
+    calls = fast.chat.completions.create.call_count
+    assert _answer(pool.create(hedge=True, model="m", messages=[])) == "rapide"  # the duplicate won
+    assert fast.chat.completions.create.call_count == calls + 1
+    assert (pool.hedges, pool.hedged) == (1, config.LLM_HEDGE_MIN_SAMPLES + 1)
+    assert "1 requetes doublees" in pool.summary()
+    # the slow call is stopped and gives its slot back
+    assert _wait_until(slow.stream.closed.is_set)
+    assert _wait_until(lambda: pool.limiter.in_flight == 0)
+    release.set()
+
+
+def test_llm_pool_hedging_respects_budget():
+    pool, slow, fast, release = _warm_hedging_pool(budget=0)
+    calls = fast.chat.completions.create.call_count
+    threading.Timer(0.2, release.set).start()
+    assert _answer(pool.create(hedge=True, model="m", messages=[])) == "lent"  # no budget: waited
+    assert fast.chat.completions.create.call_count == calls
+    assert pool.hedges == 0
+
+
+def test_llm_pool_counts_usage_of_streamed_calls():
+    pool, slow, fast, release = _warm_hedging_pool(budget=0)
+    usage = mock.Mock(prompt_tokens=7, completion_tokens=3)
+    for client in (slow, fast):
+        client.chat.completions.create.side_effect = lambda **kw: _FakeStream('{"a": 1}', usage=usage)
+    before = llm.token_usage()
+    with mock.patch.object(llm, "get_pool", return_value=pool):
+        assert llm.ask([{"role": "user", "content": "article"}], hedge=True) == '{"a": 1}'
+    after = llm.token_usage()
+    assert (after["prompt_tokens"] - before["prompt_tokens"], after["completion_tokens"] - before["completion_tokens"]) == (7, 3)
+    streamed = [
+        call.kwargs for client in (slow, fast)
+        for call in client.chat.completions.create.call_args_list if call.kwargs.get("stream")
+    ]
+    assert streamed and all(kw["stream_options"] == {"include_usage": True} for kw in streamed)
+
+
+def test_llm_pool_does_not_hedge_when_saturated():
+    limiter = llm.AdaptiveLimiter(initial=1, maximum=1)
+    pool, slow, fast, release = _warm_hedging_pool(budget=1, limiter=limiter)
+    calls = fast.chat.completions.create.call_count
+    threading.Timer(0.2, release.set).start()
+    # the only slot is taken: a duplicate would just queue behind it
+    assert _answer(pool.create(hedge=True, model="m", messages=[])) == "lent"
+    assert fast.chat.completions.create.call_count == calls
+    assert pool.hedges == 0
+
+
+def test_llm_pool_does_not_retry_bad_requests():
+    bad, other = _fake_client(), _fake_client()
+    bad.chat.completions.create.side_effect = ValueError("requete invalide")
+    with pytest.raises(ValueError):
+        llm.LLMPool([bad, other]).create(model="m", messages=[])
+    other.chat.completions.create.assert_not_called()
+
+
 # --------------------------------------------------------------------------- #
 # Categories as a Reference List into the Rubriques table
 # --------------------------------------------------------------------------- #
@@ -149,6 +397,19 @@ def test_process_row_duplicate(vocab, examples):
     assert set(fields) == {"Traitement"}  # nothing else touched
 
 
+def test_process_row_canonical_duplicate(vocab, examples):
+    rows = [
+        {"id": 5, config.COL_LINK: "https://www.x.fr/a"},
+        {"id": 9, config.COL_LINK: "[x](http://x.fr/a/?utm_medium=chat)"},
+    ]
+    duplicate_of = cv.find_canonical_duplicates(rows)
+    assert duplicate_of == {9: 5}
+    with mock.patch.object(cv, "fetch_if_working") as fetch:
+        fields = cv.process_row(rows[1], vocab, examples, mock.Mock(), duplicate_of=5)
+        fetch.assert_not_called()  # no page fetch, no LLM call
+    assert fields["Traitement"].startswith("Ignore : doublon de la ligne 5")
+
+
 def test_process_row_no_working_link(vocab, examples):
     with mock.patch.object(cv, "fetch_if_working", return_value=None):
         fields = cv.process_row(
@@ -177,6 +438,19 @@ def test_process_row_happy_path(vocab, examples):
     assert config.COL_LINK not in fields  # original link worked -> not rewritten
 
 
+def test_process_row_passes_the_llm_options(vocab, examples):
+    # the same steps as the stages of complete_table, with the same options
+    answers = mock.Mock()
+    with mock.patch.object(cv, "fetch_if_working", return_value=FAKE_HTML), \
+         mock.patch.object(cv, "analyze_article", return_value={"titre": "T", "resume": "", "categories": []}) as analyze:
+        cv.process_row(
+            {"id": 11, config.COL_LINK: "https://live.fr/a"}, vocab, examples, mock.Mock(),
+            llm_cache=answers, hedge=True,
+        )
+    assert analyze.call_args.kwargs["cache"] is answers
+    assert analyze.call_args.kwargs["hedge"] is True
+
+
 def test_process_row_writes_category_as_rubriques_refs(vocab, examples):
     # With a name->id map, the category is written as Rubriques row ids, not names.
     fake_llm = {"titre": "T", "resume": "R", "categories": ["IA", "fun"]}
@@ -217,10 +491,11 @@ def test_process_row_keeps_lien_article_when_original_works(vocab, examples):
 def test_process_row_writes_back_backup_link_from_resume(vocab, examples):
     fake_llm = {"titre": "T", "resume": "R", "categories": ["IA"]}
 
-    def fake_fetch(url, logger):  # only the Resume backup responds
+    def fake_fetch(url, logger, cache=None, scheduler=None, health=None):  # only the Resume backup responds
         return FAKE_HTML if url == "https://backup.fr" else None
 
-    with mock.patch.object(cv, "fetch_if_working", side_effect=fake_fetch), \
+    with mock.patch.object(cv, "probe_link", side_effect=lambda url, *args: url == "https://backup.fr"), \
+         mock.patch.object(cv, "fetch_if_working", side_effect=fake_fetch), \
          mock.patch.object(cv, "ask_json", return_value=fake_llm):
         fields = cv.process_row(
             {"id": 21, config.COL_DUPLICATE: 1, config.COL_LINK: "https://dead.fr",
@@ -232,7 +507,8 @@ def test_process_row_writes_back_backup_link_from_resume(vocab, examples):
 
 def test_process_row_writes_back_link_extracted_from_markdown(vocab, examples):
     fake_llm = {"titre": "T", "resume": "R", "categories": ["IA"]}
-    with mock.patch.object(cv, "fetch_if_working", return_value=FAKE_HTML), \
+    with mock.patch.object(cv, "probe_link", return_value=True), \
+         mock.patch.object(cv, "fetch_if_working", return_value=FAKE_HTML), \
          mock.patch.object(cv, "ask_json", return_value=fake_llm):
         fields = cv.process_row(
             {"id": 22, config.COL_DUPLICATE: 1,
@@ -243,6 +519,230 @@ def test_process_row_writes_back_link_extracted_from_markdown(vocab, examples):
     assert fields[config.COL_LINK] == "https://clean.fr/a"  # clean URL written back
 
 
+def _streamed(text, content_type="text/html", status_code=200, charset="utf-8"):
+    # streamed `requests` response, used as a context manager
+    resp = mock.MagicMock(status_code=status_code, headers={"Content-Type": content_type})
+    resp.__enter__.return_value = resp
+    resp.iter_content.return_value = [text.encode(charset)]
+    return resp
+
+
+def test_resolve_working_link_probes_candidates_at_once():
+    timeout = 0.2
+    row = {
+        config.COL_LINK: "https://dead1.fr",
+        config.COL_RESUME: "https://dead2.fr https://dead3.fr https://live.fr https://live2.fr",
+    }
+
+    responses = []
+
+    def fake_get(url, **kwargs):
+        if "dead" in url:
+            time.sleep(timeout)
+            raise cv.requests.Timeout()
+        resp = _streamed(FAKE_HTML)
+        responses.append((url, resp))
+        return resp
+
+    start = time.perf_counter()
+    with mock.patch.object(cv.requests, "get", side_effect=fake_get):
+        url, html = cv.resolve_working_link(row, mock.Mock())
+    assert time.perf_counter() - start < 2 * timeout  # one timeout, not three
+    assert (url, html) == ("https://live.fr", FAKE_HTML)  # priority order, not speed
+    downloads = [url for url, resp in responses if resp.iter_content.called]
+    assert downloads == ["https://live.fr"]  # only the winner's body
+    assert [url for url, resp in responses].count("https://live.fr") == 1  # read from its probe
+
+
+def test_resolve_working_link_reuses_the_probe_response():
+    row = {config.COL_LINK: "https://a.fr", config.COL_RESUME: "https://b.fr"}
+    responses = {}
+
+    def fake_get(url, **kwargs):
+        responses[url] = _streamed(FAKE_HTML)
+        return responses[url]
+
+    with mock.patch.object(cv.requests, "get", side_effect=fake_get) as get, \
+         mock.patch.object(cv, "fetch_if_working") as fetch:
+        assert cv.resolve_working_link(row, mock.Mock()) == ("https://a.fr", FAKE_HTML)
+        fetch.assert_not_called()  # no second request for the winner
+    assert get.call_count <= 2  # one probe per candidate at most
+    if "https://b.fr" in responses:  # the loser was stopped before reading its page
+        assert _wait_until(lambda: responses["https://b.fr"].__exit__.called)
+        responses["https://b.fr"].iter_content.assert_not_called()
+
+
+def test_resolve_working_link_priority_beats_speed():
+    row = {config.COL_LINK: "https://slow.fr", config.COL_RESUME: "https://fast.fr"}
+
+    def fake_probe(url, *args):
+        time.sleep(0.05 if url == "https://slow.fr" else 0)
+        return True
+
+    with mock.patch.object(cv, "probe_link", side_effect=fake_probe), \
+         mock.patch.object(cv, "fetch_if_working", side_effect=lambda url, logger, cache, scheduler, health: url):
+        assert cv.resolve_working_link(row, mock.Mock())[0] == "https://slow.fr"
+
+
+def test_fetch_if_working_skips_non_html():
+    pdf = _streamed("%PDF-1.7", content_type="application/pdf")
+    with mock.patch.object(cv.requests, "get", return_value=pdf):
+        assert cv.fetch_if_working("https://a.fr/doc.pdf", mock.Mock()) is None
+    pdf.iter_content.assert_not_called()  # never downloaded
+    with mock.patch.object(cv.requests, "get", return_value=pdf):
+        assert not cv.probe_link("https://a.fr/doc.pdf", mock.Mock())
+
+
+def test_fetch_if_working_reads_a_bounded_prefix():
+    page = _streamed("", content_type="text/html; charset=ISO-8859-1")
+    page.iter_content.return_value = iter([("é" * 10).encode("latin-1")] * 1000)  # 10 kB
+    with mock.patch.object(cv.requests, "get", return_value=page), \
+         mock.patch.object(cv, "MAX_PAGE_BYTES", 25):
+        html = cv.fetch_if_working("https://a.fr", mock.Mock())
+    assert html == "é" * 25  # decoded with the declared charset, cut at the budget
+
+
+def test_fetch_if_working_wraps_plain_text():
+    with mock.patch.object(cv.requests, "get", return_value=_streamed("a < b", "text/plain")):
+        html = cv.fetch_if_working("https://a.fr/notes.txt", mock.Mock())
+    assert cv.html_to_text(html) == "a < b"
+
+
+# --------------------------------------------------------------------------- #
+# html_to_text against the former BeautifulSoup version
+# --------------------------------------------------------------------------- #
+def _html_to_text_bs(html, max_chars=config.MAX_ARTICLE_CHARS):
+    # html_to_text as it was before the streaming parser: the golden reference
+    soup = BeautifulSoup(html or "", "html.parser")
+    for tag in soup(["script", "style", "noscript"]):
+        tag.decompose()
+    parts = []
+    if soup.title and soup.title.get_text(strip=True):
+        parts.append(soup.title.get_text(strip=True))
+    meta = soup.find("meta", attrs={"name": "description"}) or soup.find(
+        "meta", attrs={"property": "og:description"}
+    )
+    if meta and meta.get("content"):
+        parts.append(meta["content"].strip())
+    body = re.sub(r"\s+", " ", soup.get_text(separator=" ", strip=True))
+    parts.append(body)
+    return "\n".join(p for p in parts if p)[:max_chars]
+
+
+_ARTICLE = "".join(
+    f"<p>Paragraphe {i} : la statistique publique &amp; l'IA, <a href='/x'>lien</a>"
+    f"<br/>suite&nbsp;du texte   sur\nplusieurs lignes.</p>"
+    for i in range(400)
+)
+# a page fed to the parser in several chunks, with text nodes (one with an
+# entity) crossing the chunk boundaries
+_SCRIPT = "<html><body><script>" + "x" * (cv._PARSE_CHUNK - 40) + "</script><p>"
+_CHUNKED_PAGE = (
+    _SCRIPT + "a" * (cv._PARSE_CHUNK - len(_SCRIPT) - 3) + "bcdef hello world</p>"
+    + "<script>" + "y" * (cv._PARSE_CHUNK - 30) + "</script><p>un &amp; deux, trois</p></body></html>"
+)
+PAGES = [
+    "",
+    FAKE_HTML,
+    "texte sans balise",
+    "<html><head><title>  Titre \n long </title></head><body>Corps</body></html>",
+    # description: name first, og as fallback, empty content does not fall back
+    '<meta property="og:description" content="og"><meta name="description" content=" d ">x',
+    '<meta property="og:description" content=" og "><p>x</p>',
+    '<meta name="description"><meta property="og:description" content="og">x',
+    '<meta name="Description" content="casse">x',
+    # skipped blocks, including what they hide
+    "<script>var a = '<p>non</p>';</script><style>p {}</style><noscript><title>N</title>"
+    "<meta name='description' content='N'>ns</noscript><title>T</title>oui",
+    "<title>A<b>B</b> C</title><svg><title>svg</title></svg>",
+    "<p>&eacute;t&eacute; &lt;b&gt; &#233; &copy; a&amp;b</p>",
+    "<!-- commentaire --><!DOCTYPE html><p>apres</p><![CDATA[donnees]]>",
+    "<div>un<div>deux</div>trois</div><ul><li>a</li><li>b</li></ul>",
+    "<p>non ferme<p>second <b>gras<i>italique</b> fin",
+    "<html><head><title>Long</title><meta name='description' content='Desc'></head>"
+    f"<body><nav>Menu Accueil</nav><script>x()</script>{_ARTICLE}</body></html>",
+    # longer than a parser chunk, text nodes across the chunk boundaries
+    _CHUNKED_PAGE,
+]
+
+
+@pytest.mark.parametrize("page", PAGES)
+def test_html_to_text_matches_beautifulsoup(page):
+    assert cv.html_to_text(page) == _html_to_text_bs(page)
+    assert cv.html_to_text(page, max_chars=50) == _html_to_text_bs(page, max_chars=50)
+
+
+@pytest.mark.benchmark
+def test_html_to_text_benchmark(capsys):
+    # Micro-benchmark on a long page, on demand (`pytest -m benchmark`): reading
+    # stops at the character budget instead of parsing the whole page.
+    page = PAGES[-2].replace("</body>", _ARTICLE * 5 + "</body>")
+
+    def cpu_per_page(func, n=5):
+        start = time.process_time()
+        for _ in range(n):
+            func(page)
+        return (time.process_time() - start) / n
+
+    old, new = cpu_per_page(_html_to_text_bs), cpu_per_page(cv.html_to_text)
+    with capsys.disabled():
+        print(f"\nhtml_to_text, page de {len(page) // 1000} ko : "
+              f"BeautifulSoup {old * 1000:.1f} ms, flux {new * 1000:.1f} ms ({old / new:.0f}x)")
+
+
+# --------------------------------------------------------------------------- #
+# main_content_text
+# --------------------------------------------------------------------------- #
+_MENU = "".join(f"<li><a href='/r{i}'>Rubrique {i}</a></li>" for i in range(60))
+NEWS_PAGE = (
+    "<html><head><title>Le recensement 2026</title>"
+    "<meta name='description' content='Ce qui change'></head><body>"
+    f"<header><div class='logo'>Journal</div><ul class='menu'>{_MENU}</ul></header>"
+    "<div id='cookie-banner'><p>Nous utilisons des cookies pour mesurer l'audience, "
+    "personnaliser les contenus et les publicites, acceptez-vous ?</p></div>"
+    "<div class='layout'><div class='article-body'>"
+    + "".join(
+        f"<p>Le recensement de la population, paragraphe {i}, decrit la methode, "
+        "les resultats et les limites de l'enquete annuelle, avec des chiffres detailles.</p>"
+        for i in range(6)
+    )
+    + "</div><div class='sidebar'><p>A lire aussi : "
+    + " ".join(f"<a href='/a{i}'>un autre article numero {i}</a>" for i in range(10))
+    + "</p></div></div>"
+    f"<footer><p>Mentions legales, plan du site, contact, abonnement.</p>{_MENU}</footer>"
+    "</body></html>"
+)
+
+
+def test_main_content_text_keeps_the_article_only():
+    text = cv.main_content_text(NEWS_PAGE)
+    assert text.startswith("Le recensement 2026\nCe qui change\nLe recensement de la population, paragraphe 0")
+    assert "paragraphe 5" in text
+    for noise in ("Rubrique", "cookies", "A lire aussi", "Mentions legales"):
+        assert noise not in text
+    assert len(text) < len(cv.html_to_text(NEWS_PAGE)) / 2
+
+
+def test_main_content_text_falls_back_to_whole_text():
+    assert cv.main_content_text(FAKE_HTML) == cv.html_to_text(FAKE_HTML)
+
+
+def test_complete_veille_reports_prompt_reduction():
+    targets = [{"id": 1, config.COL_PROCESS: "", config.COL_LINK: "https://a.fr"}]
+    logger = mock.Mock()
+    with mock.patch.object(ct, "GristApi", return_value=_fake_api(targets)), \
+         mock.patch.object(cv, "resolve_working_link", return_value=("https://a.fr", NEWS_PAGE)), \
+         mock.patch.object(cv, "analyze_article", return_value={"titre": "T", "resume": "", "categories": []}) as analyze, \
+         mock.patch.object(cv, "html_to_text", wraps=cv.html_to_text) as whole_text:
+        ct.complete_veille(
+            "Veille", dry_run=True, page_cache=False, llm_cache=False, link_health=False, main_content=True, logger=logger
+        )
+    assert "Rubrique" not in analyze.call_args.args[0]
+    whole_text.assert_not_called()  # measured from the main content parse
+    report = [c.args[0] for c in logger.info.call_args_list if c.args[0].startswith("Contenu principal")]
+    assert len(report) == 1 and f"au lieu de {len(cv.html_to_text(NEWS_PAGE))} " in report[0]
+
+
 # --------------------------------------------------------------------------- #
 # select_rows
 # --------------------------------------------------------------------------- #
@@ -256,6 +756,77 @@ def test_select_rows_keeps_empty_traitement_only():
     assert [r["id"] for r in cv.select_rows(rows)] == [1, 3, 4]
 
 
+# --------------------------------------------------------------------------- #
+# Structured output and field-level repair
+# --------------------------------------------------------------------------- #
+def test_analyze_article_asks_again_only_for_invalid_keys(vocab, examples):
+    article = "Corps de l'article. " * 1000
+    answers = [
+        {"titre": "T", "resume": "R", "categories": ["inconnue"]},
+        {"categories": ["IA"]},
+    ]
+    with mock.patch.object(cv, "ask_json", side_effect=answers) as ask:
+        analysis = cv.analyze_article(article, "https://a.fr", vocab, examples)
+    assert analysis == {"titre": "T", "resume": "R", "categories": ["IA"]}
+    first, repair = ask.call_args_list
+    assert first.kwargs["schema"] == cv.analysis_schema(vocab)
+    assert repair.kwargs["schema"]["required"] == ["categories"]
+    prompt = repair.args[0][-1]["content"]
+    assert "Corps de l'article" not in prompt  # title and summary are enough
+    assert "titre : T" in prompt
+    assert len(prompt) < len(first.args[0][-1]["content"]) / 10
+
+
+def test_analyze_article_repair_sends_a_short_excerpt(vocab, examples):
+    article = "x" * (5 * config.MAX_REPAIR_CHARS)
+    answers = [{"titre": "T", "categories": ["IA"]}, {"resume": "R"}]
+    with mock.patch.object(cv, "ask_json", side_effect=answers) as ask:
+        assert cv.analyze_article(article, "https://a.fr", vocab, examples)["resume"] == "R"
+    prompt = ask.call_args_list[1].args[0][-1]["content"]
+    assert "x" * config.MAX_REPAIR_CHARS in prompt
+    assert "x" * (config.MAX_REPAIR_CHARS + 1) not in prompt
+
+
+def test_ask_json_falls_back_when_schema_refused():
+    client = _fake_client()
+    refused = llm.openai.BadRequestError(
+        "response_format", response=mock.Mock(status_code=400, headers={}), body=None
+    )
+    answer = client.chat.completions.create.return_value
+    client.chat.completions.create.side_effect = [refused, answer, answer]
+    messages = [{"role": "user", "content": "article"}]
+    with mock.patch.object(llm, "_structured_output", True):
+        assert llm.ask_json(messages, client=client, schema={"type": "object"}) == {"titre": "T"}
+        assert llm.ask_json(messages, client=client, schema={"type": "object"}) == {"titre": "T"}
+    sent = [call.kwargs for call in client.chat.completions.create.call_args_list]
+    assert sent[0]["response_format"]["json_schema"]["schema"] == {"type": "object"}
+    assert "response_format" not in sent[1] and "response_format" not in sent[2]
+
+
+def test_ask_json_raises_other_bad_requests():
+    client = _fake_client()
+    too_long = llm.openai.BadRequestError(
+        "maximum context length exceeded", response=mock.Mock(status_code=400, headers={}), body=None
+    )
+    client.chat.completions.create.side_effect = [too_long]
+    with mock.patch.object(llm, "_structured_output", True):
+        with pytest.raises(llm.openai.BadRequestError):
+            llm.ask_json([{"role": "user", "content": "article"}], client=client, schema={"type": "object"})
+        assert llm._structured_output  # still asked for the next rows
+    assert client.chat.completions.create.call_count == 1
+
+
+def test_token_usage_counts_calls_and_tokens():
+    client = _fake_client()
+    client.chat.completions.create.return_value.usage = mock.Mock(prompt_tokens=100, completion_tokens=20)
+    before = llm.token_usage()
+    llm.ask([{"role": "user", "content": "article"}], client=client)
+    after = llm.token_usage()
+    assert after["calls"] - before["calls"] == 1
+    assert after["prompt_tokens"] - before["prompt_tokens"] == 100
+    assert after["completion_tokens"] - before["completion_tokens"] == 20
+
+
 # --------------------------------------------------------------------------- #
 # Fallback: unreachable link -> categorise from existing text, no overwrite
 # --------------------------------------------------------------------------- #
@@ -322,6 +893,203 @@ def test_formula_target_columns_tolerates_fetch_error():
     assert cv.formula_target_columns(api, "Veille", [config.COL_PROCESS], mock.Mock()) == []
 
 
+# --------------------------------------------------------------------------- #
+# complete_veille orchestration (Grist client mocked)
+# --------------------------------------------------------------------------- #
+def _fake_api(targets):
+    api = mock.Mock()
+    api.fetch_columns.return_value = mock.Mock(json=lambda: {"columns": []})
+
+    def fetch_table_pl(table_id, columns=None, **kwargs):
+        if table_id == config.TABLE_RUBRIQUES:
+            return pl.DataFrame({"id": [1], config.COL_RUBRIQUE_CATEGORY: ["IA"]})
+        if columns is not None:  # example rows / links of the whole table
+            return pl.DataFrame({"id": [r["id"] for r in targets], config.COL_LINK: [None] * len(targets)})
+        return pl.DataFrame(targets)
+
+    api.fetch_table_pl.side_effect = fetch_table_pl
+    api.update_records.return_value = mock.Mock(status_code=200)
+    return api
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_complete_veille_workers_keep_row_order(workers):
+    targets = [{"id": i, config.COL_PROCESS: "", config.COL_LINK: f"https://a.fr/{i}"} for i in range(1, 9)]
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def fake_analyze(text, url, *args, **kwargs):
+        row_id = int(url.rsplit("/", 1)[1])
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02 * (9 - row_id))  # first rows are the slowest
+        with lock:
+            running[0] -= 1
+        if row_id == 5:
+            raise RuntimeError("boom")
+        return {"titre": f"ok {row_id}", "resume": "", "categories": []}
+
+    api = _fake_api(targets)
+    with mock.patch.object(ct, "GristApi", return_value=api), \
+         mock.patch.object(cv, "resolve_working_link", side_effect=lambda row, *args: (row[config.COL_LINK], FAKE_HTML)), \
+         mock.patch.object(cv, "analyze_article", side_effect=fake_analyze):
+        updates = ct.complete_veille(
+            "Veille", workers=workers, page_cache=False, llm_cache=False, link_health=False, logger=mock.Mock()
+        )
+
+    assert [u["id"] for u in updates] == list(range(1, 9))  # deterministic order
+    assert updates[4]["fields"][config.COL_PROCESS].startswith("ERREUR : boom")  # isolated
+    assert updates[5]["fields"][config.COL_TITLE] == "ok 6"
+    assert peak[0] == workers
+    written = [r["id"] for call in api.update_records.call_args_list for r in call.kwargs["json"]["records"]]
+    assert sorted(written) == list(range(1, 9))
+
+
+def test_complete_veille_parses_pages_in_processes():
+    targets = [{"id": i, config.COL_PROCESS: "", config.COL_LINK: f"https://a.fr/{i}"} for i in range(1, 5)]
+
+    def run(parse_workers):
+        with mock.patch.object(ct, "GristApi", return_value=_fake_api(targets)), \
+             mock.patch.object(cv, "resolve_working_link", side_effect=lambda row, *args: (row[config.COL_LINK], NEWS_PAGE)), \
+             mock.patch.object(cv, "analyze_article", side_effect=lambda text, *args, **kwargs: {"titre": text[:60], "resume": "", "categories": []}):
+            return ct.complete_veille(
+                "Veille", dry_run=True, page_cache=False, llm_cache=False, link_health=False, main_content=True,
+                parse_workers=parse_workers, logger=mock.Mock(),
+            )
+
+    def titles(updates):
+        return [u["fields"][config.COL_TITLE] for u in updates]
+
+    in_processes = run(parse_workers=2)
+    assert titles(in_processes) == titles(run(parse_workers=None))
+    assert titles(in_processes)[0].startswith("Le recensement 2026")
+
+
+def test_complete_veille_stages_have_their_own_limits():
+    targets = [{"id": i, config.COL_PROCESS: "", config.COL_LINK: f"https://a.fr/{i}"} for i in range(1, 13)]
+    running, peak, lock = {"fetch": 0, "llm": 0}, {"fetch": 0, "llm": 0}, threading.Lock()
+
+    def counted(stage, result, delay):
+        def call(*args, **kwargs):
+            with lock:
+                running[stage] += 1
+                peak[stage] = max(peak[stage], running[stage])
+            time.sleep(delay)
+            with lock:
+                running[stage] -= 1
+            return result
+        return call
+
+    logger = mock.Mock()
+    with mock.patch.object(ct, "GristApi", return_value=_fake_api(targets)), \
+         mock.patch.object(cv, "resolve_working_link", side_effect=counted("fetch", ("https://a.fr", FAKE_HTML), 0.005)), \
+         mock.patch.object(cv, "analyze_article", side_effect=counted("llm", {"titre": "T", "resume": "", "categories": []}, 0.03)):
+        updates = ct.complete_veille(
+            "Veille", fetch_workers=3, llm_workers=2, dry_run=True,
+            page_cache=False, llm_cache=False, link_health=False, logger=logger,
+        )
+
+    assert len(updates) == 12
+    assert peak == {"fetch": 3, "llm": 2}
+    summary = [c.args[0] for c in logger.info.call_args_list if c.args[0].startswith("etape")]
+    assert [line.split()[1] for line in summary] == ["fetch", "texte", "llm", "ecriture"]
+
+
+def test_pipeline_back_pressure():
+    # A fast stage in front of a slow one: the bounded queues stop it from
+    # running ahead, so only a few fetched pages wait for the LLM at a time.
+    pending, peak, lock = [0], [0], threading.Lock()
+
+    def fetch(item):
+        with lock:
+            pending[0] += 1
+            peak[0] = max(peak[0], pending[0])
+        return item
+
+    def llm_call(item):
+        time.sleep(0.01)
+        with lock:
+            pending[0] -= 1
+        return item
+
+    stages = [pipeline.Stage("fetch", fetch, workers=2), pipeline.Stage("llm", llm_call)]
+    pipeline.run_pipeline(range(30), stages)
+    # <= 2 fetch workers + queue of 1 + 1 call in progress
+    assert peak[0] <= 4
+    assert [stage.items for stage in stages] == [30, 30]
+    assert stages[1].utilisation() > stages[0].utilisation()  # the bottleneck
+
+
+def test_pipeline_stopped_early_waits_for_running_items():
+    # The caller flushes and closes its caches right after: nothing may still
+    # be running in a stage function then.
+    finished = threading.Event()
+
+    def stage(item):
+        if item == 0:
+            raise RuntimeError("boom")
+        time.sleep(0.2)
+        finished.set()
+        return item
+
+    with pytest.raises(RuntimeError):
+        pipeline.run_pipeline(range(2), [pipeline.Stage("fetch", stage, workers=2)])
+    assert finished.is_set()
+
+
+
+def _interrupt_after(seconds):
+    # Ctrl+C, as the user would press it
+    threading.Timer(seconds, signal.raise_signal, args=(signal.SIGINT,)).start()
+
+
+def test_pipeline_interrupted_writes_every_analysed_item():
+    analysed, written = [], []
+
+    def llm_call(item):
+        time.sleep(0.02)
+        analysed.append(item)
+        return item
+
+    def write(item):
+        time.sleep(0.01)  # slower than the LLM: items wait in its queue
+        written.append(item)
+        return item
+
+    stages = [
+        pipeline.Stage("fetch", lambda item: item, workers=2),
+        pipeline.Stage("llm", llm_call, workers=4),
+        pipeline.Stage("ecriture", write, queue_size=4),
+    ]
+    _interrupt_after(0.15)
+    with pytest.raises(KeyboardInterrupt):
+        pipeline.run_pipeline(range(1000), stages)
+    assert 0 < len(analysed) < 1000
+    assert sorted(written) == sorted(analysed)
+
+
+def test_complete_veille_interrupted_writes_every_analysed_row():
+    targets = [{"id": i, config.COL_PROCESS: "", config.COL_LINK: f"https://a.fr/{i}"} for i in range(1, 201)]
+    api, analysed = _fake_api(targets), []
+
+    def fake_analyze(text, url, *args, **kwargs):
+        time.sleep(0.02)
+        analysed.append(int(url.rsplit("/", 1)[1]))
+        return {"titre": "T", "resume": "", "categories": []}
+
+    _interrupt_after(0.2)
+    with mock.patch.object(ct, "GristApi", return_value=api), \
+         mock.patch.object(cv, "resolve_working_link", side_effect=lambda row, *args: (row[config.COL_LINK], FAKE_HTML)), \
+         mock.patch.object(cv, "analyze_article", side_effect=fake_analyze):
+        with pytest.raises(KeyboardInterrupt):
+            ct.complete_veille(
+                "Veille", page_cache=False, llm_cache=False, link_health=False, workers=4, logger=mock.Mock()
+            )
+    written = [r["id"] for call in api.update_records.call_args_list for r in call.kwargs["json"]["records"]]
+    assert 0 < len(analysed) < len(targets)
+    assert sorted(written) == sorted(analysed)  # no LLM answer lost
+
+
 if __name__ == "__main__":
     # `uv run src/test/test_complete_veille.py` -> run this file through pytest.
     raise SystemExit(pytest.main([__file__, "-v", "-rs"]))
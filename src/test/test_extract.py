@@ -0,0 +1,317 @@
+"""
+Unit tests for the extraction stage (`src/data/clean_conv.py` and the
+formatting helpers it relies on).
+
+Self-contained: no network, no Grist credentials — the Tchap exports are small
+json files written to a temporary directory. Run from the repository root:
+
+    uv run pytest src/test/test_extract.py
+"""
+
+import doctest
+import json
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import os
+import sys
+
+# Allow running this file directly (`uv run src/test/test_extract.py`), not
+# only via pytest: put the repo root on sys.path so `import src...` resolves.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import polars as pl
+import pytest
+
+import src.data.clean_conv as cc
+import src.data.formatting_link as fl
+import src.data.formatting_time as ft
+import src.data.watermark as wm
+
+ROOM = "!room:agent.finances.tchap.gouv.fr"
+
+
+def _event(i, body="", formatted_body=None, ts=None):
+    content = {"body": body}
+    if formatted_body is not None:
+        content["formatted_body"] = formatted_body
+    return {
+        "content": content,
+        "event_id": f"$event{i}",
+        "origin_server_ts": ts if ts is not None else 1760297400000 + i * 60_000,
+        "room_id": ROOM,
+    }
+
+
+# --------------------------------------------------------------------------- #
+# Fixtures
+# --------------------------------------------------------------------------- #
+@pytest.fixture
+def messages():
+    return [
+        _event(0, "bonjour"),
+        _event(1, "[Insee](https://www.insee.fr)", '<a href="https://www.insee.fr">Insee</a>'),
+        _event(2, "voir https://x.fr/a", "voir https://x.fr/a"),
+        _event(3, "re", '<a href="https://www.insee.fr">encore</a>'),  # same link, later
+        _event(4, "tchap", '<a href="https://matrix.to/#/@a">@a</a>'),  # internal only
+        _event(5, "[Y](https://y.fr)", '<a href="https://y.fr">Y</a> un commentaire'),
+    ]
+
+
+@pytest.fixture
+def export_file(tmp_path, messages):
+    path = tmp_path / "export.json"
+    export = {
+        "room_name": "SSPLab - Veille",
+        "export_date": "13/10/2025",
+        "messages": messages,
+        "exported_by": "@moi",
+    }
+    path.write_text(json.dumps(export, indent=1))
+    return path
+
+
+# --------------------------------------------------------------------------- #
+# Doctests on the pure helpers
+# --------------------------------------------------------------------------- #
+@pytest.mark.parametrize("module", [wm, ft], ids=["watermark", "formatting_time"])
+def test_doctests(module):
+    result = doctest.testmod(module, verbose=False)
+    assert result.failed == 0, f"{module.__name__} doctests failed: {result}"
+
+
+# --------------------------------------------------------------------------- #
+# Streaming reader
+# --------------------------------------------------------------------------- #
+@pytest.mark.parametrize("read_size", [1, 7, 1 << 16])
+def test_iter_tchap_messages_matches_json_load(export_file, messages, read_size):
+    # Tiny chunks force values (and numbers) to be cut at every position.
+    assert list(cc.iter_tchap_messages(export_file, read_size=read_size)) == messages
+
+
+def test_iter_tchap_messages_requires_messages(tmp_path):
+    path = tmp_path / "empty.json"
+    path.write_text(json.dumps({"room_name": "x"}))
+    with pytest.raises(KeyError):
+        list(cc.iter_tchap_messages(path))
+
+
+def test_iter_conv_batches_sizes(export_file):
+    sizes = [len(batch) for batch in cc.iter_conv_batches(export_file, batch_size=4)]
+    assert sizes == [4, 2]
+
+
+# --------------------------------------------------------------------------- #
+# Vectorized link extraction
+# --------------------------------------------------------------------------- #
+BODIES = [
+    "",
+    "bonjour",
+    '<a href="https://www.insee.fr"> Insee </a>',
+    "voir https://x.fr/a et https://x.fr/b",
+    '<a href="https://matrix.to/#/@a">@a</a> https://ext.fr',  # first raw url is internal
+    '<mx-reply><a href="https://old.fr">o</a></mx-reply>new <a href="https://new.fr">N</a>',
+    '<a href="ftp://f.fr">f</a> www.insee.fr',
+    '<a data-href="https://no.fr" href="https://yes.fr">Y</a><a href="https://z.fr">Z</a>',
+    # BeautifulSoup fallback: entities, tags in the title, unusual <a> tags
+    '<a href="https://a.fr?x=1&amp;y=2">A &amp; B</a>',
+    '<a href="https://a.fr"><b>Gras</b> titre</a>',
+    "<a href='https://sq.fr'>sq</a>",
+    '<A HREF="https://up.fr">U</A>',
+    '<a title="x>y" href="https://gt.fr">C</a>',
+    '<a href="https://gt.fr" title="x>y">C</a>',
+    "<a title='a > b' href=\"https://gt2.fr\">D</a> <a href=\"https://e.fr\">E</a>",
+]
+
+
+def test_extract_links_pl_matches_beautifulsoup():
+    out = fl.extract_links_pl(pl.DataFrame({"formatted_body": BODIES}))
+    for body, link, title in zip(BODIES, out["hyperlink"], out["link_text"]):
+        ref_link, ref_title = fl.extract_link_title(body)
+        assert link == ref_link, body
+        if link is not None:
+            assert title == ref_title, body
+
+
+def test_extract_links_pl_process_pool():
+    df = pl.DataFrame({"formatted_body": BODIES * 3})
+    with ProcessPoolExecutor(2, mp_context=get_context("spawn")) as pool:
+        for all_links in (False, True):
+            out = fl.extract_links_pl(df, all_links=all_links, pool=pool)
+            assert out.equals(fl.extract_links_pl(df, all_links=all_links))
+
+
+def test_extract_links_pl_all_links():
+    df = pl.DataFrame({"formatted_body": BODIES})
+    out = fl.extract_links_pl(df, all_links=True).drop_nulls("hyperlink")
+    links = out.filter(pl.col("formatted_body") == BODIES[7])["hyperlink"].to_list()
+    assert links == ["https://yes.fr", "https://z.fr"]
+    raw = out.filter(pl.col("formatted_body") == BODIES[3])
+    assert raw["hyperlink"].to_list() == ["https://x.fr/a", "https://x.fr/b"]
+    assert raw["link_text"].to_list() == ["", ""]
+    assert "https://ext.fr" in out["hyperlink"].to_list()  # internal url skipped, not the rest
+
+
+# --------------------------------------------------------------------------- #
+# Timestamps
+# --------------------------------------------------------------------------- #
+def test_convert_unix_time_pl_matches_python():
+    # 10 and 13 digits, around the spring DST change in Paris
+    times = [1760297400, 1711846800, 1711843199000, 1700000000123]
+    df = pl.DataFrame({"origin_server_ts": times})
+    out = df.select(ft.convert_unix_time_pl(pl.col("origin_server_ts")))
+    assert out["origin_server_ts"].to_list() == [ft.convert_unix_time(t) for t in times]
+
+
+# --------------------------------------------------------------------------- #
+# Canonical urls
+# --------------------------------------------------------------------------- #
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("http://www.Insee.fr/fr/stat/?utm_source=x&id=2#haut", "https://insee.fr/fr/stat?id=2"),
+        ("www.insee.fr", "https://insee.fr"),
+        ("https://x.fr/a?fbclid=1&gclid=2", "https://x.fr/a"),
+        ("https://x.fr/A/b/", "https://x.fr/A/b"),  # path case is kept
+        ("https://app.fr/#/page", "https://app.fr#/page"),  # route fragment kept
+        (None, None),
+    ],
+)
+def test_canonical_url_python_and_polars(url, expected):
+    assert fl.canonical_url(url) == expected
+    column = pl.Series("u", [url], dtype=pl.Utf8).to_frame()
+    assert column.select(fl.canonical_url_pl(pl.col("u"))).item() == expected
+
+
+def test_clean_conv_dedups_on_canonical_link(tmp_path):
+    path = tmp_path / "export.json"
+    messages = [
+        _event(0, "a", '<a href="https://www.insee.fr/a/">Premier</a>'),
+        _event(1, "b", '<a href="http://insee.fr/a?utm_source=tchap">Second</a>'),
+    ]
+    path.write_text(json.dumps({"messages": messages}))
+    df = cc.clean_conv(path)
+    assert df["hyperlink"].to_list() == ["https://www.insee.fr/a/"]  # original url kept
+    assert df["link_key"].to_list() == ["https://insee.fr/a"]
+
+
+# --------------------------------------------------------------------------- #
+# clean_conv
+# --------------------------------------------------------------------------- #
+def test_clean_conv_streaming_matches_in_memory(export_file):
+    in_memory = cc.clean_conv(export_file).sort("hyperlink")
+    streamed = cc.clean_conv(export_file, batch_size=2).sort("hyperlink")
+    assert streamed.equals(in_memory)
+    assert in_memory["hyperlink"].to_list() == [
+        "https://www.insee.fr",
+        "https://x.fr/a",
+        "https://y.fr",
+    ]
+
+
+def test_clean_conv_keeps_first_link_and_clears_link_only_body(export_file):
+    df = cc.clean_conv(export_file, batch_size=2)
+    insee = df.filter(df["hyperlink"] == "https://www.insee.fr").to_dicts()[0]
+    assert insee["link_text"] == "Insee"  # earliest message kept
+    assert insee["body"] == ""  # body was only "[Insee](https://www.insee.fr)"
+    assert insee["origin_server_ts"] == 1760297460  # 13 -> 10 digits
+
+
+def test_clean_conv_all_links(tmp_path):
+    path = tmp_path / "export.json"
+    body = '<a href="https://a.fr">A</a> et <a href="https://b.fr">B</a>'
+    path.write_text(json.dumps({"messages": [_event(0, "a b", body)]}))
+    assert cc.clean_conv(path)["hyperlink"].to_list() == ["https://a.fr"]
+    df = cc.clean_conv(path, batch_size=10, all_links=True).sort("hyperlink")
+    assert df["link_text"].to_list() == ["A", "B"]
+    assert df["msg_link"].n_unique() == 1  # both rows point to the same message
+
+
+def test_clean_conv_empty_export(tmp_path):
+    path = tmp_path / "export.json"
+    path.write_text(json.dumps({"messages": []}))
+    assert cc.clean_conv(path).columns == cc.clean_conv(path, batch_size=10).columns
+    assert len(cc.clean_conv(path, batch_size=10)) == 0
+
+
+# --------------------------------------------------------------------------- #
+# Several exports
+# --------------------------------------------------------------------------- #
+def test_find_export_files(tmp_path, export_file):
+    (tmp_path / "b.json").write_text(json.dumps({"messages": []}))
+    (tmp_path / "notes.txt").write_text("")
+    expected = [str(tmp_path / "b.json"), str(export_file)]
+    assert cc.find_export_files(str(tmp_path)) == expected
+    assert cc.find_export_files(str(tmp_path / "*.json")) == expected
+    assert cc.find_export_files(str(export_file)) == [str(export_file)]
+    with pytest.raises(FileNotFoundError):
+        cc.find_export_files(str(tmp_path / "missing*.json"))
+
+
+def test_clean_convs_single_export_with_processes(export_file):
+    in_processes = cc.clean_convs([str(export_file)], max_workers=2)
+    assert in_processes.sort("link_key").equals(cc.clean_conv(str(export_file)).sort("link_key"))
+
+
+def test_clean_convs_merges_exports(tmp_path, export_file):
+    other_room = "!other:agent.finances.tchap.gouv.fr"
+    later = [
+        dict(_event(10, "[Z](https://z.fr)", '<a href="https://z.fr">Z</a>'), room_id=other_room),
+        dict(  # already posted in the first export, earlier
+            _event(11, "[Insee](https://www.insee.fr)", '<a href="https://www.insee.fr">Autre</a>'),
+            room_id=other_room,
+        ),
+    ]
+    other = tmp_path / "other.json"
+    other.write_text(json.dumps({"messages": later}))
+
+    watermark = {}
+    df = cc.clean_convs([str(export_file), str(other)], watermark=watermark, max_workers=2)
+    assert sorted(df["hyperlink"].to_list()) == [
+        "https://www.insee.fr",
+        "https://x.fr/a",
+        "https://y.fr",
+        "https://z.fr",
+    ]
+    assert df.filter(df["hyperlink"] == "https://www.insee.fr")["link_text"].item() == "Insee"
+    assert set(watermark) == {ROOM, other_room}  # marks of both exports kept
+
+
+# --------------------------------------------------------------------------- #
+# Incremental extraction (watermark per room)
+# --------------------------------------------------------------------------- #
+@pytest.mark.parametrize("batch_size", [None, 2])
+def test_clean_conv_skips_ingested_messages(export_file, batch_size):
+    watermark = {}
+    assert len(cc.clean_conv(export_file, batch_size, watermark=watermark)) == 3
+    assert watermark == {ROOM: {"origin_server_ts": 1760297700000, "event_id": "$event5"}}
+    # Nothing new since the last run
+    assert len(cc.clean_conv(export_file, batch_size, watermark=watermark)) == 0
+    # Mark moved back before event 5: only its link comes back
+    watermark[ROOM] = {"origin_server_ts": 1760297640000, "event_id": "$event4"}
+    df = cc.clean_conv(export_file, batch_size, watermark=watermark)
+    assert df["hyperlink"].to_list() == ["https://y.fr"]
+
+
+def test_clean_conv_since_overrides_watermark(export_file):
+    watermark = {ROOM: {"origin_server_ts": 1760297700000, "event_id": "$event5"}}
+    df = cc.clean_conv(export_file, watermark=watermark, since=1760297520000)  # event 2
+    assert sorted(df["hyperlink"].to_list()) == [
+        "https://www.insee.fr",  # event 3 repeats the link of event 1
+        "https://x.fr/a",
+        "https://y.fr",
+    ]
+
+
+def test_watermark_roundtrip_per_table(tmp_path):
+    path = tmp_path / "marks.json"
+    assert wm.load_watermark("Veille", path) == {}
+    mark = {ROOM: {"origin_server_ts": 1, "event_id": "$a"}}
+    wm.save_watermark("Veille", mark, path)
+    wm.save_watermark("Test", {}, path)
+    assert wm.load_watermark("Veille", path) == mark
+    assert wm.load_watermark("Test", path) == {}
+
+
+if __name__ == "__main__":
+    # `uv run src/test/test_extract.py` -> run this file through pytest.
+    raise SystemExit(pytest.main([__file__, "-v", "-rs"]))
@@ -0,0 +1,258 @@
+"""
+Unit tests for the Grist client (`src/utils/access_grist_api.py`).
+
+Self-contained: no network, no real Grist credentials — `requests` is mocked
+and a dummy doc id / key are set for the duration of each test. Run from the
+repository root:
+
+    uv run pytest src/test/test_grist_api.py
+"""
+
+import json
+import os
+import sys
+
+# Allow running this file directly (`uv run src/test/test_grist_api.py`), not
+# only via pytest: put the repo root on sys.path so `import src...` resolves.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import doctest
+import gzip
+from unittest import mock
+
+import pytest
+from urllib3.exceptions import NewConnectionError
+
+import src.utils.access_grist_api as grist
+
+
+def _response(payload, status_code=200, headers=None):
+    response = mock.Mock(
+        status_code=status_code, headers=headers or {}, text=json.dumps(payload), json=lambda: payload
+    )
+    response.raise_for_status.side_effect = (
+        grist.requests.HTTPError(f"{status_code}") if status_code >= 400 else None
+    )
+    return response
+
+
+def _created(request_json, first_id=1):
+    n = len(request_json["records"])
+    return _response({"records": [{"id": first_id + i} for i in range(n)]})
+
+
+# --------------------------------------------------------------------------- #
+# Fixtures
+# --------------------------------------------------------------------------- #
+@pytest.fixture
+def api(monkeypatch):
+    monkeypatch.setenv("GRIST_VEILLE_DOC_ID", "doc")
+    monkeypatch.setenv("GRIST_SERVICE_ACCOUNT_VEILLE_KEY", "key")
+    return grist.GristApi()
+
+
+# The GristApi method examples need a live document: only the pure helpers'
+# doctests are run.
+@pytest.mark.parametrize("func", [grist._select_statement, grist._decode_list_cell])
+def test_helper_doctests(func):
+    runner = doctest.DocTestRunner()
+    for test in doctest.DocTestFinder().find(func, globs=vars(grist)):
+        runner.run(test)
+    assert runner.failures == 0, f"{func.__name__} doctests failed"
+
+
+# --------------------------------------------------------------------------- #
+# Shared transport
+# --------------------------------------------------------------------------- #
+def test_instances_share_one_pooled_session(api):
+    assert grist.GristApi().session is api.session
+    adapter = api.session.get_adapter("https://grist.numerique.gouv.fr/api")
+    assert adapter.max_retries.total == grist.GRIST_RETRIES
+    assert "POST" not in adapter.max_retries.allowed_methods  # never re-add rows
+
+
+def test_gzip_body(api):
+    api.gzip_body = True
+    body = {"records": [{"id": 1, "fields": {"Traitement": "OK"}}]}
+    with mock.patch.object(api.session, "request", return_value=_response({})) as request:
+        api.update_records("Veille", json=body)
+    kwargs = request.call_args.kwargs
+    assert kwargs["headers"]["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(kwargs["data"])) == body
+    assert "json" not in kwargs
+
+
+# --------------------------------------------------------------------------- #
+# fetch_table_pl
+# --------------------------------------------------------------------------- #
+def test_fetch_table_pl_filter_uses_records_params(api):
+    payload = {"records": [{"id": 3, "fields": {"Traitement": "", "Categorie": ["L", 1]}}]}
+    with mock.patch.object(api.session, "request", return_value=_response(payload)) as request:
+        df = api.fetch_table_pl("Veille", filter={"Traitement": [""]}, sort="id", limit=5)
+    assert request.call_args.args[0] == "GET"
+    params = request.call_args.kwargs["params"]
+    assert json.loads(params["filter"]) == {"Traitement": [""]}
+    assert (params["sort"], params["limit"]) == ("id", 5)
+    # polars stringifies the mixed ["L", <id>...] lists, as for a full fetch
+    assert df.to_dicts() == [{"id": 3, "Traitement": "", "Categorie": ["L", "1"]}]
+
+
+def test_fetch_table_pl_columns_go_through_sql(api):
+    payload = {"records": [{"fields": {"id": 1, "Lien_article": "https://a.fr", "Categorie": "[2, 3]"}}]}
+    with mock.patch.object(api.session, "request", return_value=_response(payload)) as request:
+        df = api.fetch_table_pl(
+            "Veille", columns=["Lien_article", "Categorie"], list_columns=["Categorie"]
+        )
+    assert request.call_args.args[0] == "POST"
+    assert request.call_args.args[1].endswith("/docs/doc/sql")
+    assert request.call_args.kwargs["json"]["sql"] == 'SELECT "id", "Lien_article", "Categorie" FROM "Veille"'
+    assert df.to_dicts() == [{"id": 1, "Lien_article": "https://a.fr", "Categorie": ["L", "2", "3"]}]
+
+
+def test_fetch_table_pl_no_match(api):
+    with mock.patch.object(api.session, "request", return_value=_response({"records": []})):
+        df = api.fetch_table_pl("Veille", columns=["Lien_article"], where='"A_garder" = 1')
+    assert df.columns == ["id", "Lien_article"]
+    assert len(df) == 0
+
+
+# --------------------------------------------------------------------------- #
+# add_records_bulk
+# --------------------------------------------------------------------------- #
+def test_add_records_bulk_chunks_and_ids(api):
+    records = [{"fields": {"n": i}} for i in range(5)]
+    first_ids = iter([10, 20, 30])
+    with mock.patch.object(
+        api, "add_records", side_effect=lambda table, json: _created(json, next(first_ids))
+    ) as add:
+        ids = api.add_records_bulk("Veille", records, chunk_size=2)
+    # one chunk after the other by default: row ids follow the records
+    assert [[r["fields"]["n"] for r in call.kwargs["json"]["records"]] for call in add.call_args_list] == [
+        [0, 1], [2, 3], [4]
+    ]
+    assert ids == [10, 11, 20, 21, 30]
+
+
+def test_add_records_bulk_retries_transient_errors(api):
+    answers = [
+        _response({}, 429, {"Retry-After": "3"}),
+        grist.requests.ConnectionError(NewConnectionError(None, "refused")),
+        grist.requests.ConnectTimeout("connect"),
+        _response({}, 503, {"Retry-After": "1"}),
+        _created({"records": [{}]}, 7),
+    ]
+    with mock.patch.object(api, "add_records", side_effect=answers), \
+         mock.patch.object(grist.time, "sleep") as sleep:
+        ids = api.add_records_bulk("Veille", [{"fields": {}}], backoff=0.5, retries=5)
+    assert ids == [7]
+    # Retry-After, then backoff
+    assert [call.args[0] for call in sleep.call_args_list] == [3.0, 1.0, 2.0, 1.0]
+
+
+@pytest.mark.parametrize(
+    "answer",
+    [
+        grist.requests.ConnectionError("reset"),
+        grist.requests.ReadTimeout("read"),
+        _response({}, 502),
+        _response({}, 503),
+    ],
+    ids=["reset", "read-timeout", "502", "503-without-retry-after"],
+)
+def test_add_records_bulk_does_not_resend_maybe_added_rows(api, answer):
+    # the rows may already be in the table: sending them again would duplicate them
+    with mock.patch.object(api, "add_records", side_effect=[answer]) as add, \
+         mock.patch.object(grist.time, "sleep"):
+        with pytest.raises(grist.requests.RequestException):
+            api.add_records_bulk("Veille", [{"fields": {}}])
+    assert add.call_count == 1
+
+
+def test_add_records_bulk_raises_on_permanent_error(api):
+    with mock.patch.object(api, "add_records", return_value=_response({}, 400)) as add, \
+         mock.patch.object(grist.time, "sleep"):
+        with pytest.raises(grist.requests.HTTPError):
+            api.add_records_bulk("Veille", [{"fields": {}}])
+    assert add.call_count == 1  # a 400 is not retried
+
+
+# --------------------------------------------------------------------------- #
+# UpdateBuffer
+# --------------------------------------------------------------------------- #
+def _update(row_id, **fields):
+    return {"id": row_id, "fields": {"Traitement": "OK", **fields}}
+
+
+def _patched_ids(api):
+    return [[r["id"] for r in call.kwargs["json"]["records"]] for call in api.update_records.call_args_list]
+
+
+def test_update_buffer_flushes_by_count_and_on_exit():
+    api = mock.Mock()
+    api.update_records.return_value = _response({})
+    with grist.UpdateBuffer(api, "Veille", mock.Mock(), max_records=2, max_age=3600) as buffer:
+        for row_id in (1, 2, 3):
+            buffer.add(_update(row_id))
+        assert _patched_ids(api) == [[1, 2]]
+    assert _patched_ids(api) == [[1, 2], [3]]  # the rest written on exit
+
+
+def test_update_buffer_flushes_by_age():
+    api = mock.Mock()
+    api.update_records.return_value = _response({})
+    buffer = grist.UpdateBuffer(api, "Veille", mock.Mock(), max_records=100, max_age=30)
+    with mock.patch.object(grist.time, "monotonic", side_effect=[0, 0, 31]):
+        buffer.add(_update(1))
+        buffer.add(_update(2))
+    assert _patched_ids(api) == [[1, 2]]
+
+
+def test_update_buffer_groups_records_by_columns():
+    api = mock.Mock()
+    api.update_records.return_value = _response({})
+    with grist.UpdateBuffer(api, "Veille", mock.Mock()) as buffer:
+        buffer.add(_update(1))
+        buffer.add(_update(2, Resume="R"))
+        buffer.add(_update(3))
+    assert _patched_ids(api) == [[1, 3], [2]]
+
+
+def test_update_buffer_bisects_to_the_bad_record():
+    api = mock.Mock()
+
+    def patch(table_id, json):
+        bad = any(r["id"] == 3 for r in json["records"])
+        return _response({}, 400 if bad else 200)
+
+    api.update_records.side_effect = patch
+    with grist.UpdateBuffer(api, "Veille", mock.Mock()) as buffer:
+        for row_id in range(1, 6):
+            buffer.add(_update(row_id))
+    assert buffer.failed == [3]
+    written = [ids for ids in _patched_ids(api) if 3 not in ids]
+    assert sorted(i for ids in written for i in ids) == [1, 2, 4, 5]
+
+
+def test_update_buffer_does_not_split_on_server_error():
+    api = mock.Mock()
+    api.update_records.return_value = _response({}, 500)  # the session already retried it
+    with grist.UpdateBuffer(api, "Veille", mock.Mock()) as buffer:
+        buffer.add(_update(1))
+        buffer.add(_update(2))
+    assert _patched_ids(api) == [[1, 2]]  # sent once: no record is at fault
+    assert buffer.failed == [1, 2]
+
+
+def test_update_buffer_flushes_on_interrupt():
+    api = mock.Mock()
+    api.update_records.return_value = _response({})
+    with pytest.raises(KeyboardInterrupt):
+        with grist.UpdateBuffer(api, "Veille", mock.Mock()) as buffer:
+            buffer.add(_update(1))
+            raise KeyboardInterrupt  # Ctrl+C while the next row is being processed
+    assert _patched_ids(api) == [[1]]
+
+
+if __name__ == "__main__":
+    # `uv run src/test/test_grist_api.py` -> run this file through pytest.
+    raise SystemExit(pytest.main([__file__, "-v", "-rs"]))
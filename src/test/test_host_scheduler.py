@@ -0,0 +1,145 @@
+"""
+Unit tests for the per-site politeness limits (`src/utils/host_scheduler.py`)
+and their use by `fetch_if_working`.
+
+Self-contained: no network — `requests.get` is mocked. Run from the repository
+root:
+
+    uv run pytest src/test/test_host_scheduler.py
+"""
+
+import os
+import sys
+
+# Allow running this file directly (`uv run src/test/test_host_scheduler.py`),
+# not only via pytest: put the repo root on sys.path so `import src...` resolves.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import doctest
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+
+import src.data.complete_veille as cv
+import src.utils.config as config
+import src.utils.host_scheduler as hs
+
+PAGE = "<html><body>Contenu</body></html>"
+
+
+def _page(status_code=200, headers=None, text=PAGE):
+    # streamed `requests` response, used as a context manager
+    resp = mock.MagicMock(status_code=status_code, headers={"Content-Type": "text/html", **(headers or {})})
+    resp.__enter__.return_value = resp
+    resp.iter_content.return_value = [text.encode("utf-8")]
+    return resp
+
+
+def test_doctests():
+    result = doctest.testmod(hs, verbose=False)
+    assert result.failed == 0, f"host_scheduler doctests failed: {result}"
+
+
+# --------------------------------------------------------------------------- #
+# HostScheduler
+# --------------------------------------------------------------------------- #
+def test_concurrency_is_capped_per_host():
+    scheduler = hs.HostScheduler(max_concurrency=2, rate=1000, burst=100)
+    running, peak, lock = {}, {}, threading.Lock()
+
+    def request(url):
+        host = hs.host_of(url)
+        with scheduler.slot(url):
+            with lock:
+                running[host] = running.get(host, 0) + 1
+                peak[host] = max(peak.get(host, 0), running[host])
+            time.sleep(0.03)
+            with lock:
+                running[host] -= 1
+
+    urls = [f"https://www.a.fr/{i}" for i in range(6)] + [f"https://b.fr/{i}" for i in range(2)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(request, urls))
+    assert peak == {"a.fr": 2, "b.fr": 2}
+    assert time.perf_counter() - start < 0.2  # b.fr did not wait behind a.fr
+
+
+def test_rate_is_limited_per_host():
+    scheduler = hs.HostScheduler(max_concurrency=10, rate=20, burst=1)
+    start = time.perf_counter()
+    for _ in range(5):
+        with scheduler.slot("https://a.fr"):
+            pass
+    assert time.perf_counter() - start >= 4 / 20 * 0.9  # first one free, then 1/20 s each
+    with scheduler.slot("https://b.fr"):  # other host: its own bucket
+        pass
+
+
+def test_rate_must_be_positive():
+    for rate in (0, -1):
+        with pytest.raises(ValueError):
+            hs.HostScheduler(rate=rate)
+
+
+# --------------------------------------------------------------------------- #
+# Link probes of resolve_working_link
+# --------------------------------------------------------------------------- #
+def test_probe_waiting_for_its_turn_frees_its_slot():
+    # The live link waits for the dead one before it: meanwhile, the only
+    # slot of its site stays free for the other rows.
+    scheduler = hs.HostScheduler(max_concurrency=1, rate=1000, burst=100)
+    row = {config.COL_LINK: "https://dead.fr", config.COL_RESUME: "https://live.fr/a"}
+    waiting = threading.Event()
+
+    def fake_get(url, **kwargs):
+        if "dead" in url:
+            waiting.wait(2)
+            time.sleep(0.1)
+            raise cv.requests.Timeout()
+        waiting.set()
+        return _page()
+
+    with mock.patch.object(cv.requests, "get", side_effect=fake_get), \
+         ThreadPoolExecutor(1) as pool:
+        race = pool.submit(cv.resolve_working_link, row, mock.Mock(), None, scheduler)
+        waiting.wait(2)
+        time.sleep(0.02)
+        start = time.perf_counter()
+        with scheduler.slot("https://live.fr/b"):  # another row's request
+            assert time.perf_counter() - start < 0.05
+        assert race.result() == ("https://live.fr/a", PAGE)
+
+
+# --------------------------------------------------------------------------- #
+# Retry-After through fetch_if_working
+# --------------------------------------------------------------------------- #
+def test_fetch_waits_for_retry_after():
+    scheduler = hs.HostScheduler()
+    answers = [_page(429, {"Retry-After": "0.1"}), _page()]
+    start = time.perf_counter()
+    with mock.patch.object(cv.requests, "get", side_effect=answers) as get:
+        assert cv.fetch_if_working("https://a.fr", mock.Mock(), scheduler=scheduler) == PAGE
+    assert get.call_count == 2
+    assert time.perf_counter() - start >= 0.1
+
+
+def test_fetch_gives_up_on_long_retry_after():
+    scheduler = hs.HostScheduler(max_retry_after=5)
+    with mock.patch.object(cv.requests, "get", return_value=_page(429, {"Retry-After": "3600"})) as get:
+        assert cv.fetch_if_working("https://a.fr", mock.Mock(), scheduler=scheduler) is None
+    assert get.call_count == 1
+
+
+def test_fetch_without_scheduler_does_not_retry():
+    with mock.patch.object(cv.requests, "get", return_value=_page(429, {"Retry-After": "0"})) as get:
+        assert cv.fetch_if_working("https://a.fr", mock.Mock()) is None
+    assert get.call_count == 1
+
+
+if __name__ == "__main__":
+    # `uv run src/test/test_host_scheduler.py` -> run this file through pytest.
+    raise SystemExit(pytest.main([__file__, "-v", "-rs"]))
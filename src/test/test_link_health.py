@@ -0,0 +1,138 @@
+"""
+Unit tests for the dead links memory (`src/utils/link_health.py`) and its use
+by `fetch_if_working` / `resolve_working_link`.
+
+Self-contained: no network — `requests.get` is mocked and the sqlite file lives
+in a temp dir. Run from the repository root:
+
+    uv run pytest src/test/test_link_health.py
+"""
+
+import os
+import sys
+
+# Allow running this file directly (`uv run src/test/test_link_health.py`), not
+# only via pytest: put the repo root on sys.path so `import src...` resolves.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import doctest
+from unittest import mock
+
+import pytest
+import requests
+
+import src.data.complete_veille as cv
+import src.utils.config as config
+import src.utils.link_health as lh
+from src.utils.link_health import LinkHealth
+
+PAGE = "<html><body>Contenu</body></html>"
+
+
+def _page(status_code=200):
+    # streamed `requests` response, used as a context manager
+    resp = mock.MagicMock(status_code=status_code, headers={"Content-Type": "text/html"})
+    resp.__enter__.return_value = resp
+    resp.iter_content.return_value = [PAGE.encode("utf-8")]
+    return resp
+
+
+def test_doctests():
+    result = doctest.testmod(lh, verbose=False)
+    assert result.failed == 0, f"link_health doctests failed: {result}"
+
+
+# --------------------------------------------------------------------------- #
+# Fixtures
+# --------------------------------------------------------------------------- #
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "health.sqlite")
+
+
+@pytest.fixture
+def health(path):
+    health = LinkHealth(path=path)
+    yield health
+    health.close()
+
+
+# --------------------------------------------------------------------------- #
+# LinkHealth
+# --------------------------------------------------------------------------- #
+def test_failure_is_remembered_between_runs(path):
+    health = LinkHealth(path=path)
+    health.failed("https://a.fr/gone", "4xx")
+    health.failed("https://a.fr/ok", None)  # nothing worth remembering
+    health.close()
+
+    health = LinkHealth(path=path)
+    assert health.dead("https://a.fr/gone") == "4xx"
+    assert health.dead("https://a.fr/ok") is None
+    assert health.dead("https://a.fr/other") is None  # a 404 says nothing of the site
+    assert health.skipped == 1
+    health.close()
+
+
+def test_failure_expires_with_its_ttl(path):
+    health = LinkHealth(path=path, ttl={"4xx": 100, "5xx": 10})
+    with mock.patch("src.utils.link_health.time.time", return_value=1000.0):
+        health.failed("https://a.fr/gone", "4xx")
+        health.failed("https://a.fr/error", "5xx")
+    with mock.patch("src.utils.link_health.time.time", return_value=1050.0):
+        assert health.dead("https://a.fr/gone") == "4xx"
+        assert health.dead("https://a.fr/error") is None
+    health.close()
+
+
+def test_dns_failure_covers_the_whole_site(path):
+    health = LinkHealth(path=path, trip_after=10)
+    health.failed("https://www.gone.fr/a", "dns")
+    health.close()
+
+    health = LinkHealth(path=path)
+    assert health.dead("https://gone.fr/b") == "dns (site)"
+    health.worked("https://gone.fr/c")  # answers again: forgiven
+    assert health.dead("https://gone.fr/b") is None
+    assert health.dead("https://www.gone.fr/a") == "dns"
+    health.close()
+
+
+def test_site_failing_twice_is_skipped_for_the_run(path):
+    health = LinkHealth(path=path, trip_after=2)
+    health.failed("https://slow.fr/1", "timeout")
+    assert health.dead("https://slow.fr/2") is None
+    health.failed("https://slow.fr/2", "timeout")
+    assert health.dead("https://slow.fr/3") == "site hors service"
+    assert health.down == {"slow.fr"}
+    health.close()
+
+    health = LinkHealth(path=path)  # the next run tries the site again
+    assert health.dead("https://slow.fr/3") is None
+    health.close()
+
+
+# --------------------------------------------------------------------------- #
+# fetch_if_working / resolve_working_link
+# --------------------------------------------------------------------------- #
+def test_fetch_records_the_outcome(health):
+    error = requests.exceptions.ConnectionError("Failed to resolve 'gone.fr' (NameResolutionError)")
+    with mock.patch.object(cv.requests, "get", side_effect=error):
+        assert cv.fetch_if_working("https://gone.fr/a", mock.Mock(), health=health) is None
+    with mock.patch.object(cv.requests, "get", return_value=_page(404)):
+        assert cv.fetch_if_working("https://a.fr/gone", mock.Mock(), health=health) is None
+    assert health.dead("https://gone.fr/b") == "dns (site)"
+    assert health.dead("https://a.fr/gone") == "4xx"
+
+
+def test_resolve_skips_known_dead_links(health):
+    health.failed("https://a.fr/gone", "4xx")
+    row = {config.COL_LINK: "https://a.fr/gone", config.COL_RESUME: "voir https://b.fr/ok"}
+    with mock.patch.object(cv.requests, "get", return_value=_page()) as get:
+        assert cv.resolve_working_link(row, mock.Mock(), health=health) == ("https://b.fr/ok", PAGE)
+    assert [call.args[0] for call in get.call_args_list] == ["https://b.fr/ok"]
+
+
+if __name__ == "__main__":
+    # `uv run src/test/test_link_health.py` -> run this file through pytest.
+    raise SystemExit(pytest.main([__file__, "-v", "-rs"]))
@@ -0,0 +1,111 @@
+"""
+Unit tests for the on-disk article cache (`src/utils/page_cache.py`) and its
+use by `fetch_if_working` / `resolve_working_link`.
+
+Self-contained: no network — `requests.get` is mocked and the cache lives in a
+temp dir. Run from the repository root:
+
+    uv run pytest src/test/test_page_cache.py
+"""
+
+import os
+import sys
+
+# Allow running this file directly (`uv run src/test/test_page_cache.py`), not
+# only via pytest: put the repo root on sys.path so `import src...` resolves.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import zlib
+from unittest import mock
+
+import pytest
+
+import src.data.complete_veille as cv
+import src.utils.config as config
+from src.utils.page_cache import PageCache
+
+PAGE = "<html><head><title>T</title></head><body>Contenu</body></html>"
+
+
+def _page(text=PAGE, status_code=200, url="https://a.fr/", headers=None):
+    # streamed `requests` response, used as a context manager
+    resp = mock.MagicMock(status_code=status_code, url=url, headers=headers or {})
+    resp.__enter__.return_value = resp
+    resp.iter_content.return_value = [text.encode("utf-8")]
+    return resp
+
+
+# --------------------------------------------------------------------------- #
+# Fixtures
+# --------------------------------------------------------------------------- #
+@pytest.fixture
+def cache(tmp_path):
+    cache = PageCache(path=str(tmp_path / "pages.sqlite"), ttl=60)
+    yield cache
+    cache.close()
+
+
+# --------------------------------------------------------------------------- #
+# PageCache
+# --------------------------------------------------------------------------- #
+def test_put_get_round_trip(cache):
+    cache.put("https://a.fr", _page(headers={"ETag": '"v1"', "Last-Modified": "Mon, 01 Jan 2024"}), PAGE)
+    entry = cache.get("https://a.fr")
+    assert entry["html"] == PAGE
+    assert (entry["final_url"], entry["status"]) == ("https://a.fr/", 200)
+    assert cache.validators(entry) == {"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Jan 2024"}
+    assert cache.has_fresh("https://a.fr")
+    assert cache.get("https://b.fr") is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    size = len(zlib.compress(PAGE.encode()))
+    cache = PageCache(path=str(tmp_path / "pages.sqlite"), max_bytes=2 * size)  # room for 2 pages
+    with mock.patch("src.utils.page_cache.time.time", side_effect=range(100)):
+        cache.put("https://1.fr", _page(), PAGE)
+        cache.put("https://2.fr", _page(), PAGE)
+        cache.get("https://1.fr")  # 1 is now more recent than 2
+        cache.put("https://3.fr", _page(), PAGE)
+    assert [cache.get(u) is not None for u in ("https://1.fr", "https://2.fr", "https://3.fr")] == [
+        True, False, True
+    ]
+    cache.close()
+
+
+# --------------------------------------------------------------------------- #
+# fetch_if_working through the cache
+# --------------------------------------------------------------------------- #
+def test_fresh_page_needs_no_request(cache):
+    with mock.patch.object(cv.requests, "get", return_value=_page()) as get:
+        assert cv.fetch_if_working("https://a.fr", mock.Mock(), cache) == PAGE
+        assert cv.fetch_if_working("https://a.fr", mock.Mock(), cache) == PAGE
+    assert get.call_count == 1
+
+
+def test_stale_page_is_revalidated(cache):
+    with mock.patch.object(cv.requests, "get", return_value=_page(headers={"ETag": '"v1"'})):
+        cv.fetch_if_working("https://a.fr", mock.Mock(), cache)
+    cache.ttl = 0  # now stale
+    with mock.patch.object(cv.requests, "get", return_value=_page("", 304)) as get:
+        assert cv.fetch_if_working("https://a.fr", mock.Mock(), cache) == PAGE
+    assert get.call_args.kwargs["headers"]["If-None-Match"] == '"v1"'
+
+    with mock.patch.object(cv.requests, "get", return_value=_page("<p>v2</p>")):
+        assert cv.fetch_if_working("https://a.fr", mock.Mock(), cache) == "<p>v2</p>"
+    assert cache.get("https://a.fr")["html"] == "<p>v2</p>"
+
+
+def test_offline_uses_cache_only(cache):
+    with mock.patch.object(cv.requests, "get", return_value=_page()):
+        cv.fetch_if_working("https://a.fr", mock.Mock(), cache)
+    cache.ttl, cache.offline = 0, True  # stale pages still used offline
+    row = {config.COL_LINK: "https://new.fr", config.COL_RESUME: "https://a.fr"}
+    with mock.patch.object(cv.requests, "get") as get:
+        assert cv.fetch_if_working("https://new.fr", mock.Mock(), cache) is None
+        assert cv.resolve_working_link(row, mock.Mock(), cache) == ("https://a.fr", PAGE)
+    get.assert_not_called()
+
+
+if __name__ == "__main__":
+    # `uv run src/test/test_page_cache.py` -> run this file through pytest.
+    raise SystemExit(pytest.main([__file__, "-v", "-rs"]))
@@ -125,7 +125,7 @@ def test_fallback_categorises_unscrapeable_rows(rows, ref_maps, vocab, examples)
     if not targets:
         pytest.skip("no un-scrapeable + uncategorised + has-text rows in the Test table")
 
-    def fake_fetch(url, logger):
+    def fake_fetch(url, logger, cache=None, scheduler=None, health=None):
         return None if is_blocked(url) else "<title>T</title><body>x</body>"
 
     with mock.patch.object(cv, "fetch_if_working", side_effect=fake_fetch), \
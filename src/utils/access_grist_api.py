@@ -1,12 +1,70 @@
+import gzip
+import json
 import os
+import threading
+import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import polars as pl
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
+
+from src.utils.config import (
+    GRIST_BACKOFF,
+    GRIST_CHUNK_SIZE,
+    GRIST_FLUSH_AGE,
+    GRIST_FLUSH_SIZE,
+    GRIST_GZIP_BODY,
+    GRIST_MAX_WORKERS,
+    GRIST_POOL_SIZE,
+    GRIST_RETRIES,
+)
+
+# Answers worth retrying: rate limiting and gateway / overload errors
+_TRANSIENT_STATUS = {429, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size=GRIST_POOL_SIZE):
+    """
+    The process-wide requests.Session every GristApi goes through: its
+    keep-alive connections are reused from one call (and one instance) to the
+    next instead of opening a new TCP + TLS connection each time.
+
+    Requests that can safely be sent twice (GET, PATCH...) are retried by the
+    transport on transient errors, honouring `Retry-After`. POST is not: adding
+    records twice would duplicate rows (`add_records_bulk` retries explicitly).
+
+    Args:
+        pool_size: number of connections kept open (only used by the first call).
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=GRIST_RETRIES,
+                backoff_factor=GRIST_BACKOFF,
+                status_forcelist=sorted(_TRANSIENT_STATUS),
+                allowed_methods=Retry.DEFAULT_ALLOWED_METHODS | {"PATCH"},
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+            )
+            _session = requests.Session()
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
 
 
 class GristApi:
-    def __init__(self, doc_id=None):
+    def __init__(self, doc_id=None, gzip_body=GRIST_GZIP_BODY):
         # Resolved here (not as a default argument) so that *importing* GristApi
         # does not require GRIST_VEILLE_DOC_ID to be set — only instantiating it
         # does. This keeps imports (and test collection) working without secrets.
@@ -36,49 +94,106 @@ class GristApi:
 
         self.table_url = f"{self.doc_url}/{doc_id}/tables"
 
+        self.sql_url = f"{self.doc_url}/{doc_id}/sql"
+
         self.headers = {
             "accept": "application/json",
             "Authorization": f"Bearer {token}",
             "Content-Type": "application/json",
         }
 
+        self.session = get_session()
+
+        self.gzip_body = gzip_body
+
+    def _request(self, method, url, **kwarg):
+        """Send a request on the shared session, gzipping the json body if asked."""
+        headers = self.headers
+        if self.gzip_body and kwarg.get("json") is not None:
+            kwarg["data"] = gzip.compress(json.dumps(kwarg.pop("json")).encode("utf-8"))
+            headers = {**headers, "Content-Encoding": "gzip"}
+        return self.session.request(method, url, headers=headers, **kwarg)
+
     def fetch_table(self, table_id, **kwarg):
         """
         Wrapper for a GET requests
 
         Args:
             The grist table id
-            Additionnal arguments to pass on to requets.get()
+            Additionnal arguments to pass on to the session's request()
 
         Returns:
-            response from requests.get
+            response from the Grist API
 
         Example:
         >>> GristApi().fetch_table("Test")
         <Response [200]>
         """
-        response = requests.get(
-            f"{self.table_url}/{table_id}/records", headers=self.headers, **kwarg
+        response = self._request(
+            "GET", f"{self.table_url}/{table_id}/records", **kwarg
         )
         return response
 
-    def fetch_table_pl(self, table_id, **kwarg):
+    def fetch_table_pl(
+        self,
+        table_id,
+        columns=None,
+        filter=None,
+        sort=None,
+        limit=None,
+        where=None,
+        list_columns=(),
+        **kwarg,
+    ):
         """
-        Fetch data from a Grist table
+        Fetch data from a Grist table, optionally only some rows / columns of it,
+        selected by Grist so that only what is needed is downloaded.
+
+        Without `columns` or `where`, the records endpoint is used with its
+        `filter`, `sort` and `limit` query parameters. With them, the query goes
+        through the `/sql` endpoint (the records endpoint cannot project
+        columns); there, Choice List / Reference List cells come back as json
+        text: name them in `list_columns` to get Grist's ["L", ...] lists back.
 
         Args:
             The grist table id
-
+            columns (list, optional): columns to fetch ("id" is always there)
+            filter (dict, optional): {column: [accepted values]}, e.g. {"Traitement": ["", None]}
+            sort (string, optional): Grist sort spec, e.g. "-Date,id"
+            limit (int, optional): maximum number of rows
+            where (string, optional): SQL condition, e.g. '"A_garder" = 1' (forces /sql)
+            list_columns (list, optional): list columns to decode (/sql only)
 
         Returns:
             the table from Grist as a Polars DataFrame
 
         Example:
         >>> GristApi().fetch_table_pl("Test")
+        >>> GristApi().fetch_table_pl("Test", columns=["Lien_article"])
+        >>> GristApi().fetch_table_pl("Test", filter={"Traitement": [""]}, limit=10)
         """
+        if columns is None and where is None:
+            params = kwarg.pop("params", {})
+            if filter is not None:
+                params["filter"] = json.dumps(filter)
+            if sort is not None:
+                params["sort"] = sort
+            if limit is not None:
+                params["limit"] = limit
+            records = self.fetch_table(table_id=table_id, params=params, **kwarg).json()
+        else:
+            records = self.fetch_sql(
+                *_select_statement(table_id, columns, filter, sort, limit, where), **kwarg
+            ).json()
+            for record in records.get("records", []):
+                for col in list_columns:
+                    record["fields"][col] = _decode_list_cell(record["fields"].get(col))
+
+        if not records.get("records"):  # nothing matches: no column to unnest
+            return pl.DataFrame(schema={"id": pl.Int64, **{c: pl.Null for c in columns or []}})
         return (
             pl.DataFrame(
-                self.fetch_table(table_id=table_id, **kwarg).json(),
+                records,
                 infer_schema_length=None,
                 strict=False,
             )
@@ -86,6 +201,27 @@ class GristApi:
             .unnest(columns="fields")
         )
 
+    def fetch_sql(self, sql, args=(), **kwarg):
+        """
+        Wrapper for a read-only SQL query on the document (POST /sql).
+
+        Args:
+            sql: a SELECT statement, with "?" placeholders
+            args: the values of the placeholders
+
+        Returns:
+            response from the Grist API; the JSON payload looks like
+            {"statement": ..., "records": [{"fields": {<col>: <value>, ...}}]}
+
+        Example:
+        >>> GristApi().fetch_sql('SELECT id FROM "Test" WHERE "Traitement" = ?', [""])
+        <Response [200]>
+        """
+        response = self._request(
+            "POST", self.sql_url, json={"sql": sql, "args": list(args)}, **kwarg
+        )
+        return response
+
     def fetch_columns(self, table_id, **kwarg):
         """
         GET the column metadata of a table.
@@ -95,8 +231,8 @@ class GristApi:
         Useful to check, before writing, that a target column is a writable data
         column (isFormula == False) and not a formula column.
         """
-        response = requests.get(
-            f"{self.table_url}/{table_id}/columns", headers=self.headers, **kwarg
+        response = self._request(
+            "GET", f"{self.table_url}/{table_id}/columns", **kwarg
         )
         return response
 
@@ -107,20 +243,76 @@ class GristApi:
 
         Args:
             The grist table id
-            Additionnal arguments to pass on to requets.post()
+            Additionnal arguments to pass on to the session's request()
 
         Returns:
-            response from requests.get
+            response from the Grist API
 
         Example:
         >>> GristApi().add_records("Test", json=data_json)
         <Response [200]>
         """
-        response = requests.post(
-            f"{self.table_url}/{table_id}/records", headers=self.headers, **kwarg
+        response = self._request(
+            "POST", f"{self.table_url}/{table_id}/records", **kwarg
         )
         return response
 
+    def add_records_bulk(
+        self,
+        table_id,
+        records,
+        chunk_size=GRIST_CHUNK_SIZE,
+        max_workers=GRIST_MAX_WORKERS,
+        retries=GRIST_RETRIES,
+        backoff=GRIST_BACKOFF,
+    ):
+        """
+        Add many records to a table: they are POSTed by chunks of `chunk_size`,
+        up to `max_workers` chunks at a time. A chunk is sent again, after an
+        exponential backoff or the delay given by `Retry-After`, only when
+        Grist surely did not add it: the connection could not be opened, or
+        the answer is a 429 or a 503 with `Retry-After`. After a read timeout,
+        a dropped connection or a 502 / 504 the rows may already be in the
+        table, so the error is raised rather than risking duplicates.
+
+        With the default `max_workers` of 1, the chunks are added one after the
+        other, so the new row ids follow the order of `records` (e.g. the date
+        order of an extraction, which `sort="id"` then relies on). With more,
+        chunks are added in the order Grist gets them: the ids are still
+        returned in the order of `records`, but are no longer increasing.
+
+        Args:
+            table_id: the grist table id
+            records: list of {"fields": {<col>: <value>, ...}} dicts
+            chunk_size: number of records per POST
+            max_workers: number of chunks sent at the same time
+            retries: number of attempts per chunk
+            backoff: seconds before the first retry (then doubled)
+
+        Returns:
+            the ids of the created records, in the order of `records`
+
+        Raises:
+            requests.HTTPError (or the network error) once a chunk fails for good;
+            the chunks already sent stay in the table.
+
+        Example:
+        >>> GristApi().add_records_bulk("Test", [{"fields": {"Titre_article": "A"}}])
+        [513]
+        """
+        chunks = [records[i : i + chunk_size] for i in range(0, len(records), chunk_size)]
+
+        def send(chunk):
+            response = _with_retries(
+                lambda: self.add_records(table_id, json={"records": chunk}),
+                retries,
+                backoff,
+            )
+            response.raise_for_status()
+            return [record["id"] for record in response.json()["records"]]
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            return [row_id for ids in pool.map(send, chunks) for row_id in ids]
 
     def update_records(self, table_id, **kwarg):
         """
@@ -134,10 +326,10 @@ class GristApi:
 
         Args:
             table_id: the grist table id
-            Additionnal arguments to pass on to requests.patch() (typically json=...)
+            Additionnal arguments to pass on to the session's request() (typically json=...)
 
         Returns:
-            response from requests.patch
+            response from the Grist API
 
         Example:
         >>> GristApi().update_records(
@@ -146,7 +338,193 @@ class GristApi:
         ... )
         <Response [200]>
         """
-        response = requests.patch(
-            f"{self.table_url}/{table_id}/records", headers=self.headers, **kwarg
+        response = self._request(
+            "PATCH", f"{self.table_url}/{table_id}/records", **kwarg
         )
         return response
+
+
+class UpdateBuffer:
+    """
+    Collects {"id", "fields"} updates and PATCHes them to Grist in batches,
+    once `max_records` are waiting or the oldest one is `max_age` seconds old.
+    Both are checked on `add` (there is no timer): a batch is not written while
+    no update comes in.
+
+    Use it as a context manager: whatever remains is written when the block
+    exits, be it normally, on an exception or on Ctrl+C (KeyboardInterrupt), so
+    no completed work is lost. When Grist rejects a batch (4xx), it is split in
+    two and each half sent again, down to the single record at fault, which is
+    logged and skipped. A server error (5xx) says nothing of the records: the
+    batch is not split, and is failed as a whole once the shared session has
+    retried it (`get_session`).
+
+    Example:
+    >>> with UpdateBuffer(GristApi(), "Test", logger) as buffer:
+    ...     buffer.add({"id": 12, "fields": {"Traitement": "OK"}})
+    """
+
+    def __init__(
+        self, api, table_id, logger, max_records=GRIST_FLUSH_SIZE, max_age=GRIST_FLUSH_AGE
+    ):
+        self.api = api
+        self.table_id = table_id
+        self.logger = logger
+        self.max_records = max_records
+        self.max_age = max_age
+        self.pending = []
+        self.oldest = None
+        self.failed = []  # ids that could not be written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+        return False
+
+    def add(self, update):
+        """Queue one update, and write the batch if it is full or old enough."""
+        if not self.pending:
+            self.oldest = time.monotonic()
+        self.pending.append(update)
+        if (
+            len(self.pending) >= self.max_records
+            or time.monotonic() - self.oldest >= self.max_age
+        ):
+            self.flush()
+
+    def flush(self):
+        """Write every queued update."""
+        pending, self.pending = self.pending, []
+        # Records of one PATCH share the same columns: group them by fields
+        groups = {}
+        for update in pending:
+            groups.setdefault(tuple(sorted(update["fields"])), []).append(update)
+        for updates in groups.values():
+            self._send(updates)
+
+    def _send(self, updates):
+        ids = [update["id"] for update in updates]
+        try:
+            resp = self.api.update_records(self.table_id, json={"records": updates})
+        except requests.RequestException as exc:  # network down: bisecting won't help
+            self.logger.error(f"[ids {ids}] echec maj ({exc.__class__.__name__}): {exc}")
+            self.failed.extend(ids)
+            return
+        if resp.status_code == 200:
+            self.logger.info(f"[ids {ids}] mis a jour")
+        elif len(updates) == 1 or _server_error(resp):  # already retried by the session
+            self.logger.error(f"[ids {ids}] echec maj ({resp.status_code}): {resp.text[:200]}")
+            self.failed.extend(ids)
+        else:  # isolate the record(s) Grist rejects
+            half = len(updates) // 2
+            self._send(updates[:half])
+            self._send(updates[half:])
+
+
+def _quote(name):
+    """Quote a table / column id for SQL."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _select_statement(table_id, columns=None, filter=None, sort=None, limit=None, where=None):
+    """
+    Translate the arguments of `fetch_table_pl` into an SQL query for `/sql`.
+
+    >>> _select_statement("Veille", ["Lien_article"], {"Traitement": ["", None]}, "-id", 5)
+    ('SELECT "id", "Lien_article" FROM "Veille" WHERE ("Traitement" IN (?) OR "Traitement" IS NULL) ORDER BY "id" DESC LIMIT 5', [''])
+    """
+    select = "*" if columns is None else ", ".join(_quote(c) for c in ["id", *columns])
+    sql = f"SELECT {select} FROM {_quote(table_id)}"
+    conditions, args = [], []
+    for col, values in (filter or {}).items():
+        parts = []
+        not_null = [v for v in values if v is not None]
+        if not_null:
+            parts.append(f"{_quote(col)} IN ({', '.join('?' * len(not_null))})")
+            args.extend(not_null)
+        if len(not_null) < len(values):
+            parts.append(f"{_quote(col)} IS NULL")
+        conditions.append("(" + " OR ".join(parts or ["0"]) + ")")
+    if where is not None:
+        conditions.append(f"({where})")
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if sort is not None:
+        keys = [k.strip() for k in sort.split(",") if k.strip()]
+        sql += " ORDER BY " + ", ".join(
+            f"{_quote(k[1:])} DESC" if k.startswith("-") else _quote(k) for k in keys
+        )
+    if limit is not None:
+        sql += f" LIMIT {int(limit)}"
+    return sql, args
+
+
+def _decode_list_cell(value):
+    """
+    A Choice List / Reference List cell as returned by /sql (json text) ->
+    the ["L", ...] list the records endpoint gives.
+
+    >>> _decode_list_cell('[1, 2]')
+    ['L', 1, 2]
+    >>> _decode_list_cell(None)
+    """
+    if not isinstance(value, str) or not value.startswith("["):
+        return value
+    try:
+        items = json.loads(value)
+    except json.JSONDecodeError:
+        return value
+    return ["L", *items] if isinstance(items, list) else value
+
+
+def _retry_delay(response, attempt, backoff):
+    """Seconds to wait before the next attempt: `Retry-After` if given, else exponential."""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    try:
+        return max(0.0, float(retry_after))
+    except (TypeError, ValueError):
+        return backoff * 2**attempt
+
+
+def _server_error(response):
+    """True when the failure is the server's (5xx, or 429), not the request's."""
+    return response.status_code >= 500 or response.status_code == 429
+
+
+def _not_sent(exc):
+    """True when a request failed before reaching the server (connection not opened)."""
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    reason = exc.args[0] if exc.args else None
+    reason = getattr(reason, "reason", reason)  # urllib3's MaxRetryError wraps the cause
+    return isinstance(reason, NewConnectionError)
+
+
+def _not_processed(response):
+    """True when the server says it did not process the request and asks to come back."""
+    return response.status_code == 429 or (
+        response.status_code == 503 and "Retry-After" in response.headers
+    )
+
+
+def _with_retries(send, retries=GRIST_RETRIES, backoff=GRIST_BACKOFF):
+    """
+    Call `send()` (which returns a requests response), at most `retries` times,
+    as long as the request surely had no effect: safe for a POST. The last
+    response is returned as is; a network error is raised.
+    """
+    for attempt in range(retries):
+        last = attempt == retries - 1
+        try:
+            response = send()
+        except requests.RequestException as exc:
+            if last or not _not_sent(exc):
+                raise
+            time.sleep(_retry_delay(None, attempt, backoff))
+            continue
+        if not _not_processed(response) or last:
+            return response
+        time.sleep(_retry_delay(response, attempt, backoff))
+
@@ -21,8 +21,58 @@ COL_RUBRIQUE_CATEGORY = "Categories"
 COL_RUBRIQUE_RUBRIQUE = "Rubrique"
 
 REQUEST_TIMEOUT = 15  # seconds, when checking/fetching a link
+LINK_PROBE_WORKERS = 4  # candidate links of a row checked at the same time
+HOST_MAX_CONCURRENCY = 2  # page requests in flight to one site
+HOST_RATE = 1.0  # page requests per second to one site
+HOST_BURST = 3  # requests a site may get at once before HOST_RATE applies
+FETCH_RETRIES = 2  # new tries of a page after a 429 / 503 with Retry-After
+MAX_RETRY_AFTER = 60  # seconds; a site asking to wait longer is not retried
+MAX_PAGE_BYTES = 1 << 20  # bytes of an article page read at most (the rest is never downloaded)
+PAGE_CACHE_PATH = "page_cache.sqlite"  # article pages kept between `complete` runs
+PAGE_CACHE_TTL = 7 * 24 * 3600  # seconds a cached page is used before asking the site again
+PAGE_CACHE_MAX_BYTES = 200 * 2**20  # compressed pages kept, least recently used dropped first
+LINK_HEALTH_PATH = "link_health.sqlite"  # dead links and sites remembered between `complete` runs
+# seconds a failure is trusted before the link is tried again, per kind of failure
+LINK_HEALTH_TTL = {
+    "4xx": 7 * 24 * 3600,  # page gone or forbidden: rarely comes back
+    "5xx": 6 * 3600,  # server error: often transient
+    "dns": 24 * 3600,  # unknown domain: the whole site
+    "tls": 24 * 3600,  # broken certificate: the whole site
+    "timeout": 6 * 3600,
+    "connexion": 6 * 3600,  # connection refused / reset
+}
+HOST_FAILURES_TO_TRIP = 2  # network failures after which a site is skipped for the rest of a run
+LLM_CACHE_PATH = "llm_cache.sqlite"  # LLM answers kept between `complete` runs
+LLM_CACHE_MAX_BYTES = 50 * 2**20  # LLM answers kept, least recently used dropped first
+LLM_EJECT_SECONDS = 30  # an LLM endpoint that failed gets no request for that long
+LLM_TIMEOUT = 120  # seconds before an LLM call is given up (then retried)
+LLM_RETRIES = 4  # new tries of an LLM call after a connection error, timeout, 429 or 5xx
+LLM_BACKOFF = 2.0  # seconds, upper bound of the first random wait before a retry, doubled each time
+LLM_BACKOFF_MAX = 60  # seconds, longest wait before a retry
+LLM_INITIAL_CONCURRENCY = 4  # LLM calls in flight at the start of a run
+LLM_MAX_CONCURRENCY = 16  # LLM calls in flight at most, however well the endpoints answer
+LLM_LATENCY_SPIKE = 3.0  # a call this many times slower than usual counts as a sign of overload
+LLM_STATS_EVERY = 30  # seconds between two log lines on the LLM throughput
+LLM_HEDGE_PERCENTILE = 0.9  # with hedging, a call slower than this share of the recent ones is sent twice
+LLM_HEDGE_BUDGET = 0.1  # with hedging, calls sent twice at most, as a share of the calls
+LLM_HEDGE_MIN_SAMPLES = 20  # answered calls needed before hedging starts
+LLM_HEDGE_WINDOW = 200  # recent call durations the hedging threshold is learned from
 MAX_ARTICLE_CHARS = 8000  # how much article text we feed the LLM
+MAX_REPAIR_CHARS = 1500  # article text sent again when the LLM left the title / summary out
+LLM_REPAIR_ROUNDS = 1  # new asks for the keys missing or invalid in an LLM answer
+MIN_MAIN_CONTENT_CHARS = 200  # shorter main content: the whole page text is used instead
 DEFAULT_N_EXAMPLES = 15  # category example assignments sent to the LLM
+CONV_BATCH_SIZE = 2000  # Tchap messages per record batch when streaming an export
+CONV_READ_SIZE = 1 << 16  # characters read at once from the export when streaming
+WATERMARK_PATH = "extract_watermark.json"  # last Tchap event ingested, per table and room
+GRIST_CHUNK_SIZE = 500  # records per POST when adding rows in bulk
+GRIST_MAX_WORKERS = 1  # chunks added to Grist at the same time; 1 keeps row ids in the order of the records
+GRIST_RETRIES = 5  # attempts per chunk on a transient error (429, 5xx, network)
+GRIST_BACKOFF = 1.0  # seconds before the first retry, doubled at each attempt
+GRIST_POOL_SIZE = 10  # keep-alive connections to Grist shared by every GristApi
+GRIST_GZIP_BODY = False  # gzip the json bodies sent to Grist (big imports / updates)
+GRIST_FLUSH_SIZE = 50  # completed rows buffered before one PATCH to Grist
+GRIST_FLUSH_AGE = 30  # seconds after which buffered rows are written anyway
 PARIS_TZ = ZoneInfo("Europe/Paris")  # timestamps written to Grist use Paris time
 USER_AGENT = (
     "Mozilla/5.0 (compatible; ssphub-veille-bot/1.0; "
@@ -33,3 +83,18 @@ USER_AGENT = (
 _URL_RE = re.compile(r"https?://[^\s)\]<>\"']+")
 # internal links
 _INTERNAL_PREFIXES = ("https://tchap.gouv.fr/", "https://matrix.to")
+# query parameters that only track the click, dropped from canonical urls
+_TRACKING_PARAM_RE = (
+    r"^(?:utm_[^=]*|fbclid|gclid|dclid|msclkid|mc_cid|mc_eid|igshid|yclid"
+    r"|_hsenc|_hsmi|mkt_tok)(?:=|$)"
+)
+# charset declared in a Content-Type header or a <meta> tag
+_CHARSET_RE = re.compile(r"""charset\s*=\s*["']?([\w.:-]+)""", re.IGNORECASE)
+# Content-Types that can be analysed, and how: "html" pages go to BeautifulSoup
+# as they are, "text" ones are wrapped in a <pre>. Others (pdf, images, video)
+# are skipped.
+PAGE_CONTENT_TYPES = {
+    "text/html": "html",
+    "application/xhtml+xml": "html",
+    "text/plain": "text",
+}
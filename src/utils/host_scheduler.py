@@ -0,0 +1,177 @@
+"""
+Politeness towards the sites the article pages are fetched from.
+
+Veille links cluster on a few hosts (github, arxiv, insee.fr, medium...): with
+many fetches in flight, each host still only gets a few requests at a time and
+a steady rate, and a host answering 429 / 503 with `Retry-After` is left alone
+for that long.
+
+    scheduler = HostScheduler()
+    with scheduler.slot(url):
+        resp = requests.get(url)
+    if scheduler.retry_after(url, resp):
+        ...  # ask again: the next slot waits as long as the site asked
+"""
+
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from src.utils.config import HOST_BURST, HOST_MAX_CONCURRENCY, HOST_RATE, MAX_RETRY_AFTER
+
+_THROTTLED_STATUS = {429, 503}
+
+
+def host_of(url):
+    """
+    The host a url is fetched from, the politeness unit.
+
+    Example:
+        >>> host_of("https://WWW.Insee.fr/fr/statistiques?x=1")
+        'insee.fr'
+    """
+    host = (urlsplit(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def parse_retry_after(value, now=None):
+    """
+    Seconds to wait from a `Retry-After` header (seconds or HTTP date), or None.
+
+    Example:
+        >>> parse_retry_after("120")
+        120.0
+        >>> parse_retry_after("Wed, 21 Oct 2015 07:28:30 GMT", now=1445412480.0)
+        30.0
+        >>> parse_retry_after("bientot") is None
+        True
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - (time.time() if now is None else now))
+
+
+class _Host:
+    def __init__(self, max_concurrency, burst):
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.tokens = float(burst)
+        self.refilled = time.monotonic()
+        self.blocked_until = 0.0
+
+
+class HostScheduler:
+    """
+    Per-host limits on the requests of the threads of a run.
+
+    Args:
+        max_concurrency (int): requests in flight to one host.
+        rate (float): requests per second to one host (token bucket), > 0.
+        burst (int): requests a host may get at once before `rate` applies.
+        max_retry_after (float): longest `Retry-After` worth waiting for, in
+            seconds; a host asking for more is not retried.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=HOST_MAX_CONCURRENCY,
+        rate=HOST_RATE,
+        burst=HOST_BURST,
+        max_retry_after=MAX_RETRY_AFTER,
+    ):
+        if rate <= 0:
+            raise ValueError(f"rate must be > 0 requests per second, got {rate}")
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_retry_after = max_retry_after
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, url):
+        with self._lock:
+            host = host_of(url)
+            if host not in self._hosts:
+                self._hosts[host] = _Host(self.max_concurrency, self.burst)
+            return self._hosts[host]
+
+    def _take_token(self, host):
+        # Wait until the host is not blocked and its bucket holds a token
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                host.tokens = min(self.burst, host.tokens + (now - host.refilled) * self.rate)
+                host.refilled = now
+                wait = host.blocked_until - now
+                if wait <= 0:
+                    if host.tokens >= 1:
+                        host.tokens -= 1
+                        return
+                    wait = (1 - host.tokens) / self.rate
+            time.sleep(wait)
+
+    def slot(self, url):
+        """
+        Context manager holding one of the request slots of the host of `url`;
+        it can be given back for a while with `pause` / `resume`.
+        """
+        return _Slot(self, self._host(url))
+
+    def retry_after(self, url, resp):
+        """
+        If `resp` says the host is throttling us (429 / 503), stop sending it
+        requests for the time it asks (`Retry-After`, else one token's time)
+        and tell whether asking again is worth it.
+        """
+        if resp.status_code not in _THROTTLED_STATUS:
+            return False
+        delay = parse_retry_after(resp.headers.get("Retry-After"))
+        if delay is None:
+            delay = 1 / self.rate
+        if delay > self.max_retry_after:
+            return False
+        host = self._host(url)
+        with self._lock:
+            host.blocked_until = max(host.blocked_until, time.monotonic() + delay)
+        return True
+
+
+class _Slot:
+    def __init__(self, scheduler, host):
+        self.scheduler = scheduler
+        self.host = host
+        self.held = False
+
+    def __enter__(self):
+        self.host.slots.acquire()
+        try:
+            self.scheduler._take_token(self.host)
+        except BaseException:
+            self.host.slots.release()
+            raise
+        self.held = True
+        return self
+
+    def pause(self):
+        """Give the slot back while the request waits idle (see `resume`)."""
+        if self.held:
+            self.held = False
+            self.host.slots.release()
+
+    def resume(self):
+        """Take the slot again, without a new token: the request was sent."""
+        if not self.held:
+            self.host.slots.acquire()
+            self.held = True
+
+    def __exit__(self, *exc):
+        self.pause()
+        return False
@@ -0,0 +1,169 @@
+"""
+Dead links and dead sites remembered between runs of the completion step.
+
+A link that failed (4xx, 5xx, unknown domain, broken certificate, timeout...)
+is not tried again before the time-to-live of that kind of failure: checking
+it again would only cost another `REQUEST_TIMEOUT`. An unknown domain or a
+broken certificate is remembered for the whole site, and a site that keeps
+failing at the network level during a run is skipped for the rest of the run
+(circuit breaker), so the other rows pointing to it do not wait for it either.
+A link that answers again wipes what was known against it and its site.
+
+    health = LinkHealth()
+    if health.dead(url) is None:
+        ...  # request url, then health.worked(url) or health.failed(url, outcome)
+"""
+
+import re
+import sqlite3
+import threading
+import time
+
+import requests
+
+from src.utils.config import HOST_FAILURES_TO_TRIP, LINK_HEALTH_PATH, LINK_HEALTH_TTL
+from src.utils.host_scheduler import host_of
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS links (url TEXT PRIMARY KEY, outcome TEXT, failed_at REAL)",
+    "CREATE TABLE IF NOT EXISTS hosts (host TEXT PRIMARY KEY, outcome TEXT, failed_at REAL)",
+]
+# failures that say nothing about the page but about the whole site
+_HOST_OUTCOMES = {"dns", "tls", "timeout", "connexion"}
+# ... and those remembered for the site in the next runs too
+_PERSISTED_HOST_OUTCOMES = {"dns", "tls"}
+_DNS_ERROR_RE = re.compile(
+    r"NameResolutionError|Name or service not known|nodename nor servname|"
+    r"getaddrinfo failed|name resolution|No address associated",
+    re.IGNORECASE,
+)
+
+
+def status_outcome(status_code):
+    """
+    Kind of failure of an HTTP status, or None when it is not one worth
+    remembering (a success, or 429: the site only asks to slow down).
+
+    Example:
+        >>> status_outcome(404), status_outcome(503), status_outcome(429), status_outcome(200)
+        ('4xx', '5xx', None, None)
+    """
+    if status_code == 429 or status_code < 400:
+        return None
+    return "4xx" if status_code < 500 else "5xx"
+
+
+def error_outcome(exc):
+    """
+    Kind of failure of a `requests` exception, or None when it is not one of
+    the known network failures.
+
+    Example:
+        >>> error_outcome(requests.exceptions.ReadTimeout())
+        'timeout'
+        >>> error_outcome(requests.exceptions.ConnectionError("Failed to resolve 'x.fr' (NameResolutionError)"))
+        'dns'
+        >>> error_outcome(requests.exceptions.SSLError("certificate verify failed"))
+        'tls'
+        >>> error_outcome(requests.exceptions.TooManyRedirects()) is None
+        True
+    """
+    if isinstance(exc, requests.exceptions.SSLError):
+        return "tls"
+    if isinstance(exc, requests.exceptions.Timeout):
+        return "timeout"
+    if isinstance(exc, requests.exceptions.ConnectionError):
+        return "dns" if _DNS_ERROR_RE.search(str(exc)) else "connexion"
+    return None
+
+
+class LinkHealth:
+    """
+    Link failures kept on disk, shared by the threads of a run.
+
+    Args:
+        path (string): sqlite file of the failures.
+        ttl (dict): seconds a failure is trusted, per kind of failure
+            (`status_outcome` / `error_outcome`).
+        trip_after (int): network failures of a site after which it is
+            skipped for the rest of the run.
+    """
+
+    def __init__(self, path=LINK_HEALTH_PATH, ttl=LINK_HEALTH_TTL, trip_after=HOST_FAILURES_TO_TRIP):
+        self.ttl = ttl
+        self.trip_after = trip_after
+        self.skipped = 0  # links not tried during the run
+        self.down = set()  # sites skipped for the rest of the run
+        self._failures = {}  # network failures of each site during the run
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self._purge()
+        self._db.commit()
+
+    def _is_recent(self, outcome, failed_at):
+        return time.time() - failed_at < self.ttl.get(outcome, 0)
+
+    def _purge(self):
+        # Drop the failures older than their time-to-live
+        for table, key in (("links", "url"), ("hosts", "host")):
+            for name, outcome, failed_at in self._db.execute(
+                f"SELECT {key}, outcome, failed_at FROM {table}"
+            ).fetchall():
+                if not self._is_recent(outcome, failed_at):
+                    self._db.execute(f"DELETE FROM {table} WHERE {key} = ?", (name,))
+
+    def dead(self, url):
+        """
+        Why `url` is not worth trying (e.g. `"4xx"`, `"dns (site)"`, `"site
+        hors service"`), or None when it has to be tried.
+        """
+        host = host_of(url)
+        with self._lock:
+            reason = None
+            if host in self.down:
+                reason = "site hors service"
+            else:
+                row = self._db.execute(
+                    "SELECT outcome, failed_at FROM links WHERE url = ?", (url,)
+                ).fetchone()
+                if row is not None and self._is_recent(*row):
+                    reason = row[0]
+                else:
+                    row = self._db.execute(
+                        "SELECT outcome, failed_at FROM hosts WHERE host = ?", (host,)
+                    ).fetchone()
+                    if row is not None and self._is_recent(*row):
+                        reason = f"{row[0]} (site)"
+            if reason is not None:
+                self.skipped += 1
+            return reason
+
+    def failed(self, url, outcome):
+        """Remember that `url` failed with `outcome` (None: nothing to remember)."""
+        if outcome is None:
+            return
+        host = host_of(url)
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO links VALUES (?, ?, ?)", (url, outcome, now))
+            if outcome in _PERSISTED_HOST_OUTCOMES:
+                self._db.execute("INSERT OR REPLACE INTO hosts VALUES (?, ?, ?)", (host, outcome, now))
+            self._db.commit()
+            if outcome in _HOST_OUTCOMES:
+                self._failures[host] = self._failures.get(host, 0) + 1
+                if self._failures[host] >= self.trip_after:
+                    self.down.add(host)
+
+    def worked(self, url):
+        """`url` answered: forget its failures and those of its site."""
+        host = host_of(url)
+        with self._lock:
+            self._db.execute("DELETE FROM links WHERE url = ?", (url,))
+            self._db.execute("DELETE FROM hosts WHERE host = ?", (host,))
+            self._db.commit()
+            self._failures.pop(host, None)
+
+    def close(self):
+        self._db.close()
@@ -8,18 +8,75 @@ LLM_LAB_API_KEY environment variable, and a chat-completion call.
 
 Endpoint and model can be overridden through environment variables so the
 script keeps working if the lab changes its default model:
-    - LLM_LAB_API_KEY   : API key (required)
-    - LLM_LAB_ENDPOINT  : base url   (default https://llm.lab.sspcloud.fr/api)
+    - LLM_LAB_API_KEY   : API key (required), or one per endpoint, comma-separated
+    - LLM_LAB_ENDPOINT  : base url   (default https://llm.lab.sspcloud.fr/api),
+                          or several comma-separated urls serving the same model
     - LLM_MODEL_NAME    : model name (default gemma4-26b-moe)
+
+The clients are built once per process (`get_pool`) and reused by every call.
+With several endpoints, each request goes to the one with the fewest requests
+in flight, and an endpoint that fails (connection error, timeout, 429, 5xx) is
+left aside for `LLM_EJECT_SECONDS` while the request is sent to another one.
+The number of calls in flight adapts to how the endpoints cope (`AdaptiveLimiter`)
+and a call failing everywhere is retried after a random, growing wait. With
+`hedge=True`, a call still running after most recent calls had answered is
+sent a second time and the first answer wins.
+
+`ask_json(schema=...)` asks the endpoint for constrained decoding (OpenAI
+`response_format` json_schema), so the answer is JSON of that shape; an
+endpoint that does not support it is asked for free JSON from then on.
+
+Answers can be kept on disk (`LLMCache`) so that the same request, e.g. a
+`--dry-run` followed by the real run, only reaches the endpoint once.
 """
 
+import hashlib
 import json
+import logging
 import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from types import SimpleNamespace
 
+import openai
 from openai import OpenAI
 
+from src.utils.config import (
+    LLM_BACKOFF,
+    LLM_BACKOFF_MAX,
+    LLM_CACHE_MAX_BYTES,
+    LLM_CACHE_PATH,
+    LLM_EJECT_SECONDS,
+    LLM_HEDGE_BUDGET,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_PERCENTILE,
+    LLM_HEDGE_WINDOW,
+    LLM_INITIAL_CONCURRENCY,
+    LLM_LATENCY_SPIKE,
+    LLM_MAX_CONCURRENCY,
+    LLM_RETRIES,
+    LLM_STATS_EVERY,
+    LLM_TIMEOUT,
+)
+from src.utils.host_scheduler import parse_retry_after
+
 DEFAULT_ENDPOINT = "https://llm.lab.sspcloud.fr/api"
 DEFAULT_MODEL = "gemma4-26b-moe"
+# errors that say the endpoint is unwell, not that the request is wrong
+_UNHEALTHY_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+logger = logging.getLogger(__name__)
+
+_structured_output = True  # cleared once the endpoint refuses `response_format`
+# what an endpoint not supporting constrained decoding says in its 400 / 422
+_SCHEMA_ERROR_RE = re.compile(r"response_format|json_schema", re.IGNORECASE)
+_usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+_usage_lock = threading.Lock()
 
 
 def get_client() -> OpenAI:
@@ -33,25 +90,570 @@ def get_model_name() -> str:
     return os.environ.get("LLM_MODEL_NAME", DEFAULT_MODEL)
 
 
-def ask(messages: list, client: OpenAI | None = None, **kwargs) -> str:
+class AdaptiveLimiter:
+    """
+    Limit on the LLM calls in flight that follows how the endpoints cope
+    (additive increase, multiplicative decrease).
+
+    Each call that succeeds adds `1 / limit` to the limit (about one more slot
+    per round of calls); a call throttled (connection error, timeout, 429, 5xx)
+    or `latency_spike` times slower than usual halves it, at most once per
+    usual call duration, since the calls of a burst fail together. Every
+    `stats_every` seconds a log line gives the calls per second and the limit.
+
+    Args:
+        initial (int): calls in flight at the start.
+        minimum (int), maximum (int): bounds of the limit.
+        latency_spike (float): slowdown, against the running mean duration of
+            the calls, taken as a sign of overload.
+        stats_every (float): seconds between two log lines.
+    """
+
+    def __init__(
+        self,
+        initial=LLM_INITIAL_CONCURRENCY,
+        minimum=1,
+        maximum=LLM_MAX_CONCURRENCY,
+        latency_spike=LLM_LATENCY_SPIKE,
+        stats_every=LLM_STATS_EVERY,
+    ):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_spike = latency_spike
+        self.stats_every = stats_every
+        self.in_flight = 0
+        self.done = 0  # calls answered
+        self.throttled = 0  # calls throttled
+        self.latency = None  # running mean duration of the answered calls, seconds
+        self.started = None
+        self._decreased = 0.0
+        self._window = (None, 0)  # (start, calls answered) of the current log line
+        self._cond = threading.Condition()
+
+    def acquire(self, cancel=None):
+        """
+        Wait for a free slot; returns the start time to give to `release`, or
+        None if the `cancel` event is set first.
+        """
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                if cancel is not None and cancel.is_set():
+                    return None
+                self._cond.wait(None if cancel is None else 0.1)
+            if cancel is not None and cancel.is_set():
+                return None
+            self.in_flight += 1
+            now = time.monotonic()
+            if self.started is None:
+                self.started = now
+                self._window = (now, 0)
+            return now
+
+    def has_room(self):
+        """True when a call would get a slot right away."""
+        with self._cond:
+            return self.in_flight < int(self.limit)
+
+    def release(self, started, throttled=False, cancelled=False):
+        """
+        Free the slot of a call started at `started`, and adapt the limit (not
+        for a `cancelled` call, which says nothing of the endpoint).
+        """
+        now = time.monotonic()
+        elapsed = now - started
+        with self._cond:
+            self.in_flight -= 1
+            if cancelled:
+                self._cond.notify_all()
+                return
+            slow = (
+                not throttled
+                and self.latency is not None
+                and elapsed > self.latency_spike * self.latency
+            )
+            if throttled or slow:
+                if now - self._decreased > (self.latency or 0):
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._decreased = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            if throttled:
+                self.throttled += 1
+            else:
+                self.done += 1
+                self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+            window_start, window_done = self._window
+            self._window = (window_start, window_done + (not throttled))
+            if now - window_start >= self.stats_every:
+                logger.info(
+                    f"LLM : {(window_done + (not throttled)) / (now - window_start):.2f} requetes/s, "
+                    f"limite {int(self.limit)}, {self.in_flight} en cours"
+                )
+                self._window = (now, 0)
+            self._cond.notify_all()
+
+    def summary(self):
+        """One line on the whole run: calls per second, throttled calls, limit."""
+        elapsed = time.monotonic() - self.started if self.started is not None else 0.0
+        rate = self.done / elapsed if elapsed else 0.0
+        return (
+            f"LLM : {self.done} appels en {elapsed:.0f} s ({rate:.2f} requetes/s), "
+            f"{self.throttled} ralentis par l'endpoint, limite finale {int(self.limit)}"
+        )
+
+
+def backoff_delay(attempt, error=None, base=LLM_BACKOFF, cap=LLM_BACKOFF_MAX):
+    """
+    Random wait before retry number `attempt` (from 0): up to `base * 2**attempt`
+    seconds (at most `cap`), and at least the `Retry-After` of `error` if any.
+
+    Example:
+        >>> 0 <= backoff_delay(0) <= 2.0, 0 <= backoff_delay(10) <= 60
+        (True, True)
+    """
+    delay = random.uniform(0, min(cap, base * 2**attempt))
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after is not None:
+            delay = max(delay, min(cap, retry_after))
+    return delay
+
+
+class _Cancelled(Exception):
+    """A hedged call stopped because the other one answered first."""
+
+
+class _Call:
+    # One of the (at most two) sends of a hedged request
+    def __init__(self):
+        self.started = threading.Event()  # holds a slot, or is over
+        self.cancel = threading.Event()
+        self.stream = None
+        self._lock = threading.Lock()
+
+    def attach(self, stream):
+        with self._lock:
+            self.stream = stream
+        if self.cancel.is_set():
+            stream.close()
+
+    def stop(self):
+        # Closing the stream drops the request: the endpoint stops generating
+        self.cancel.set()
+        with self._lock:
+            stream = self.stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+
+def _read_stream(stream, cancel):
+    # Response of a streamed call, in the shape of a non-streamed one
+    parts, usage = [], None
+    try:
+        for chunk in stream:
+            if cancel.is_set():
+                raise _Cancelled
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+            usage = getattr(chunk, "usage", None) or usage
+    except _Cancelled:
+        raise
+    except Exception:
+        if cancel.is_set():  # closed by `_Call.stop` while reading
+            raise _Cancelled from None
+        raise
+    finally:
+        stream.close()
+    message = SimpleNamespace(content="".join(parts))
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+class _Endpoint:
+    def __init__(self, client):
+        self.client = client
+        self.in_flight = 0
+        self.sent = 0
+        self.ejected_until = 0.0
+
+
+class LLMPool:
+    """
+    Long-lived clients of one or several OpenAI-compatible endpoints serving
+    the same model, shared by the threads of a run.
+
+    Each request goes to the endpoint with the fewest requests in flight among
+    those not ejected. An endpoint failing with a connection error, a timeout,
+    a 429 or a 5xx is ejected for `eject_seconds` and the request is sent to
+    the next one. Once every endpoint failed, the request is tried again after
+    `backoff_delay`, `retries` times at most, then the error is raised. The
+    calls in flight are bounded by `limiter`.
+
+    A hedged request (`create(hedge=True)`) still running `hedge_percentile`
+    of the recent call durations after it got its slot is sent a second time,
+    most likely to another endpoint, if the limiter has room for it. The two
+    are streamed: the first answer wins and the other one is stopped (its
+    stream closed, its slot freed). At most `hedge_budget` of the hedged
+    requests are sent twice.
+
+    Args:
+        clients (list of OpenAI): one client per endpoint.
+        eject_seconds (float): how long a failing endpoint gets no request.
+        retries (int): new tries of a request that failed on every endpoint.
+        limiter (AdaptiveLimiter, optional): default: a new one.
+        hedge_percentile (float): share of the recent calls that answered
+            before a request is sent a second time.
+        hedge_budget (float): requests sent twice at most, as a share of the
+            hedged requests.
+    """
+
+    def __init__(
+        self,
+        clients,
+        eject_seconds=LLM_EJECT_SECONDS,
+        retries=LLM_RETRIES,
+        limiter=None,
+        hedge_percentile=LLM_HEDGE_PERCENTILE,
+        hedge_budget=LLM_HEDGE_BUDGET,
+    ):
+        self._endpoints = [_Endpoint(client) for client in clients]
+        self.eject_seconds = eject_seconds
+        self.retries = retries
+        self.limiter = limiter or AdaptiveLimiter()
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self.hedged = 0  # requests that could be sent twice
+        self.hedges = 0  # requests sent twice
+        self._latencies = deque(maxlen=LLM_HEDGE_WINDOW)  # durations of the recent answered calls
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _acquire(self, tried):
+        with self._lock:
+            now = time.monotonic()
+            left = [endpoint for endpoint in self._endpoints if endpoint not in tried]
+            healthy = [endpoint for endpoint in left if endpoint.ejected_until <= now]
+            if healthy:
+                endpoint = min(healthy, key=lambda e: (e.in_flight, e.sent))
+            else:  # all ejected: the one back the soonest
+                endpoint = min(left, key=lambda e: e.ejected_until)
+            endpoint.in_flight += 1
+            endpoint.sent += 1
+            return endpoint
+
+    def _release(self, endpoint, error=None):
+        with self._lock:
+            endpoint.in_flight -= 1
+            if error is not None:
+                endpoint.ejected_until = time.monotonic() + self.eject_seconds
+        if error is not None:
+            logger.warning(
+                f"endpoint LLM {endpoint.client.base_url} ecarte {self.eject_seconds} s "
+                f"({error.__class__.__name__})"
+            )
+
+    def _send(self, request, call=None):
+        # One try on each endpoint, the least busy first; a `call` is streamed
+        # so that it can be stopped
+        tried = set()
+        while True:
+            endpoint = self._acquire(tried)
+            started = self.limiter.acquire(None if call is None else call.cancel)
+            if started is None:
+                self._release(endpoint)
+                raise _Cancelled
+            if call is not None:
+                call.started.set()
+            try:
+                if call is None:
+                    response = endpoint.client.chat.completions.create(**request)
+                else:
+                    stream = endpoint.client.chat.completions.create(
+                        stream=True, stream_options={"include_usage": True}, **request
+                    )
+                    call.attach(stream)
+                    response = _read_stream(stream, call.cancel)
+            except _Cancelled:
+                self.limiter.release(started, cancelled=True)
+                self._release(endpoint)
+                raise
+            except _UNHEALTHY_ERRORS as exc:
+                self.limiter.release(started, throttled=True)
+                self._release(endpoint, exc)
+                tried.add(endpoint)
+                if len(tried) == len(self._endpoints):
+                    raise
+                continue
+            except BaseException:
+                self.limiter.release(started)
+                self._release(endpoint)
+                raise
+            self.limiter.release(started)
+            self._release(endpoint)
+            with self._lock:
+                self._latencies.append(time.monotonic() - started)
+            return response
+
+    def _create(self, request, call=None):
+        for attempt in range(self.retries + 1):
+            try:
+                return self._send(request, call)
+            except _UNHEALTHY_ERRORS as exc:
+                if attempt == self.retries:
+                    raise
+                delay = backoff_delay(attempt, exc)
+                logger.warning(
+                    f"appel LLM en echec ({exc.__class__.__name__}), "
+                    f"nouvel essai {attempt + 1}/{self.retries} dans {delay:.1f} s"
+                )
+                if call is None:
+                    time.sleep(delay)
+                elif call.cancel.wait(delay):
+                    raise _Cancelled from None
+
+    def _hedged_send(self, request, call):
+        try:
+            return self._create(request, call)
+        finally:
+            call.started.set()  # over before getting a slot: nobody waits for it
+
+    def hedge_after(self):
+        """
+        Seconds after which a hedged request is sent again: the
+        `hedge_percentile` of the recent call durations, or None while fewer
+        than `LLM_HEDGE_MIN_SAMPLES` calls answered.
+        """
+        with self._lock:
+            if len(self._latencies) < LLM_HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[int(self.hedge_percentile * (len(ordered) - 1))]
+
+    def _take_hedge(self):
+        # One more request sent twice, if the budget allows it
+        with self._lock:
+            if self.hedges + 1 > self.hedge_budget * self.hedged:
+                return False
+            self.hedges += 1
+            return True
+
+    def create(self, hedge=False, **request):
+        """
+        `chat.completions.create(**request)` on the least busy healthy
+        endpoint, sent a second time if it is slow and `hedge` is set.
+        """
+        if not hedge:
+            return self._create(request)
+        with self._lock:
+            self.hedged += 1
+            if self._executor is None:
+                # the calls of the caller threads and their duplicates
+                self._executor = ThreadPoolExecutor(2 * LLM_MAX_CONCURRENCY)
+        threshold = self.hedge_after()
+        if threshold is None:
+            return self._create(request)
+        first = _Call()
+        calls = {self._executor.submit(self._hedged_send, request, first): first}
+        # The clock starts once the call holds a slot: waiting for the limiter
+        # is not the endpoint being slow, and a duplicate would only wait too
+        first.started.wait()
+        if (
+            not wait(list(calls), timeout=threshold).done
+            and self.limiter.has_room()
+            and self._take_hedge()
+        ):
+            logger.info(f"appel LLM plus long que {threshold:.1f} s : requete doublee")
+            second = _Call()
+            calls[self._executor.submit(self._hedged_send, request, second)] = second
+        pending = set(calls)
+        while True:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                if future.exception() is None or not pending:
+                    for other in pending:
+                        calls[other].stop()
+                    return future.result()
+
+    def summary(self):
+        """`AdaptiveLimiter.summary`, plus the requests sent twice if any."""
+        line = self.limiter.summary()
+        if self.hedged:
+            line += f", {self.hedges} requetes doublees sur {self.hedged}"
+        return line
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> LLMPool:
+    """
+    The `LLMPool` of the endpoints listed in `LLM_LAB_ENDPOINT`, built on the
+    first call and reused afterwards.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            urls = [
+                url.strip()
+                for url in os.environ.get("LLM_LAB_ENDPOINT", DEFAULT_ENDPOINT).split(",")
+                if url.strip()
+            ]
+            keys = os.environ.get("LLM_LAB_API_KEY", "").split(",")
+            if len(keys) != len(urls):  # one key for every endpoint
+                keys = [",".join(keys)] * len(urls)
+            # No retries in the client: a failing request moves on to the next
+            # endpoint, and the pool retries itself after a random wait
+            _pool = LLMPool(
+                [
+                    OpenAI(base_url=url, api_key=key.strip(), timeout=LLM_TIMEOUT, max_retries=0)
+                    for url, key in zip(urls, keys)
+                ]
+            )
+        return _pool
+
+
+def pool_summary() -> str | None:
+    """`LLMPool.summary` of the shared pool, None if no call went through it."""
+    with _pool_lock:
+        if _pool is None or _pool.limiter.started is None:
+            return None
+        return _pool.summary()
+
+
+class LLMCache:
+    """
+    LLM answers kept on disk (sqlite), keyed by a hash of the request: model
+    name, messages and call options. The least recently used answers are
+    dropped once they weigh more than `max_bytes`. Shared by the threads of a run.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers "
+            "(key TEXT PRIMARY KEY, answer TEXT, used_at REAL, size INTEGER)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def key(model: str, messages: list, kwargs: dict) -> str:
+        """
+        Hash of a request; the order of the options does not matter.
+
+        Example:
+            >>> k = LLMCache.key("m", [{"role": "user", "content": "x"}], {"a": 1, "b": 2})
+            >>> k == LLMCache.key("m", [{"role": "user", "content": "x"}], {"b": 2, "a": 1})
+            True
+            >>> k == LLMCache.key("other", [{"role": "user", "content": "x"}], {"a": 1, "b": 2})
+            False
+        """
+        request = json.dumps([model, messages, kwargs], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._db.execute("SELECT answer FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE answers SET used_at = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        return row[0]
+
+    def put(self, key: str, answer: str):
+        size = len(answer.encode("utf-8"))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?)",
+                (key, answer, time.time(), size),
+            )
+            # Drop the least recently used answers until the cache fits
+            (total,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()
+            for old_key, old_size in self._db.execute(
+                "SELECT key, size FROM answers ORDER BY used_at"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM answers WHERE key = ?", (old_key,))
+                total -= old_size
+            self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+
+def ask(
+    messages: list,
+    client: OpenAI | None = None,
+    cache: LLMCache | None = None,
+    hedge: bool = False,
+    usable=None,
+    **kwargs,
+) -> str:
     """
     Send a list of chat messages and return the assistant's text answer.
 
     Args:
         messages: list of {"role": ..., "content": ...} dicts.
-        client: an optional pre-built OpenAI client (handy for tests / reuse).
+        client: an optional pre-built OpenAI client (handy for tests); by
+            default the request goes through the shared `get_pool()`.
+        cache: an optional `LLMCache`; a request already answered is not sent
+            again, a new answer is stored.
+        hedge: send the request a second time if it is slow (see `LLMPool`);
+            only through the shared pool.
+        usable: optional `usable(answer) -> bool`; only the answers it accepts
+            are stored in (and reused from) `cache`, so a broken answer is
+            asked again on the next run.
         kwargs: forwarded to chat.completions.create (e.g. temperature).
 
     Returns:
         the model answer as a string.
     """
-    client = client or get_client()
-    response = client.chat.completions.create(
-        model=get_model_name(),
+    model = get_model_name()
+    key = LLMCache.key(model, messages, kwargs) if cache is not None else None
+    if cache is not None:
+        answer = cache.get(key)
+        if answer is not None and (usable is None or usable(answer)):
+            return answer
+
+    if client is not None:
+        create = client.chat.completions.create
+    else:
+        create = get_pool().create
+        kwargs = {**kwargs, "hedge": hedge}
+    response = create(
+        model=model,
         messages=messages,
         **kwargs,
     )
-    return response.choices[0].message.content
+    _count_usage(response)
+    answer = response.choices[0].message.content
+    if cache is not None and answer and (usable is None or usable(answer)):
+        cache.put(key, answer)
+    return answer
+
+
+def _count_usage(response):
+    usage = getattr(response, "usage", None)
+    with _usage_lock:
+        _usage["calls"] += 1
+        for name in ("prompt_tokens", "completion_tokens"):
+            tokens = getattr(usage, name, None)
+            if isinstance(tokens, int):
+                _usage[name] += tokens
+
+
+def token_usage() -> dict:
+    """Calls sent to the LLM by this process and the tokens they used (cached answers excluded)."""
+    with _usage_lock:
+        return dict(_usage)
 
 
 def parse_json_answer(raw: str) -> dict:
@@ -88,6 +690,48 @@ def parse_json_answer(raw: str) -> dict:
         return {}
 
 
-def ask_json(messages: list, client: OpenAI | None = None, **kwargs) -> dict:
-    """Convenience: ask() then parse_json_answer()."""
-    return parse_json_answer(ask(messages, client=client, **kwargs))
+def _is_json_answer(raw: str) -> bool:
+    # an answer worth keeping in the cache: a JSON object can be read from it
+    return bool(parse_json_answer(raw))
+
+
+def ask_json(
+    messages: list,
+    client: OpenAI | None = None,
+    cache: LLMCache | None = None,
+    hedge: bool = False,
+    schema: dict | None = None,
+    **kwargs,
+) -> dict:
+    """
+    Convenience: ask() then parse_json_answer().
+
+    With `schema` (a JSON schema of the expected object), the endpoint is asked
+    to only produce JSON of that shape. If it refuses it (a 400 / 422 about
+    `response_format`), the request is sent again without, and so are the
+    next ones; any other error is raised.
+    """
+    global _structured_output
+    if schema is not None and _structured_output:
+        response_format = {
+            "type": "json_schema",
+            "json_schema": {"name": "reponse", "schema": schema, "strict": True},
+        }
+        try:
+            return parse_json_answer(
+                ask(
+                    messages, client=client, cache=cache, hedge=hedge, usable=_is_json_answer,
+                    response_format=response_format, **kwargs,
+                )
+            )
+        except (openai.BadRequestError, openai.UnprocessableEntityError) as exc:
+            if not _SCHEMA_ERROR_RE.search(str(exc)):
+                raise
+            logger.warning(
+                f"sortie JSON contrainte refusee par l'endpoint ({exc.__class__.__name__}) : "
+                "JSON libre desormais"
+            )
+            _structured_output = False
+    return parse_json_answer(
+        ask(messages, client=client, cache=cache, hedge=hedge, usable=_is_json_answer, **kwargs)
+    )
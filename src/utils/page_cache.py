@@ -0,0 +1,148 @@
+"""
+On-disk cache of the article pages fetched by the completion step.
+
+One sqlite file keyed by the url asked for, holding the url reached after
+redirects, the HTTP status, the zlib-compressed page and its `ETag` /
+`Last-Modified` validators. A page younger than `ttl` is served without any
+request; an older one is revalidated (`If-None-Match` / `If-Modified-Since`,
+a 304 costs no body). The least recently used pages are dropped once the file
+holds more than `max_bytes` of pages. In `offline` mode nothing is fetched: the
+cached pages are used whatever their age.
+
+    cache = PageCache()
+    html = fetch_if_working(url, logger, cache=cache)
+"""
+
+import sqlite3
+import threading
+import time
+import zlib
+
+from src.utils.config import PAGE_CACHE_MAX_BYTES, PAGE_CACHE_PATH, PAGE_CACHE_TTL
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    final_url TEXT,
+    status INTEGER,
+    body BLOB,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL,
+    used_at REAL,
+    size INTEGER
+)
+"""
+
+
+class PageCache:
+    """
+    Pages cached on disk, shared by the threads of a run.
+
+    Args:
+        path (string): sqlite file of the cache.
+        ttl (float): seconds a page is used without asking the site again.
+        max_bytes (int): size of the compressed pages above which the least
+            recently used ones are dropped.
+        offline (bool): never fetch, only use the cached pages.
+    """
+
+    def __init__(
+        self, path=PAGE_CACHE_PATH, ttl=PAGE_CACHE_TTL, max_bytes=PAGE_CACHE_MAX_BYTES, offline=False
+    ):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+
+    def get(self, url):
+        """
+        The cached page of `url`, whatever its age, as a dict (`html`,
+        `final_url`, `status`, `etag`, `last_modified`, `fetched_at`), or None.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT final_url, status, body, etag, last_modified, fetched_at "
+                "FROM pages WHERE url = ?",
+                (url,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE pages SET used_at = ? WHERE url = ?", (time.time(), url))
+            self._db.commit()
+        final_url, status, body, etag, last_modified, fetched_at = row
+        return {
+            "html": zlib.decompress(body).decode("utf-8"),
+            "final_url": final_url,
+            "status": status,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": fetched_at,
+        }
+
+    def is_fresh(self, entry):
+        """True when `entry` (from `get`) can be used without asking the site."""
+        return self.offline or time.time() - entry["fetched_at"] < self.ttl
+
+    def has_fresh(self, url):
+        """True when the cached page of `url` can be used without a request."""
+        with self._lock:
+            row = self._db.execute("SELECT fetched_at FROM pages WHERE url = ?", (url,)).fetchone()
+        return row is not None and self.is_fresh({"fetched_at": row[0]})
+
+    @staticmethod
+    def validators(entry):
+        """Conditional request headers revalidating `entry`."""
+        headers = {}
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def put(self, url, resp, html):
+        """Store `html`, the page of a successful `requests` response to `url`."""
+        body = zlib.compress(html.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    resp.url,
+                    resp.status_code,
+                    body,
+                    resp.headers.get("ETag"),
+                    resp.headers.get("Last-Modified"),
+                    now,
+                    now,
+                    len(body),
+                ),
+            )
+            self._evict()
+            self._db.commit()
+
+    def refresh(self, url):
+        """The site answered 304 Not Modified: the page is fresh again."""
+        with self._lock:
+            self._db.execute("UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), url))
+            self._db.commit()
+
+    def _evict(self):
+        # Drop the least recently used pages until the cache fits in max_bytes
+        (total,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()
+        if total <= self.max_bytes:
+            return
+        for url, size in self._db.execute(
+            "SELECT url, size FROM pages ORDER BY used_at"
+        ).fetchall():
+            self._db.execute("DELETE FROM pages WHERE url = ?", (url,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,198 @@
+"""
+Run items through a chain of blocking stages, each with its own concurrency.
+
+The stages are connected by bounded queues: a stage that is ahead waits for
+room in the queue of the next one (back-pressure), so a fast stage never piles
+up work (and memory) in front of a saturated one. The blocking stage functions
+run in threads driven by an asyncio event loop.
+
+When the run stops early (error, Ctrl+C), the items the previous stages already
+finished still go through the last stage (typically the one writing the
+results), so no finished work is lost; the others are dropped.
+
+    stages = [Stage("fetch", fetch, workers=4), Stage("llm", ask, workers=2)]
+    run_pipeline(rows, stages, on_error=record_error)
+    for line in stage_summary(stages):
+        logger.info(line)
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_DONE = object()  # end-of-stream marker, one per worker of the next stage
+
+
+class Stage:
+    """
+    A step of the pipeline: `func(item) -> item`, run by `workers` threads.
+
+    Its input queue holds at most `queue_size` items (default: `workers`). The
+    counters filled during the run feed `stage_summary`.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue_size = queue_size or self.workers
+        self.items = 0
+        self.busy = 0.0  # seconds spent in func, summed over the workers
+        self.elapsed = 0.0  # wall time of the run
+        self.depth_max = 0
+        self.depth_sum = 0
+
+    def utilisation(self):
+        """Share of the run time the workers of the stage spent working."""
+        if not self.elapsed:
+            return 0.0
+        return self.busy / (self.elapsed * self.workers)
+
+    def mean_depth(self):
+        """Mean length of the input queue, sampled each time an item is taken."""
+        return self.depth_sum / self.items if self.items else 0.0
+
+
+async def _work(stage, inbox, outbox, on_error, executor, stranded):
+    # `stranded` gets the (future, item) of the calls interrupted by a stop
+    while True:
+        item = await inbox.get()
+        if item is _DONE:
+            return
+        depth = inbox.qsize()
+        stage.depth_max = max(stage.depth_max, depth)
+        stage.depth_sum += depth
+        start = time.perf_counter()
+        future = executor.submit(stage.func, item)
+        try:
+            item = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            stranded.append((stage, future, item))
+            raise
+        except Exception as exc:
+            item = on_error(item, stage, exc)
+        stage.busy += time.perf_counter() - start
+        stage.items += 1
+        if outbox is not None:
+            try:
+                await outbox.put(item)
+            except asyncio.CancelledError:
+                stranded.append((stage, None, item))
+                raise
+
+
+def _finish(stages, inbox, stranded, on_error):
+    # After an early stop, once the running calls are over: run the items the
+    # stage before the last one finished through the last one, in this thread
+    last = stages[-1]
+    items = [item for item in _drain(inbox) if item is not _DONE]
+    for stage, future, item in stranded:
+        if stage is last:
+            if future.cancelled():  # taken from the queue, never started
+                items.append(item)
+        elif stage is stages[-2] and future is None:  # finished, waiting for room
+            items.append(item)
+        elif stage is stages[-2] and not future.cancelled():
+            exc = future.exception()
+            items.append(future.result() if exc is None else on_error(item, stage, exc))
+    for item in items:
+        try:
+            last.func(item)
+        except Exception as exc:
+            on_error(item, last, exc)
+        last.items += 1
+
+
+def _drain(queue):
+    while not queue.empty():
+        yield queue.get_nowait()
+
+
+async def _run(items, stages, on_error):
+    executor = ThreadPoolExecutor(max_workers=sum(stage.workers for stage in stages))
+    stranded = []
+    queues = [asyncio.Queue(maxsize=stage.queue_size) for stage in stages]
+    start = time.perf_counter()
+
+    async def feed():
+        for item in items:
+            await queues[0].put(item)
+        for _ in range(stages[0].workers):
+            await queues[0].put(_DONE)
+
+    async def run_stage(i, stage):
+        outbox = queues[i + 1] if i + 1 < len(stages) else None
+        await asyncio.gather(
+            *(
+                _work(stage, queues[i], outbox, on_error, executor, stranded)
+                for _ in range(stage.workers)
+            )
+        )
+        stage.elapsed = time.perf_counter() - start
+        if outbox is not None:
+            for _ in range(stages[i + 1].workers):
+                await outbox.put(_DONE)
+
+    tasks = [
+        asyncio.ensure_future(feed()),
+        *(asyncio.ensure_future(run_stage(i, stage)) for i, stage in enumerate(stages)),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # On error / Ctrl+C, stop every worker and do not start the items still
+        # queued, but wait for those running: the caller may then flush or
+        # close what they use
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        executor.shutdown(wait=True, cancel_futures=True)
+        if len(stages) > 1:
+            _finish(stages, queues[-1], stranded, on_error)
+
+
+def run_pipeline(items, stages, on_error=None):
+    """
+    Send every item of `items` through `stages`, in order.
+
+    Items come out of a stage in the order they finish, not in input order: the
+    last stage is where results are collected (e.g. written or stored by index).
+
+    Args:
+        items: iterable of items, read lazily as the first stage has room.
+        stages (list of Stage): the chain; each `func` gets the item returned by
+            the previous stage.
+        on_error (callable, optional): `on_error(item, stage, exc) -> item`,
+            called when a stage function raises; what it returns goes on to the
+            next stage. Without it, the exception stops the run.
+
+    When the run stops early (error, Ctrl+C), the items already in a stage
+    function are finished before `run_pipeline` returns or raises, and those
+    done with the stage before the last one still go through the last one.
+
+    Example:
+        >>> stages = [Stage("double", lambda x: 2 * x, workers=2), Stage("collect", print)]
+        >>> run_pipeline([1], stages)
+        2
+        >>> stages[0].items
+        1
+    """
+    if on_error is None:
+        def on_error(item, stage, exc):
+            raise exc
+    asyncio.run(_run(items, stages, on_error))
+
+
+def stage_summary(stages):
+    """
+    One line per stage: workers, items, utilisation and input queue depth.
+
+    The stage with the highest utilisation and a full input queue is the
+    bottleneck; a stage with low utilisation is starved by the one before it.
+    """
+    return [
+        f"etape {stage.name:<8} {stage.workers} workers, {stage.items} lignes, "
+        f"occupation {stage.utilisation():.0%}, file d'attente "
+        f"moy. {stage.mean_depth():.1f} / max {stage.depth_max} (capacite {stage.queue_size})"
+        for stage in stages
+    ]
@@ -17,10 +17,51 @@ import argparse
 # --------------------------------------------------------------------------- #
 # Shared argument helpers (keep the subcommands from drifting apart)
 # --------------------------------------------------------------------------- #
+def _positive_float(value):
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be > 0, got {value}")
+    return number
+
+
 def _add_file_arg(parser):
     parser.add_argument(
         "-f", "--file", default="export.json",
-        help="Tchap json export to read (default: export.json).",
+        help="Tchap json export to read, or a directory / glob pattern of several "
+        "exports (default: export.json).",
+    )
+
+
+def _add_extract_args(parser):
+    parser.add_argument(
+        "--batch-size", type=int, default=None, metavar="N",
+        help="Stream the export N messages at a time instead of loading it at "
+        "once (constant memory for big exports; same result).",
+    )
+    parser.add_argument(
+        "--all-links", action="store_true",
+        help="Keep every external link of a message, not only the first one.",
+    )
+    rescan = parser.add_mutually_exclusive_group()
+    rescan.add_argument(
+        "--since", default=None, metavar="DATE",
+        help="Read the messages from DATE on (YYYY-MM-DD or 'YYYY-MM-DD HH:MM', "
+        "Paris time) instead of those after the last run.",
+    )
+    rescan.add_argument(
+        "--full", action="store_true",
+        help="Read the whole export again instead of only the messages after the "
+        "last run.",
+    )
+
+
+def _add_parse_workers_arg(parser):
+    parser.add_argument(
+        "--parse-workers", type=int, default=None, metavar="N",
+        help="Number of processes parsing the html: the Tchap exports when -f "
+        "matches several files (default: one per core), the html links of a "
+        "single export, the article pages of the completion step (default: none, "
+        "parsed in threads).",
     )
 
 
@@ -45,6 +86,57 @@ def _add_complete_args(parser):
         "--n-examples", type=int, default=15,
         help="Number of example category assignments sent to the LLM (default: 15).",
     )
+    parser.add_argument(
+        "--workers", type=int, default=1, metavar="N",
+        help="Number of rows handled at the same time by each stage (page fetch, "
+        "text extraction, LLM call); default: 1.",
+    )
+    parser.add_argument(
+        "--fetch-workers", type=int, default=None, metavar="N",
+        help="Number of pages fetched at the same time (default: --workers).",
+    )
+    parser.add_argument(
+        "--llm-workers", type=int, default=None, metavar="N",
+        help="Number of LLM calls at the same time (default: --workers).",
+    )
+    parser.add_argument(
+        "--per-host", type=int, default=2, metavar="N",
+        help="Number of page requests in flight to one site (default: 2).",
+    )
+    parser.add_argument(
+        "--host-rate", type=_positive_float, default=1.0, metavar="R",
+        help="Page requests per second to one site (default: 1).",
+    )
+    parser.add_argument(
+        "--no-page-cache", action="store_true",
+        help="Download every article page again instead of reusing the pages "
+        "kept on disk by the previous runs.",
+    )
+    parser.add_argument(
+        "--offline", action="store_true",
+        help="Never download a page: only use those kept on disk by the previous "
+        "runs.",
+    )
+    parser.add_argument(
+        "--no-link-health", action="store_true",
+        help="Try every link again, even those found dead (4xx/5xx, unknown "
+        "domain, certificate, timeout) by the previous runs.",
+    )
+    parser.add_argument(
+        "--main-content", action="store_true",
+        help="Send only the article body of each page to the LLM (menus, cookie "
+        "banners, footers dropped) instead of the start of the whole page text.",
+    )
+    parser.add_argument(
+        "--hedge-llm", action="store_true",
+        help="Send an LLM call a second time when it is slower than 90%% of the "
+        "recent ones; the first answer wins (at most 10%% more calls).",
+    )
+    parser.add_argument(
+        "--no-llm-cache", action="store_true",
+        help="Call the LLM for every row instead of reusing the answers kept on "
+        "disk for the same request (e.g. by a previous --dry-run).",
+    )
 
 
 def _add_output_arg(parser):
@@ -61,7 +153,15 @@ def cmd_extract(args):
     """Extract links from a Tchap export and add new rows to the Grist table."""
     from src.extract import extract_and_add_to_veille
 
-    extract_and_add_to_veille(input_conv_file_path=args.file, target_table=args.table)
+    extract_and_add_to_veille(
+        input_conv_file_path=args.file,
+        target_table=args.table,
+        batch_size=args.batch_size,
+        all_links=args.all_links,
+        since=args.since,
+        full=args.full,
+        max_workers=args.parse_workers,
+    )
 
 
 def cmd_complete(args):
@@ -73,6 +173,18 @@ def cmd_complete(args):
         limit=args.limit,
         dry_run=args.dry_run,
         n_examples=args.n_examples,
+        workers=args.workers,
+        fetch_workers=args.fetch_workers,
+        llm_workers=args.llm_workers,
+        page_cache=not args.no_page_cache,
+        offline=args.offline,
+        llm_cache=not args.no_llm_cache,
+        main_content=args.main_content,
+        parse_workers=args.parse_workers,
+        per_host=args.per_host,
+        host_rate=args.host_rate,
+        link_health=not args.no_link_health,
+        hedge_llm=args.hedge_llm,
     )
 
 
@@ -81,12 +193,32 @@ def cmd_extract_and_complete(args):
     from src.extract import extract_and_add_to_veille
     from src.complete_table import complete_veille
 
-    extract_and_add_to_veille(input_conv_file_path=args.file, target_table=args.table)
+    extract_and_add_to_veille(
+        input_conv_file_path=args.file,
+        target_table=args.table,
+        batch_size=args.batch_size,
+        all_links=args.all_links,
+        since=args.since,
+        full=args.full,
+        max_workers=args.parse_workers,
+    )
     complete_veille(
         table_id=args.table,
         limit=args.limit,
         dry_run=args.dry_run,
         n_examples=args.n_examples,
+        workers=args.workers,
+        fetch_workers=args.fetch_workers,
+        llm_workers=args.llm_workers,
+        page_cache=not args.no_page_cache,
+        offline=args.offline,
+        llm_cache=not args.no_llm_cache,
+        main_content=args.main_content,
+        parse_workers=args.parse_workers,
+        per_host=args.per_host,
+        host_rate=args.host_rate,
+        link_health=not args.no_link_health,
+        hedge_llm=args.hedge_llm,
     )
 
 
@@ -111,6 +243,8 @@ def build_parser() -> argparse.ArgumentParser:
         "extract", help="Extract links from a Tchap export and add them to Grist."
     )
     _add_file_arg(pe)
+    _add_extract_args(pe)
+    _add_parse_workers_arg(pe)
     _add_table_arg(pe)
     pe.set_defaults(func=cmd_extract)
 
@@ -118,6 +252,7 @@ def build_parser() -> argparse.ArgumentParser:
     pc = sub.add_parser("complete", help="Complete existing Grist rows with an LLM.")
     _add_table_arg(pc)
     _add_complete_args(pc)
+    _add_parse_workers_arg(pc)
     pc.set_defaults(func=cmd_complete)
 
     # ----- extract-and-complete -----
@@ -129,6 +264,8 @@ def build_parser() -> argparse.ArgumentParser:
         "completion step.",
     )
     _add_file_arg(pa)
+    _add_extract_args(pa)
+    _add_parse_workers_arg(pa)
     _add_table_arg(pa)
     _add_complete_args(pa)
 